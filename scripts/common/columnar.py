@@ -0,0 +1,454 @@
+"""
+Columnar storage for per-metric intermediates.
+
+Scripts keep referring to intermediates by their CSV name
+(data/intermediate/wallet_ages.csv); with pyarrow installed the data lives
+next to it in a Parquet dataset directory (wallet_ages.parquet/). Each flush
+appends one part file instead of rewriting the whole output, readers only
+decode the columns they ask for, and numbers stay typed instead of being
+re-parsed from text. compact() folds the parts into a single file sorted by
+wallet_id at the end of a run, ready for a streaming merge join.
+
+Rows with a wallet column also get a wallet_id from the shared wallet
+dictionary, so consumers can join on read_keyed() ids instead of strings.
+
+Without pyarrow everything falls back to plain CSV with the same calls.
+An existing CSV is migrated into the dataset the first time it's appended to.
+"""
+import glob
+import os
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+
+import numpy as np
+import pandas as pd
+
+from wallet_ids import get_dictionary
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAVE_ARROW = True
+except ImportError:
+    HAVE_ARROW = False
+
+_locks = {}
+_locks_guard = Lock()
+
+SORTED_KEY = b"orbt.sorted_by"
+ROW_GROUP_ROWS = 100000
+SORT_RUN_ROWS = 1000000 # Rows sorted in memory at once by sort_by_wallet_id (one run)
+SORT_WORKERS = 2 # Datasets sorted at the same time by sort_all; peak memory is about this many runs
+
+def dataset_path(path):
+    """data/intermediate/foo.csv -> data/intermediate/foo.parquet"""
+    return os.path.splitext(path)[0] + ".parquet"
+
+def _write_lock(path):
+    """Per-dataset lock, so different intermediates can be written or sorted concurrently."""
+    with _locks_guard:
+        return _locks.setdefault(dataset_path(path), Lock())
+
+def _parts(path):
+    return sorted(glob.glob(os.path.join(dataset_path(path), "part-*.parquet")))
+
+def _restore_swapped(path):
+    """Put back the previous contents if write_table died between moving them aside and swapping in."""
+    directory = dataset_path(path)
+    if os.path.isdir(directory) or not os.path.isdir(directory + ".old"):
+        return
+    lock = _write_lock(path)
+    if lock.acquire(blocking=False):  # held: a write_table is mid-swap right now
+        try:
+            if not os.path.isdir(directory) and os.path.isdir(directory + ".old"):
+                os.rename(directory + ".old", directory)
+        finally:
+            lock.release()
+
+def _use_dataset(path):
+    if not HAVE_ARROW:
+        return False
+    _restore_swapped(path)
+    return os.path.isdir(dataset_path(path))
+
+def exists(path):
+    return _use_dataset(path) or os.path.exists(path)
+
+def storage_files(path):
+    """The files currently holding an intermediate's rows (its Parquet parts, or the CSV)."""
+    if _use_dataset(path):
+        return _parts(path)
+    return [path] if os.path.exists(path) else []
+
+def row_count(path):
+    """Rows in an intermediate, from the Parquet footers or by counting CSV lines."""
+    if _use_dataset(path):
+        return sum(pq.read_metadata(p).num_rows for p in _parts(path))
+    if not os.path.exists(path):
+        return 0
+    lines, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    lines += last != b"\n"  # final line without a newline
+    return max(lines - 1, 0)  # header
+
+def column_names(path):
+    """Column names of an intermediate (across all parts), without reading any rows."""
+    if _use_dataset(path):
+        names = {}
+        for p in _parts(path):
+            names.update(dict.fromkeys(pq.read_schema(p).names))
+        return list(names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def _write_part(path, df):
+    directory = dataset_path(path)
+    os.makedirs(directory, exist_ok=True)
+    parts = _parts(path)
+    index = int(os.path.basename(parts[-1])[5:-8]) + 1 if parts else 0
+    final = os.path.join(directory, f"part-{index:06d}.parquet")
+    tmp = os.path.join(directory, f".part-{index:06d}.tmp")  # dot-files are ignored by readers
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp)
+    os.replace(tmp, final)
+
+def _migrate(path):
+    """Move a legacy CSV's rows into the dataset (once; call with _write_lock(path) held)."""
+    if not os.path.isdir(dataset_path(path)) and os.path.exists(path):
+        print(f"🔧 Migrating {path} to {dataset_path(path)} (one-time)...")
+        _write_part(path, pd.read_csv(path))
+
+def _layout(existing, df):
+    """Existing column order; wallet_id is added to files written before it existed."""
+    existing = list(existing)
+    if 'wallet_id' in df.columns and 'wallet_id' not in existing:
+        existing.append('wallet_id')
+    return existing
+
+def append_rows(path, rows):
+    """Append rows (DataFrame or list of dicts), keeping the existing column layout."""
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+    if df.empty:
+        return
+    if 'wallet' in df.columns and 'wallet_id' not in df.columns:
+        df = df.assign(wallet_id=get_dictionary().intern(df['wallet'].tolist()))
+    with _write_lock(path):
+        if not HAVE_ARROW:
+            if os.path.exists(path):
+                # A CSV header can't grow, so ids are only stored in files that started with them
+                df = df.reindex(columns=pd.read_csv(path, nrows=0).columns)
+                df.to_csv(path, mode='a', header=False, index=False)
+            else:
+                df.to_csv(path, index=False)
+            return
+
+        _migrate(path)
+        if _parts(path):
+            df = df.reindex(columns=_layout(column_names(path), df))
+        _write_part(path, df)
+
+def _cast(df, dtypes):
+    """Apply declared dtypes to whichever of their columns df has."""
+    if not dtypes:
+        return df
+    return df.astype({c: t for c, t in dtypes.items() if c in df.columns})
+
+def read_table(path, columns=None, dtypes=None):
+    """
+    Load an intermediate as a DataFrame, optionally only some columns.
+    `dtypes` ({column: dtype}) declares compact types up front, e.g. float32 / 'Int32' / 'category'.
+    """
+    if not _use_dataset(path):
+        if dtypes and columns is not None:
+            dtypes = {c: t for c, t in dtypes.items() if c in columns}
+        return pd.read_csv(path, usecols=columns, dtype=dtypes)
+    tables = []
+    for p in _parts(path):
+        # Older parts may lack newer columns (e.g. wallet_id); those come back null
+        names = pq.read_schema(p).names
+        tables.append(pq.read_table(p, columns=None if columns is None else [c for c in columns if c in names]))
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    # Parts written from different batches may disagree on e.g. int vs float
+    df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+    return _cast(df if columns is None else df.reindex(columns=columns), dtypes)
+
+def iter_table(path, columns=None, dtypes=None, batch_rows=ROW_GROUP_ROWS):
+    """Like read_table, but yields the rows in batches instead of loading them all."""
+    if not _use_dataset(path):
+        if dtypes and columns is not None:
+            dtypes = {c: t for c, t in dtypes.items() if c in columns}
+        yield from pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=batch_rows)
+        return
+    for p in _parts(path):
+        part = pq.ParquetFile(p)
+        names = part.schema_arrow.names
+        wanted = None if columns is None else [c for c in columns if c in names]
+        for batch in part.iter_batches(batch_size=batch_rows, columns=wanted):
+            df = batch.to_pandas()
+            yield _cast(df if columns is None else df.reindex(columns=columns), dtypes)
+
+def read_keyed(path, columns, dtypes=None):
+    """
+    Load `columns` plus an int32 wallet_id, without decoding wallet strings when
+    every row already has an id (rows written before ids existed are interned).
+    Rows with an invalid address are dropped.
+    """
+    available = set(column_names(path))
+    wanted = [c for c in columns if c not in ('wallet', 'wallet_id')]
+    df = None
+    if 'wallet_id' in available:
+        df = read_table(path, columns=['wallet_id'] + wanted, dtypes=dtypes)
+        if df['wallet_id'].isna().any():
+            df = None
+    if df is None:
+        df = read_table(path, columns=['wallet'] + wanted, dtypes=dtypes)
+        df['wallet_id'] = get_dictionary().intern(df['wallet'].tolist())
+        df = df.drop(columns=['wallet'])
+    df = df[df['wallet_id'] >= 0]
+    return df.astype({'wallet_id': 'int32'})
+
+def write_table(path, df):
+    """Replace an intermediate's contents."""
+    if not HAVE_ARROW:
+        df.to_csv(path, index=False)
+        return
+    with _write_lock(path):
+        directory = dataset_path(path)
+        tmp = directory + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(tmp, "part-000000.parquet"))
+        # Move the old contents aside, swap the new ones in, then delete the old: a crash
+        # leaves either version in place (_restore_swapped), never an empty dataset
+        old = directory + ".old"
+        if not os.path.isdir(directory) and os.path.isdir(old):
+            os.rename(old, directory)  # an earlier swap died halfway
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.isdir(directory):
+            os.rename(directory, old)
+        os.rename(tmp, directory)
+        shutil.rmtree(old, ignore_errors=True)
+
+def _conform(table, schema):
+    """Reorder / null-fill / cast a part to the unified schema (older parts may lack wallet_id)."""
+    arrays = [
+        table.column(f.name).cast(f.type) if f.name in table.column_names else pa.nulls(len(table), f.type)
+        for f in schema
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def _swap_in(path, parts, tmp):
+    """Make the file at `tmp` the dataset's only part, replacing `parts`."""
+    # The new part sorts after every part it replaces, so a crash
+    # between these steps can only leave duplicates, never lose rows.
+    index = int(os.path.basename(parts[-1])[5:-8]) + 1
+    os.replace(tmp, os.path.join(dataset_path(path), f"part-{index:06d}.parquet"))
+    for p in parts:
+        os.remove(p)
+
+def compact(path):
+    """
+    Fold all parts into one file. Wallet-keyed data is also sorted by
+    wallet_id (see sort_by_wallet_id); anything else keeps one row group
+    per original part.
+    """
+    if not _use_dataset(path):
+        return
+    if 'wallet' in column_names(path):
+        sort_by_wallet_id(path)
+        return
+    with _write_lock(path):
+        parts = _parts(path)
+        if len(parts) <= 1:
+            return
+        tables = [pq.read_table(p) for p in parts]
+        schema = pa.unify_schemas([t.schema for t in tables], promote_options="permissive")
+        tmp = os.path.join(dataset_path(path), ".compact.tmp")
+        with pq.ParquetWriter(tmp, schema) as writer:
+            for table in tables:
+                writer.write_table(_conform(table, schema))
+        _swap_in(path, parts, tmp)
+
+def is_sorted(path):
+    """True if the dataset is a single part written by sort_by_wallet_id()."""
+    if not _use_dataset(path):
+        return False
+    parts = _parts(path)
+    return len(parts) == 1 and (pq.read_schema(parts[0]).metadata or {}).get(SORTED_KEY) == b"wallet_id"
+
+def _sort_schema(parts):
+    """Unified schema of the parts, with wallet_id as int32 and the sorted marker."""
+    schema = pa.unify_schemas([pq.read_schema(p) for p in parts], promote_options="permissive")
+    field = pa.field('wallet_id', pa.int32())
+    if 'wallet_id' in schema.names:
+        schema = schema.set(schema.get_field_index('wallet_id'), field)
+    else:
+        schema = schema.append(field)
+    return schema.with_metadata({**(schema.metadata or {}), SORTED_KEY: b"wallet_id"})
+
+def _sorted_run(table, schema):
+    """One chunk of the dataset with wallet_ids filled in, sorted by id (stable), invalid addresses dropped."""
+    if 'wallet_id' in table.column_names and table.column('wallet_id').null_count == 0:
+        ids = table.column('wallet_id').to_numpy().astype(np.int32)
+    else:
+        ids = get_dictionary().intern(table.column('wallet').to_pylist())
+    table = table.drop_columns(['wallet_id']) if 'wallet_id' in table.column_names else table
+    table = _conform(table.append_column('wallet_id', pa.array(ids, type=pa.int32())), schema)
+    order = np.argsort(ids, kind='stable')
+    return table.take(pa.array(order[ids[order] >= 0]))
+
+def _first_per_id(table):
+    """Keep the first row of every wallet_id in an id-sorted table."""
+    ids = table.column('wallet_id').to_numpy()
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    return table.filter(pa.array(first))
+
+def _merge_runs(runs, schema, out, batch_rows=ROW_GROUP_ROWS):
+    """
+    k-way merge of id-sorted run files into `out`, holding about one batch per
+    run in memory. Rows are emitted up to the smallest id that every unfinished
+    run has buffered past, so all copies of an id are emitted together, in run
+    (append) order, and the first one wins.
+    """
+    readers = [pq.ParquetFile(r).iter_batches(batch_size=batch_rows) for r in runs]
+    buffers = [pa.Table.from_batches([], schema=schema)] * len(runs)
+    more = [True] * len(runs)
+
+    def refill(r):
+        batch = next(readers[r], None)
+        if batch is None:
+            more[r] = False
+        else:
+            buffers[r] = pa.concat_tables([buffers[r], pa.Table.from_batches([batch])])
+
+    for r in range(len(runs)):
+        refill(r)
+    with pq.ParquetWriter(out, schema) as writer:
+        while any(len(b) for b in buffers) or any(more):
+            open_runs = [r for r in range(len(runs)) if more[r]]
+            # An empty buffer of an unfinished run can't bound anything yet
+            empty = [r for r in open_runs if not len(buffers[r])]
+            if empty:
+                for r in empty:
+                    refill(r)
+                continue
+            bound = min((int(buffers[r].column('wallet_id')[-1].as_py()) for r in open_runs), default=None)
+            pieces = []
+            for r, buffer in enumerate(buffers):
+                ids = buffer.column('wallet_id').to_numpy()
+                take = len(ids) if bound is None else int(np.searchsorted(ids, bound, side='left'))
+                pieces.append(buffer.slice(0, take))
+                buffers[r] = buffer.slice(take)
+            chunk = pa.concat_tables(pieces)
+            if len(chunk):
+                ids = chunk.column('wallet_id').to_numpy()
+                writer.write_table(_first_per_id(chunk.take(pa.array(np.argsort(ids, kind='stable')))), row_group_size=batch_rows)
+            # Runs whose buffer holds only the bound id need their next batch to see where that id ends
+            for r in open_runs:
+                if int(buffers[r].column('wallet_id')[-1].as_py()) == bound:
+                    refill(r)
+
+def sort_by_wallet_id(path, run_rows=SORT_RUN_ROWS):
+    """
+    Rewrite the dataset as one part in ascending wallet_id order with one row
+    per wallet (the first one appended wins), so it can be stream-joined.
+    A no-op if nothing was appended since the last sort.
+
+    External sort: parts are read `run_rows` rows at a time, each chunk is
+    sorted into a run file, and the runs are k-way merged, so memory stays
+    bounded by the chunk size rather than the dataset size.
+    """
+    if not _use_dataset(path) or is_sorted(path):
+        return
+    with _write_lock(path):
+        parts = _parts(path)
+        if not parts:
+            return
+        schema = _sort_schema(parts)
+        runs_dir = os.path.join(dataset_path(path), ".sort-runs")  # dot-dirs are ignored by readers
+        shutil.rmtree(runs_dir, ignore_errors=True)
+        os.makedirs(runs_dir)
+        try:
+            runs = []
+            for p in parts:
+                for batch in pq.ParquetFile(p).iter_batches(batch_size=run_rows):
+                    run = os.path.join(runs_dir, f"run-{len(runs):06d}.parquet")
+                    pq.write_table(_sorted_run(pa.Table.from_batches([batch]), schema), run)
+                    runs.append(run)
+            tmp = os.path.join(dataset_path(path), ".sort.tmp")
+            _merge_runs(runs, schema, tmp)
+            _swap_in(path, parts, tmp)
+        finally:
+            shutil.rmtree(runs_dir, ignore_errors=True)
+
+def _prepare_sorted(path):
+    """Migrate a legacy CSV and sort the dataset by wallet_id, if not done yet."""
+    with _write_lock(path):
+        _migrate(path)
+    sort_by_wallet_id(path)
+
+def iter_sorted(path, columns, batch_rows=ROW_GROUP_ROWS, dtypes=None):
+    """
+    Yield DataFrames of wallet_id + `columns` in ascending, unique wallet_id
+    order, one batch at a time, cast to `dtypes`. Sorts the dataset first if needed.
+    """
+    if not exists(path):
+        return
+    if not HAVE_ARROW:
+        df = read_keyed(path, columns, dtypes).drop_duplicates(subset=['wallet_id']).sort_values('wallet_id', kind='stable')
+        for i in range(0, len(df), batch_rows):
+            yield df.iloc[i:i + batch_rows]
+        return
+    _prepare_sorted(path)
+    parts = _parts(path)
+    if not parts:
+        return
+    part = pq.ParquetFile(parts[0])
+    names = part.schema_arrow.names
+    for batch in part.iter_batches(batch_size=batch_rows, columns=['wallet_id'] + [c for c in columns if c in names]):
+        yield _cast(batch.to_pandas().reindex(columns=['wallet_id'] + list(columns)), dtypes)
+
+def sort_all(paths, workers=None):
+    """Run any pending migrate/sort for several intermediates, at most `workers` (SORT_WORKERS) at a time."""
+    paths = [path for path in paths if exists(path)]
+    if HAVE_ARROW and paths:
+        with ThreadPoolExecutor(max_workers=min(workers or SORT_WORKERS, len(paths))) as pool:
+            list(pool.map(_prepare_sorted, paths))
+
+def _prefetch(batches, depth=2):
+    """Run a batch generator on a background thread, up to `depth` batches ahead of the consumer."""
+    buffer = queue.Queue(maxsize=depth)
+    end = object()
+
+    def produce():
+        try:
+            for batch in batches:
+                buffer.put(batch)
+            buffer.put(end)
+        except Exception as e:
+            buffer.put(e)
+
+    Thread(target=produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is end:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def open_sorted(sources, dtypes=None, workers=None, batch_rows=ROW_GROUP_ROWS):
+    """
+    Open several intermediates for merge_join at once.
+
+    sources: list of (path, columns). Any pending migrate/sort runs for all of
+    them in parallel, then each source decodes and casts its batches on its own
+    thread while the join consumes them. Returns [(batches, columns)].
+    """
+    sort_all([path for path, _ in sources], workers)
+    return [(_prefetch(iter_sorted(path, columns, batch_rows, dtypes)), columns) for path, columns in sources]
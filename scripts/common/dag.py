@@ -0,0 +1,113 @@
+"""
+Dependency-driven stage scheduler with per-API concurrency budgets.
+
+Each Stage names the stages it depends on and, optionally, the API it
+calls and how much of that API's budget it uses (e.g. its worker count).
+run_dag() starts every stage as soon as its dependencies have finished and
+its API has room, so independent fetchers overlap while the total load on
+any one API stays within budget. A stage larger than its budget still runs,
+alone. When a stage fails, everything downstream of it is skipped; stages
+that don't depend on it carry on.
+
+Stages that declare inputs or code are memoized when run_dag gets a
+ManifestStore (see manifest.py): if nothing they depend on changed since
+their last successful run, they are skipped and their outputs reused.
+"""
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+class Stage:
+    def __init__(self, name, run, deps=(), api=None, cost=1, inputs=(), outputs=(), code=(), params=None):
+        self.name = name
+        self.run = run  # callable; raising marks the stage failed
+        self.deps = tuple(deps)
+        self.api = api
+        self.cost = cost
+        # Memoization: files read, files written, source files, and anything else the result depends on
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.code = tuple(code)
+        self.params = params
+
+    @property
+    def memoized(self):
+        return bool(self.inputs or self.code)
+
+def _execute(stage, manifests, force):
+    """Run a stage, or skip it if its manifest still matches. Returns True if skipped."""
+    if manifests is None or not stage.memoized:
+        stage.run()
+        return False
+    digest, files = manifests.fingerprint(stage.name, stage.inputs, stage.code, stage.params)
+    if not force and manifests.is_fresh(stage.name, digest, stage.outputs):
+        return True
+    stage.run()
+    manifests.record(stage.name, digest, files)
+    return False
+
+def _check(stages):
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate stage names")
+    for s in stages:
+        unknown = [d for d in s.deps if d not in names]
+        if unknown:
+            raise ValueError(f"Stage {s.name} depends on unknown stage(s) {unknown}")
+
+def run_dag(stages, budgets=None, manifests=None, force=False):
+    """
+    Run `stages` (list of Stage) respecting dependencies and `budgets`
+    ({api: max total cost in flight}). With `manifests`, unchanged memoized
+    stages are skipped unless `force`. Returns the names of the stages
+    that failed or were skipped because a dependency failed.
+    """
+    _check(stages)
+    budgets = budgets or {}
+    pending = list(stages)
+    running = {}  # future -> (stage, start time)
+    in_use = defaultdict(int)
+    done, failed = set(), []
+
+    def fits(stage):
+        if stage.api is None or in_use[stage.api] == 0:
+            return True
+        return in_use[stage.api] + stage.cost <= budgets.get(stage.api, float("inf"))
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as pool:
+        while pending or running:
+            blocked = [s for s in pending if any(d in failed for d in s.deps)]
+            while blocked:  # skip the whole downstream chain, not just direct dependents
+                for stage in blocked:
+                    pending.remove(stage)
+                    failed.append(stage.name)
+                    print(f"⏭️  Skipping {stage.name} (a dependency failed)")
+                blocked = [s for s in pending if any(d in failed for d in s.deps)]
+
+            for stage in list(pending):
+                if all(d in done for d in stage.deps) and fits(stage):
+                    pending.remove(stage)
+                    in_use[stage.api] += stage.cost
+                    print(f"\n🚀 Starting {stage.name}...")
+                    running[pool.submit(_execute, stage, manifests, force)] = (stage, time.time())
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle among {[s.name for s in pending]}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, started = running.pop(future)
+                in_use[stage.api] -= stage.cost
+                try:
+                    skipped = future.result()
+                    done.add(stage.name)
+                    if skipped:
+                        print(f"⏩ {stage.name} unchanged since its last run, reusing its outputs.")
+                    else:
+                        print(f"✅ {stage.name} completed in {time.time() - started:.0f}s.")
+                except Exception as e:
+                    failed.append(stage.name)
+                    print(f"❌ {stage.name} failed: {e}")
+    return failed
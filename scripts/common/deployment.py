@@ -0,0 +1,80 @@
+"""
+Contract deployment block discovery.
+
+Binary-searches eth_getCode over block heights for the first block where the
+contract has code, so log scans can start exactly at deployment instead of
+walking empty windows from genesis. Needs an archive-capable RPC; the result
+never changes, so it is cached per address in data/state/.
+"""
+import json
+import os
+import time
+
+import requests
+
+from http_client import get_session
+from rate_control import backoff_delay
+
+CACHE_FILE = "data/state/deployment_blocks.json"
+
+def rpc_call(rpc_url, method, params, timeout=15, retries=3):
+    """One JSON-RPC call over the shared session; HTTP and RPC errors are retried with jittered backoff, then raised."""
+    payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+    last_error = None
+    for attempt in range(retries):
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1))
+        try:
+            resp = get_session().post(rpc_url, json=payload, headers={"Content-Type": "application/json"}, timeout=timeout)
+            resp.raise_for_status()
+            data = resp.json()
+        except (requests.RequestException, ValueError) as e:
+            last_error = e
+            continue
+        if 'error' in data:
+            last_error = data['error']
+            continue
+        return data['result']
+    raise RuntimeError(f"{method} failed after {retries} attempts: {last_error}")
+
+def has_code(rpc_url, address, block):
+    return rpc_call(rpc_url, "eth_getCode", [address, hex(block)]) not in ("0x", "", None)
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _save_cache(cache, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def find_deployment_block(rpc_url, address, latest=None, cache_file=CACHE_FILE):
+    """First block at which `address` has code (cached after the first lookup)."""
+    key = address.lower()
+    cache = _load_cache(cache_file)
+    if key in cache:
+        return cache[key]
+
+    if latest is None:
+        latest = int(rpc_call(rpc_url, "eth_blockNumber", []), 16)
+    if not has_code(rpc_url, address, latest):
+        raise ValueError(f"No contract code at {address} as of block {latest}")
+
+    # Invariant: no code at lo - 1 (or lo == 0), code at hi
+    lo, hi = 0, latest
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if has_code(rpc_url, address, mid):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    print(f"   📍 {address} deployed at block {lo}")
+    cache[key] = lo
+    _save_cache(cache, cache_file)
+    return lo
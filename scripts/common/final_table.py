@@ -0,0 +1,90 @@
+"""
+Schema of the final wallet table and the per-chunk cleanup that produces it.
+
+Shared by the single-pass consolidation scripts and the sharded one, so
+every mode writes identical rows.
+"""
+
+VOLUME_COLUMNS = ['total_dex_volume_usd', 'total_cex_volume_usd', 'total_lending_volume_usd', 'total_volume_usd_cis']
+
+VALUE_COLUMNS = ['gas_fees_usd', 'present_value_usd', 'ath_value_usd', 'alchemy_eth_balance', *VOLUME_COLUMNS]
+
+# Declared types: no inference. Counts are compact 'Int32' (pandas' nullable
+# int, for wallets a metric has no value for). USD / ETH values stay float64:
+# float32 keeps only ~7 significant digits, which would reach the final CSV and Dune.
+DTYPES = {
+    'tx_count': 'Int32',
+    'wallet_age_days': 'Int32',
+    **{c: 'float64' for c in VALUE_COLUMNS},
+}
+
+ETH_PRICE = 3300 # Approx
+
+FINAL_COLUMNS = [
+    'wallet_address',
+    'tx_count',
+    'wallet_age_days',
+    'first_seen_date',
+    'gas_fees_usd',
+    'total_dex_volume_usd',
+    'total_cex_volume_usd',
+    'total_lending_volume_usd',
+    'alchemy_current_wallet_value',
+    'sim_current_wallet_value',
+    'sim_ath_wallet_value',
+    'top_tokens_held'
+]
+
+def finalize(merged, to_addresses):
+    """Turn one merge-joined chunk (wallet_id + metric columns) into final-table rows."""
+    # Rename for final upload to match user request "Total Volume"
+    merged = merged.rename(columns={'first_tx_timestamp': 'first_seen_date', 'total_volume_usd_cis': 'total_volume_usd'})
+
+    # Fill NaNs for numeric columns with 0
+    numeric_cols = [
+        'wallet_age_days',
+        'total_dex_volume_usd', 'total_cex_volume_usd', 'total_lending_volume_usd',
+        'gas_fees_usd', 'present_value_usd', 'ath_value_usd', 'alchemy_eth_balance',
+        'total_volume_usd'
+    ]
+    merged[numeric_cols] = merged[numeric_cols].fillna(0)
+    # Full precision for the value math, rounding and CSV output, whatever the inputs were stored as
+    value_cols = numeric_cols[1:]
+    merged[value_cols] = merged[value_cols].astype('float64')
+
+    # Cast to int
+    merged['wallet_age_days'] = merged['wallet_age_days'].astype(int)
+    merged['tx_count'] = merged['tx_count'].fillna(0).astype(int)
+
+    # Calculate Alchemy USD Value
+    merged['alchemy_current_wallet_value'] = merged['alchemy_eth_balance'] * ETH_PRICE
+
+    # Addresses are only materialised for the rows being written
+    merged['wallet'] = to_addresses(merged['wallet_id'])
+
+    # Rename columns for final output
+    final_df = merged[[
+        'wallet',
+        'tx_count',
+        'wallet_age_days',
+        'first_seen_date',
+        'gas_fees_usd',
+        'total_dex_volume_usd',
+        'total_cex_volume_usd',
+        'total_lending_volume_usd',
+        'alchemy_current_wallet_value',
+        'present_value_usd',
+        'ath_value_usd',
+        'top_tokens'
+    ]]
+
+    final_df.columns = FINAL_COLUMNS
+
+    # Round decimals
+    round_cols = [
+        'gas_fees_usd', 'total_dex_volume_usd', 'total_cex_volume_usd',
+        'total_lending_volume_usd', 'alchemy_current_wallet_value',
+        'sim_current_wallet_value', 'sim_ath_wallet_value'
+    ]
+    final_df[round_cols] = final_df[round_cols].round(2)
+    return final_df
@@ -0,0 +1,104 @@
+"""
+ERC-20 holder balance index built by replaying Transfer logs.
+
+Balances live in SQLite as 20-byte address -> 32-byte big-endian balance.
+Fixed-width blobs compare like the integers they encode, so "holders above
+X" is a plain indexed range query. Each batch of logs is applied in
+(block, logIndex) order in the same transaction that advances the
+checkpoint, so an interrupted run never double-counts or skips a transfer.
+"""
+import os
+import sqlite3
+
+ZERO_ADDRESS = bytes(20)
+
+def balance_to_blob(value):
+    return int(value).to_bytes(32, "big")
+
+def blob_to_balance(blob):
+    return int.from_bytes(blob, "big")
+
+def topic_to_address(topic):
+    return bytes.fromhex(topic[-40:])
+
+def log_sort_key(log):
+    return int(log['blockNumber'], 16), int(log['logIndex'], 16)
+
+class HolderIndex:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS balances (address BLOB PRIMARY KEY, balance BLOB NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS balances_by_balance ON balances (balance)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def last_block(self):
+        value = self.get_meta("last_block")
+        return int(value) if value is not None else None
+
+    def apply_logs(self, logs, last_block):
+        """Apply Transfer logs in chain order and advance the checkpoint to last_block, atomically."""
+        deltas = {}
+        for log in sorted(logs, key=log_sort_key):
+            topics = log['topics']
+            if len(topics) < 3:
+                continue
+            value = int(log['data'], 16) if log.get('data') not in (None, "0x") else 0
+            if value == 0:
+                continue
+            sender, receiver = topic_to_address(topics[1]), topic_to_address(topics[2])
+            if sender != ZERO_ADDRESS:
+                deltas[sender] = deltas.get(sender, 0) - value
+            if receiver != ZERO_ADDRESS:
+                deltas[receiver] = deltas.get(receiver, 0) + value
+
+        with self.conn:
+            current = self._balances(list(deltas))
+            upserts, deletes = [], []
+            for address, delta in deltas.items():
+                balance = current.get(address, 0) + delta
+                if balance < 0:
+                    raise ValueError(f"Negative balance for 0x{address.hex()} (missing logs before block {last_block}?)")
+                if balance == 0:
+                    deletes.append((address,))
+                else:
+                    upserts.append((address, balance_to_blob(balance)))
+            self.conn.executemany("INSERT OR REPLACE INTO balances (address, balance) VALUES (?, ?)", upserts)
+            self.conn.executemany("DELETE FROM balances WHERE address = ?", deletes)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_block', ?)", (str(last_block),))
+        return len(deltas)
+
+    def _balances(self, addresses, chunk=500):
+        found = {}
+        for i in range(0, len(addresses), chunk):
+            part = addresses[i:i + chunk]
+            placeholders = ",".join("?" * len(part))
+            rows = self.conn.execute(f"SELECT address, balance FROM balances WHERE address IN ({placeholders})", part)
+            found.update((a, blob_to_balance(b)) for a, b in rows)
+        return found
+
+    def holders_above(self, min_balance=0):
+        """(0x address, raw balance) for every holder with balance > min_balance, largest first."""
+        rows = self.conn.execute(
+            "SELECT address, balance FROM balances WHERE balance > ? ORDER BY balance DESC",
+            (balance_to_blob(min_balance),)
+        )
+        return [("0x" + a.hex(), blob_to_balance(b)) for a, b in rows]
+
+    def holder_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM balances").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,51 @@
+"""
+Process-wide HTTP session shared by every fetcher.
+
+One pooled requests.Session keeps TLS connections to Alchemy / SIM / Dune
+alive across requests, and across pipeline stages when they run in one
+process (run_full_delta_pipeline.py --in-process). A response hook counts
+requests, errors and time per host for the run summary.
+"""
+from collections import defaultdict
+from threading import Lock
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = 64 # Connections kept per host; covers the largest fetcher thread pools
+
+_session = None
+_session_lock = Lock()
+_stats = defaultdict(lambda: {"requests": 0, "errors": 0, "seconds": 0.0})
+_stats_lock = Lock()
+
+def _record(response, *args, **kwargs):
+    with _stats_lock:
+        entry = _stats[urlparse(response.url).netloc]
+        entry["requests"] += 1
+        entry["errors"] += int(response.status_code >= 400)
+        entry["seconds"] += response.elapsed.total_seconds()
+
+def get_session():
+    """The shared session, created on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.hooks["response"].append(_record)
+            _session = session
+        return _session
+
+def request_stats():
+    """{host: {"requests", "errors", "seconds"}} for everything sent through the shared session."""
+    with _stats_lock:
+        return {host: dict(entry) for host, entry in _stats.items()}
+
+def print_request_stats():
+    for host, entry in sorted(request_stats().items()):
+        avg = entry["seconds"] / entry["requests"] if entry["requests"] else 0
+        print(f"   🌐 {host}: {entry['requests']} requests, {entry['errors']} errors, {avg:.2f}s avg")
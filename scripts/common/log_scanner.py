@@ -0,0 +1,175 @@
+"""
+Parallel, adaptive eth_getLogs range scanner.
+
+A pool of workers carves disjoint block ranges off a shared cursor. When a
+range is refused as too large ("block range too large", "more than 10000
+results") or comes back at the node's result cap, it is split in half and
+both halves go back on the queue, and the window for new ranges shrinks.
+Rate limits, 5xx and transport errors say nothing about the range: the same
+range is retried after a jittered backoff and the window is left alone.
+Each successful range grows the window again, so scans speed up through
+quiet stretches of chain and slow down only where logs are dense.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+
+import requests
+
+from http_client import get_session
+from rate_control import backoff_delay
+
+# get_logs() outcomes
+LOGS_OK = "ok"
+LOGS_TOO_LARGE = "too_large"  # split the range
+LOGS_RETRY = "retry"          # back off, then retry the same range
+
+# Phrases nodes use when a range or its result is too big (Alchemy, Infura, QuickNode, public Base RPC...)
+TOO_LARGE_HINTS = ("range", "too many results", "more than", "response size", "exceed", "limit of", "too large")
+RATE_LIMIT_HINTS = ("rate limit", "too many requests", "capacity", "throughput")
+
+def _classify_rpc_error(error):
+    message = str(error.get("message", error) if isinstance(error, dict) else error).lower()
+    if any(h in message for h in RATE_LIMIT_HINTS):
+        return LOGS_RETRY
+    if any(h in message for h in TOO_LARGE_HINTS):
+        return LOGS_TOO_LARGE
+    return LOGS_RETRY
+
+def get_logs(rpc_url, address, topics, from_block, to_block, timeout=30):
+    """
+    eth_getLogs for one range. Returns (LOGS_OK, logs), (LOGS_TOO_LARGE, error)
+    when the node refuses the range's size, or (LOGS_RETRY, error) for rate
+    limits, 5xx, transport and other errors.
+    """
+    payload = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "eth_getLogs",
+        "params": [{
+            "address": address,
+            "topics": topics,
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block)
+        }]
+    }
+    try:
+        resp = get_session().post(rpc_url, json=payload, headers={"Content-Type": "application/json"}, timeout=timeout)
+    except requests.RequestException as e:
+        return LOGS_RETRY, e
+    if resp.status_code == 429 or resp.status_code >= 500:
+        return LOGS_RETRY, f"HTTP {resp.status_code}"
+    try:
+        data = resp.json()
+    except ValueError:
+        return LOGS_RETRY, f"HTTP {resp.status_code}: not JSON"
+    # Some nodes send size errors as a 4xx with a JSON-RPC error body
+    if 'error' in data:
+        return _classify_rpc_error(data['error']), data['error']
+    if resp.status_code != 200:
+        return LOGS_RETRY, f"HTTP {resp.status_code}"
+    return LOGS_OK, data.get('result') or []
+
+class LogScanner:
+    def __init__(self, rpc_url, address, topics, workers=8, initial_step=10000,
+                 min_step=50, max_step=1000000, max_logs=10000, max_failures=5):
+        self.rpc_url = rpc_url
+        self.address = address
+        self.topics = topics
+        self.workers = workers
+        self.step = initial_step
+        self.min_step = min_step
+        self.max_step = max_step
+        self.max_logs = max_logs  # a result this big may have been truncated -> split
+        self.max_failures = max_failures
+
+    def scan(self, from_block, to_block, on_range=None):
+        """
+        Scan [from_block, to_block] inclusive.
+        on_range(start, end, logs) is called from worker threads as ranges complete;
+        without it, all logs are collected and returned.
+        Returns (logs, failed_ranges).
+        """
+        cond = Condition()
+        state = {"cursor": from_block, "in_flight": 0, "error": None}
+        retry = []  # (start, end, failures) split or failed ranges, taken before new ones
+        collected = []
+        failed = []
+
+        def next_range():
+            with cond:
+                while True:
+                    if state["error"] is not None:
+                        return None
+                    if retry:
+                        state["in_flight"] += 1
+                        return retry.pop()
+                    if state["cursor"] <= to_block:
+                        start = state["cursor"]
+                        end = min(to_block, start + self.step - 1)
+                        state["cursor"] = end + 1
+                        state["in_flight"] += 1
+                        return start, end, 0
+                    if state["in_flight"] == 0:
+                        return None
+                    # Nothing left to carve, but in-flight ranges may still split
+                    cond.wait()
+
+        def finish(requeue=()):
+            with cond:
+                retry.extend(requeue)
+                state["in_flight"] -= 1
+                cond.notify_all()
+
+        def worker():
+            while True:
+                item = next_range()
+                if item is None:
+                    return
+                try:
+                    process(*item)
+                except Exception as e:
+                    with cond:
+                        state["error"] = e
+                        state["in_flight"] -= 1
+                        cond.notify_all()
+                    return
+
+        def process(start, end, failures):
+            outcome, result = get_logs(self.rpc_url, self.address, self.topics, start, end)
+            splittable = end - start + 1 > self.min_step
+            capped = outcome == LOGS_OK and len(result) >= self.max_logs
+            too_large = outcome == LOGS_TOO_LARGE or capped
+
+            if outcome == LOGS_OK and not (capped and splittable):
+                logs = result
+                with cond:
+                    self.step = min(self.max_step, int(self.step * 1.5) + 1)
+                if on_range:
+                    on_range(start, end, logs)
+                else:
+                    with cond:
+                        collected.extend(logs)
+                finish()
+            elif too_large and splittable:
+                with cond:
+                    self.step = max(self.min_step, self.step // 2)
+                mid = (start + end) // 2
+                finish([(start, mid, 0), (mid + 1, end, 0)])
+            elif failures + 1 < self.max_failures:
+                # Throttled / transient (or already at the smallest range): back off and retry as-is
+                time.sleep(backoff_delay(failures, base=2.0))
+                finish([(start, end, failures + 1)])
+            else:
+                print(f"   ❌ Giving up on blocks {start}-{end}: {result}")
+                with cond:
+                    failed.append((start, end))
+                finish()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in range(self.workers):
+                executor.submit(worker)
+
+        if state["error"] is not None:
+            raise state["error"]
+        return collected, sorted(failed)
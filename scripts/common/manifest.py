@@ -0,0 +1,73 @@
+"""
+Make-style memoization for pipeline stages.
+
+Before a stage runs, its fingerprint is computed: SHA-256 over the content
+of its input files, its code files and its parameters. After it succeeds the
+fingerprint is stored in data/state/manifests/<stage>.json. On the next run
+a stage whose fingerprint is unchanged (and whose outputs still exist) is
+skipped, and its previous outputs are reused.
+
+Each file's hash is stored with its size and mtime, and reused while those
+are unchanged, so a fingerprint check doesn't reread large files that
+haven't been touched.
+"""
+import hashlib
+import json
+import os
+import time
+
+from columnar import exists, storage_files
+
+MANIFEST_DIR = "data/state/manifests"
+HASH_BLOCK = 1 << 20
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ManifestStore:
+    def __init__(self, directory=MANIFEST_DIR):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def load(self, name):
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def fingerprint(self, name, inputs=(), code=(), params=None):
+        """Returns (digest, files) for the stage's current inputs, code and params."""
+        known = self.load(name).get("files", {})
+        files = {}
+        tree = {"inputs": {}, "code": {}, "params": params}
+        for kind, paths in (("inputs", inputs), ("code", code)):
+            for path in paths:
+                hashes = []
+                for f in storage_files(path):
+                    stat = os.stat(f)
+                    size, mtime = stat.st_size, stat.st_mtime_ns
+                    entry = known.get(f)
+                    sha = entry[2] if entry and entry[:2] == [size, mtime] else _sha256(f)
+                    files[f] = [size, mtime, sha]
+                    hashes.append([os.path.basename(f), sha])
+                tree[kind][path] = hashes  # a missing input hashes as []
+        digest = hashlib.sha256(json.dumps(tree, sort_keys=True, default=str).encode()).hexdigest()
+        return digest, files
+
+    def is_fresh(self, name, digest, outputs=()):
+        return self.load(name).get("fingerprint") == digest and all(exists(o) for o in outputs)
+
+    def record(self, name, digest, files):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(name)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"fingerprint": digest, "recorded_at": int(time.time()), "files": files}, f, indent=1)
+        os.replace(tmp, path)
@@ -0,0 +1,102 @@
+"""
+Master wallet dataset, partitioned by wallet_id range, with keyed upserts.
+
+Each partition holds the final rows for PARTITION_IDS consecutive wallet ids
+(data/output/master/ids-000002.parquet covers ids 200000-299999), sorted by
+id. Upserting a delta rewrites only the partitions its wallets fall in:
+rows for wallets already present are replaced, new wallets are appended.
+Newly interned wallets get the highest ids, so a delta of new wallets mostly
+touches the last partition.
+"""
+import glob
+import os
+
+import pandas as pd
+
+from columnar import HAVE_ARROW
+from wallet_ids import get_dictionary, normalize_wallets
+
+MASTER_DIR = "data/output/master"
+PARTITION_IDS = 100000
+KEY_COLUMN = "wallet_address"
+
+class MasterDataset:
+    def __init__(self, directory=MASTER_DIR, partition_ids=PARTITION_IDS):
+        self.directory = directory
+        self.partition_ids = partition_ids
+        self.ext = ".parquet" if HAVE_ARROW else ".csv"
+
+    def _path(self, partition):
+        return os.path.join(self.directory, f"ids-{partition:06d}{self.ext}")
+
+    def partitions(self):
+        """Partition numbers present, ascending."""
+        files = glob.glob(os.path.join(self.directory, f"ids-*{self.ext}"))
+        return sorted(int(os.path.basename(f)[4:10]) for f in files)
+
+    def is_empty(self):
+        return not self.partitions()
+
+    def last_modified(self):
+        """mtime of the most recently rewritten partition (0 if empty)."""
+        return max((os.path.getmtime(self._path(p)) for p in self.partitions()), default=0)
+
+    def read_partition(self, partition):
+        path = self._path(partition)
+        if not os.path.exists(path):
+            return None
+        return pd.read_parquet(path) if HAVE_ARROW else pd.read_csv(path)
+
+    def _write_partition(self, partition, df):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(partition)
+        tmp = path + ".tmp"
+        if HAVE_ARROW:
+            df.to_parquet(tmp, index=False)
+        else:
+            df.to_csv(tmp, index=False)
+        os.replace(tmp, path)  # readers never see a half-written partition
+
+    def upsert(self, delta):
+        """
+        Merge `delta` (final-schema rows keyed by wallet_address) into the master.
+        The last row per wallet in the delta wins. Returns (replaced, added, partitions_touched).
+        """
+        delta = delta.copy()
+        delta[KEY_COLUMN] = normalize_wallets(delta[KEY_COLUMN]).values
+        delta = delta[delta[KEY_COLUMN].notna()]
+        delta['wallet_id'] = get_dictionary().intern(delta[KEY_COLUMN].tolist())
+        delta = delta.drop_duplicates(subset=['wallet_id'], keep='last')
+
+        replaced = added = 0
+        touched = []
+        for partition, rows in delta.groupby(delta['wallet_id'] // self.partition_ids):
+            existing = self.read_partition(partition)
+            if existing is not None:
+                is_replaced = existing['wallet_id'].isin(rows['wallet_id'])
+                replaced += int(is_replaced.sum())
+                added += len(rows) - int(is_replaced.sum())
+                columns = list(existing.columns) + [c for c in rows.columns if c not in existing.columns]
+                rows = pd.concat([existing[~is_replaced], rows], ignore_index=True).reindex(columns=columns)
+            else:
+                added += len(rows)
+            self._write_partition(partition, rows.sort_values('wallet_id', kind='stable'))
+            touched.append(partition)
+        return replaced, added, touched
+
+    def iter_rows(self, columns=None):
+        """Stream the master one partition at a time, in wallet_id order."""
+        for partition in self.partitions():
+            df = self.read_partition(partition)
+            yield df if columns is None else df[columns]
+
+    def export_csv(self, path):
+        """Write the whole master (without wallet_id) to one CSV, a partition at a time."""
+        tmp = path + ".tmp"
+        total = 0
+        for i, df in enumerate(self.iter_rows()):
+            df.drop(columns=['wallet_id']).to_csv(tmp, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            total += len(df)
+        if total:
+            os.replace(tmp, path)
+        return total
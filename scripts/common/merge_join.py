@@ -0,0 +1,65 @@
+"""
+Streaming left join of sorted per-metric intermediates onto a wallet cohort.
+
+Every input is consumed in ascending wallet_id order (columnar.iter_sorted),
+so joining is a k-way merge: each cohort chunk pulls from every metric only
+the rows up to its last id. Memory stays at one chunk plus one batch per
+metric, whatever the cohort size.
+"""
+import numpy as np
+import pandas as pd
+
+class SortedCursor:
+    """Reads a stream of id-sorted DataFrames up to a given wallet_id at a time."""
+
+    def __init__(self, batches, columns):
+        self.batches = iter(batches)
+        self.columns = ['wallet_id'] + list(columns)
+        self.buffer = None
+        self.done = False
+
+    def take_upto(self, max_id):
+        taken = []
+        while True:
+            if self.buffer is None or self.buffer.empty:
+                if self.done:
+                    break
+                self.buffer = next(self.batches, None)
+                if self.buffer is None:
+                    self.done = True
+                    break
+                continue
+            split = int(np.searchsorted(self.buffer['wallet_id'].to_numpy(), max_id, side='right'))
+            taken.append(self.buffer.iloc[:split])
+            self.buffer = self.buffer.iloc[split:]
+            if not self.buffer.empty:
+                break  # the rest belongs to later chunks
+        if not taken:
+            empty = {c: pd.Series(dtype='float64') for c in self.columns}
+            empty['wallet_id'] = pd.Series(dtype='int32')
+            return pd.DataFrame(empty)
+        return pd.concat(taken, ignore_index=True)
+
+def cohort_chunks(df, chunk_rows):
+    """Split a cohort (sorted by unique wallet_id) into chunks."""
+    for i in range(0, len(df), chunk_rows):
+        yield df.iloc[i:i + chunk_rows]
+
+def merge_join(cohort, sources):
+    """
+    Left-join `sources` onto each cohort chunk.
+
+    cohort:  iterable of DataFrames sorted by unique wallet_id.
+    sources: list of (batches, columns), batches sorted by unique wallet_id.
+    Yields one joined DataFrame per cohort chunk, in cohort order.
+    """
+    cursors = [SortedCursor(batches, columns) for batches, columns in sources]
+    for chunk in cohort:
+        if chunk.empty:
+            continue
+        max_id = chunk['wallet_id'].iloc[-1]
+        merged = chunk
+        for cursor in cursors:
+            rows = cursor.take_upto(max_id)
+            merged = merged.merge(rows, on='wallet_id', how='left')
+        yield merged
@@ -0,0 +1,62 @@
+"""
+Checkpoint + append-only minter set shared by the ORBT minter fetchers.
+
+Each sync scans only blocks after the last checkpoint, appends minters it
+hasn't seen before to the minter CSV, and can hand just those new wallets
+to the delta pipeline. A sync emits its new minters first, then appends
+them, then advances the checkpoint, so a crash in between repeats work but
+never drops a minter; emitting merges into the existing file, so repeats
+and unconsumed earlier syncs are kept once.
+"""
+import json
+import os
+
+import pandas as pd
+
+CHECKPOINT_FILE = "data/state/orbt_minters_checkpoint.json"
+MINTERS_FILE = "orbt_base_minters.csv"
+NEW_MINTERS_FILE = "data/input/orbt_new_minters.csv"
+DELTA_INPUT_FILE = "data/input/delta_wallets.csv"
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    """Last fully scanned block, or None on first sync."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get("last_block")
+
+def save_checkpoint(last_block, path=CHECKPOINT_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"last_block": last_block}, f)
+    os.replace(tmp, path)  # atomic: never leaves a half-written checkpoint
+
+def load_minters(path=MINTERS_FILE):
+    if not os.path.exists(path):
+        return set()
+    return set(pd.read_csv(path)['wallet'].astype(str).str.lower().str.strip())
+
+def unseen_minters(found, path=MINTERS_FILE):
+    """Minters not in the file yet, sorted."""
+    return sorted(set(w.lower() for w in found) - load_minters(path))
+
+def append_new_minters(found, path=MINTERS_FILE):
+    """Append minters not already in the file. Returns the new ones."""
+    new = unseen_minters(found, path)
+    if new:
+        pd.DataFrame(new, columns=["wallet"]).to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+    return new
+
+def emit_new_minters(new, to_delta=False):
+    """Add this sync's new minters to the delta pipeline's input, keeping wallets already there."""
+    path = DELTA_INPUT_FILE if to_delta else NEW_MINTERS_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = pd.DataFrame(new, columns=["wallet"])
+    if os.path.exists(path):
+        df = pd.concat([pd.read_csv(path), df], ignore_index=True)
+    df = df[~df['wallet'].astype(str).str.lower().str.strip().duplicated()]
+    tmp = path + ".tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return path
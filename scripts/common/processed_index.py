@@ -0,0 +1,84 @@
+"""
+Append-only index of wallets already written to a fetcher's output file.
+
+Each processed wallet is stored as its raw 20-byte address in
+<output_file>.idx, appended whenever the fetcher flushes rows to disk.
+Resuming reads that one small binary file instead of re-parsing the
+whole output with pandas. The index is only trusted while the output still
+backs it: if the output was deleted the index is dropped, and if it holds
+fewer rows than the index has wallets (replaced or truncated) the index is
+rebuilt from it.
+"""
+import os
+from threading import Lock
+
+from columnar import exists, read_table, row_count
+from wallet_ids import ADDRESS_BYTES, address_to_bytes
+
+class ProcessedIndex:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.path = output_file + ".idx"
+        self.lock = Lock()
+        self.seen = set()
+
+    def load(self):
+        """Load the index (building it from the output if it predates the index or no longer matches it)."""
+        if not exists(self.output_file):
+            if os.path.exists(self.path):
+                print(f"⚠️ {self.output_file} is gone; discarding its resume index.")
+                os.remove(self.path)
+            return self
+        if not os.path.exists(self.path):
+            self._rebuild_from_output()
+            return self
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        # Drop a torn trailing record left by an interrupted append
+        usable = len(data) - len(data) % ADDRESS_BYTES
+        if usable != len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(usable)
+
+        self.seen = {data[i:i + ADDRESS_BYTES] for i in range(0, usable, ADDRESS_BYTES)}
+        # Every indexed wallet has at least one row, so fewer rows means the output was replaced
+        if row_count(self.output_file) < len(self.seen):
+            print(f"⚠️ {self.output_file} has fewer rows than its resume index; rebuilding.")
+            os.remove(self.path)
+            self.seen = set()
+            self._rebuild_from_output()
+        return self
+
+    def _rebuild_from_output(self):
+        print(f"🔧 Building resume index for {self.output_file}...")
+        try:
+            df = read_table(self.output_file, columns=["wallet"])
+            self.add_many(df["wallet"].tolist())
+        except Exception as e:
+            print(f"⚠️ Could not build index from {self.output_file}: {e}")
+
+    def __len__(self):
+        return len(self.seen)
+
+    def __contains__(self, wallet):
+        return address_to_bytes(wallet) in self.seen
+
+    def filter_new(self, wallets):
+        """Valid wallets (in input order) that are not in the index yet."""
+        keys = ((w, address_to_bytes(w)) for w in wallets)
+        return [w for w, b in keys if b is not None and b not in self.seen]
+
+    def add_many(self, wallets):
+        """Record wallets as processed. Call right after their rows are flushed to the output."""
+        with self.lock:
+            new = []
+            for w in wallets:
+                b = address_to_bytes(w)
+                if b is not None and b not in self.seen:
+                    self.seen.add(b)
+                    new.append(b)
+            if new:
+                with open(self.path, "ab") as f:
+                    f.write(b"".join(new))
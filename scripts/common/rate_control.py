@@ -0,0 +1,75 @@
+"""
+Adaptive request concurrency for rate-limited APIs.
+
+AIMDLimiter caps the number of in-flight requests. The cap grows by one
+after a full window of healthy responses (additive increase) and is cut in
+half on a 429 or a response slower than the latency target (multiplicative
+decrease), so workers settle at the highest rate the API will sustain.
+
+RetryBudget bounds retries to a fraction of first attempts, so a burst of
+429s can't turn into a retry storm.
+"""
+import random
+import time
+from threading import Condition, Lock
+
+class AIMDLimiter:
+    def __init__(self, initial=10, minimum=1, maximum=50, latency_target=10.0, decrease_factor=0.5, cooldown=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown  # seconds between decreases, so one burst of 429s only halves once
+        self.in_flight = 0
+        self.throttled_count = 0
+        self._last_decrease = 0.0
+        self._cond = Condition()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False, latency=None):
+        with self._cond:
+            self.in_flight -= 1
+            congested = throttled or (latency is not None and latency > self.latency_target)
+            if congested:
+                self.throttled_count += int(throttled)
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                # +1 per window of `limit` successes
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+class RetryBudget:
+    def __init__(self, ratio=0.2, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self._lock = Lock()
+
+    def on_request(self):
+        """Every first attempt earns `ratio` of a retry."""
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Exponential backoff with full jitter, so retries don't arrive in lockstep."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
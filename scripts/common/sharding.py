@@ -0,0 +1,77 @@
+"""
+Deterministic hash sharding of wallet lists.
+
+A wallet always lands in the same shard for a given shard count, no matter
+which machine or process computes it, so N workers each taking
+`shard i/N` cover a cohort with no overlap and no gaps.
+
+Bulk jobs over wallet ids shard by address prefix instead (prefix_shards):
+addresses are already hash-derived, so their leading bytes are uniform, and
+reading them straight from the memory-mapped wallet dictionary needs no
+per-wallet Python work. Shard k of N then covers a contiguous prefix range.
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+from wallet_ids import ADDRESS_BYTES, DICTIONARY_FILE
+
+def shard_of(wallet, num_shards):
+    digest = hashlib.sha1(str(wallet).strip().lower().encode()).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+def select_shard(wallets, shard=0, num_shards=1):
+    if num_shards <= 1:
+        return list(wallets)
+    return [w for w in wallets if shard_of(w, num_shards) == shard]
+
+def parse_shard(spec):
+    """Parse "i/N" (e.g. "2/8") into (i, N)."""
+    try:
+        shard, num_shards = (int(x) for x in str(spec).split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, got {spec!r}")
+    if num_shards < 1 or not 0 <= shard < num_shards:
+        raise ValueError(f"Shard index must be in [0, {num_shards}), got {spec!r}")
+    return shard, num_shards
+
+def segment_path(output_file, shard=0, num_shards=1):
+    """Per-shard output file: foo.csv -> foo.shard-002-of-008.csv (unchanged when unsharded)."""
+    if num_shards <= 1:
+        return output_file
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.shard-{shard:03d}-of-{num_shards:03d}{ext}"
+
+class AddressTable:
+    """
+    Read-only, memory-mapped id -> address view of the wallet dictionary,
+    covering the ids that existed when it was opened. Unlike WalletDictionary
+    it builds no per-address objects, so worker processes can open it cheaply.
+    """
+
+    def __init__(self, path=DICTIONARY_FILE):
+        count = os.path.getsize(path) // ADDRESS_BYTES if os.path.exists(path) else 0
+        if count:
+            self.array = np.memmap(path, dtype=np.uint8, mode='r', shape=(count, ADDRESS_BYTES))
+        else:
+            self.array = np.zeros((0, ADDRESS_BYTES), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.array)
+
+    def to_addresses(self, ids):
+        return ["0x" + row.tobytes().hex() for row in self.array[np.asarray(ids)]]
+
+    def prefix_shards(self, ids, num_shards):
+        """Shard per wallet id: the first two address bytes, split into num_shards equal ranges."""
+        rows = self.array[np.asarray(ids)]
+        prefixes = (rows[:, 0].astype(np.int64) << 8) | rows[:, 1]
+        return (prefixes * num_shards) >> 16
+
+def parse_shard_args(description):
+    """A fetcher's command line (--shard i/N) as (shard, num_shards)."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--shard", default="0/1", help="Process shard i of N, e.g. 2/8, into its own segment file")
+    return parse_shard(parser.parse_args().shard)
@@ -0,0 +1,132 @@
+"""
+Shared wallet dictionary: 20-byte address <-> dense integer id.
+
+Addresses are validated and normalised once, then stored back to back in
+data/state/wallet_ids.bin; a wallet's id is its position in that file, so
+ids are stable across runs and scripts. Intermediates carry a wallet_id
+column (see columnar.append_rows), which lets joins, dedup and membership
+checks run on int32 instead of 42-character strings.
+
+Several fetchers can intern wallets at once: appends happen under an
+exclusive file lock, after reading any records other processes added and
+trimming a torn trailing record left by a crash.
+"""
+import os
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+ADDRESS_BYTES = 20
+DICTIONARY_FILE = "data/state/wallet_ids.bin"
+ID_DTYPE = np.int32
+
+def address_to_bytes(wallet):
+    """20-byte form of a 0x address, or None if it isn't a valid address."""
+    w = str(wallet).strip().lower()
+    if w.startswith("0x"):
+        w = w[2:]
+    if len(w) != 2 * ADDRESS_BYTES:
+        return None
+    try:
+        return bytes.fromhex(w)
+    except ValueError:
+        return None
+
+def normalize_wallets(values):
+    """Lowercased, stripped 0x addresses as a Series (the prefix is added if missing, as in address_to_bytes); invalid entries become NaN."""
+    s = pd.Series(values, copy=False).astype(str).str.strip().str.lower()
+    s = s.mask(s.str.fullmatch(r"[0-9a-f]{40}"), "0x" + s)
+    return s.where(s.str.fullmatch(r"0x[0-9a-f]{40}"))
+
+class WalletDictionary:
+    def __init__(self, path=DICTIONARY_FILE):
+        self.path = path
+        self.lock = Lock()
+        self.addresses = []  # id -> 20 bytes
+        self.ids = {}        # 20 bytes -> id
+
+    def load(self):
+        with self.lock:
+            self._read_tail()
+        return self
+
+    def _read_tail(self):
+        """Pick up records appended since the last read (by this or another process)."""
+        if not os.path.exists(self.path):
+            return
+        offset = len(self.addresses) * ADDRESS_BYTES
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        usable = len(data) - len(data) % ADDRESS_BYTES  # ignore a torn trailing record
+        for i in range(0, usable, ADDRESS_BYTES):
+            b = data[i:i + ADDRESS_BYTES]
+            self.ids[b] = len(self.addresses)
+            self.addresses.append(b)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def lookup(self, wallets):
+        """Ids for wallets (-1 for unknown or invalid), without adding anything."""
+        return np.fromiter(
+            (self.ids.get(address_to_bytes(w), -1) for w in wallets), dtype=ID_DTYPE, count=len(wallets)
+        )
+
+    def intern(self, wallets):
+        """Ids for wallets, assigning new ids to unseen valid addresses (-1 for invalid)."""
+        wallets = list(wallets)
+        keys = [address_to_bytes(w) for w in wallets]
+        if any(k is not None and k not in self.ids for k in keys):
+            with self.lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "ab") as f:
+                    if fcntl:
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        self._read_tail()
+                        # Drop a torn record left by a writer that crashed, so new ids start on a record boundary
+                        size = len(self.addresses) * ADDRESS_BYTES
+                        if os.fstat(f.fileno()).st_size > size:
+                            f.truncate(size)
+                        new = []
+                        for k in keys:
+                            if k is not None and k not in self.ids:
+                                self.ids[k] = len(self.addresses)
+                                self.addresses.append(k)
+                                new.append(k)
+                        f.write(b"".join(new))
+                        f.flush()
+                    finally:
+                        if fcntl:
+                            fcntl.flock(f, fcntl.LOCK_UN)
+        return np.fromiter((self.ids.get(k, -1) if k is not None else -1 for k in keys), dtype=ID_DTYPE, count=len(keys))
+
+    def to_addresses(self, ids):
+        """0x strings for ids."""
+        return ["0x" + self.addresses[i].hex() for i in ids]
+
+_shared = None
+_shared_lock = Lock()
+
+def get_dictionary():
+    """The process-wide dictionary backed by DICTIONARY_FILE."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = WalletDictionary().load()
+        return _shared
+
+def attach_ids(df, column="wallet"):
+    """Add a wallet_id column (interning new wallets) and drop rows with invalid addresses."""
+    df = df.copy()
+    df[column] = normalize_wallets(df[column]).values
+    df = df[df[column].notna()]
+    df["wallet_id"] = get_dictionary().intern(df[column].tolist())
+    return df
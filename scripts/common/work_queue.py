@@ -0,0 +1,220 @@
+"""
+Durable per-(wallet, metric) work queue for the fetchers.
+
+Every wallet a fetcher has to cover is an item in data/state/work_queue.sqlite,
+keyed by the fetcher's output file (its "metric"), with a status:
+
+    pending -> leased -> done
+                      -> failed (attempts, last_error)
+
+Workers claim leases in batches as they go, so at most a few batches are
+leased at once. A wallet is done once its row is flushed to the output; a
+fetch that raises or returns no row marks it failed. A rerun picks up only
+pending items and failed items with attempts to spare. Resuming no longer
+means "in the output file", so a wallet that failed is retried instead of
+being written as zeros.
+
+On sync the queue is reconciled with the output's ProcessedIndex, which
+covers a crash between writing rows and marking them done, and every lease
+of the metric goes back to pending: one run owns a metric (shards have their
+own), so a lease still held at start belongs to a run that died. Wallets are
+normalised on sync and invalid addresses are reported and left out, so they
+can't fail on every run. finish() raises while any wallet is not done and
+still has attempts left, so the pipeline never records such a stage as
+complete; wallets that used all MAX_ATTEMPTS are reported instead, so one
+bad wallet can't block the stage forever.
+"""
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+
+from wallet_ids import normalize_wallets
+
+QUEUE_DB = "data/state/work_queue.sqlite"
+MAX_ATTEMPTS = 5  # failed items past this are left for inspection instead of retried
+CLAIM_SIZE = 500  # wallets leased per claim
+
+# Failed items count only from earlier runs, so a run never loops on its own failures
+CLAIMABLE = """(i.status = 'pending' OR (i.status = 'failed' AND i.attempts < ? AND i.updated_at < ?))"""
+
+class WorkQueue:
+    def __init__(self, output_file, path=QUEUE_DB):
+        self.metric = os.path.splitext(os.path.basename(output_file))[0]
+        self.path = path
+        self.conn = None  # opened by sync(), so importing a fetcher touches no state
+        self.opened_at = None
+        self.lock = Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # One connection shared by the fetcher's threads; the timeout covers other processes' writes
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS items (
+                metric TEXT NOT NULL, wallet TEXT NOT NULL, status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (metric, wallet))""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS items_by_status ON items (metric, status)")
+
+    def sync(self, wallets, processed):
+        """
+        Make `wallets` this run's cohort: add unseen ones as pending, and mark
+        them done exactly when they are in `processed` (the output's ProcessedIndex).
+        Wallets are queued lowercased; invalid addresses are reported and skipped.
+        Returns the number of cohort items left to claim. Starts a run: only
+        failures from before this call are retried.
+        """
+        wallets = normalize_wallets(list(wallets))
+        invalid = int(wallets.isna().sum())
+        if invalid:
+            print(f"⚠️ {self.metric}: skipping {invalid} invalid wallet addresses")
+        wallets = wallets.dropna().tolist()
+        now = self.opened_at = time.time()
+        with self.lock:
+            if self.conn is None:
+                self._open()
+        with self.lock, self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS temp.cohort")
+            self.conn.execute("CREATE TEMP TABLE cohort (seq INTEGER PRIMARY KEY, wallet TEXT UNIQUE, saved INTEGER)")
+            self.conn.executemany("INSERT OR IGNORE INTO cohort (wallet, saved) VALUES (?, ?)",
+                                  ((w, w in processed) for w in wallets))
+            self.conn.execute("""INSERT OR IGNORE INTO items (metric, wallet, status, updated_at)
+                                 SELECT ?, wallet, 'pending', ? FROM cohort""", (self.metric, now))
+            # Leases left by a crashed run go back to the queue straight away
+            self.conn.execute("""UPDATE items SET status = 'pending', updated_at = ?
+                                 WHERE metric = ? AND status = 'leased'""", (now, self.metric))
+            self.conn.execute("""UPDATE items SET status = 'done', updated_at = ?
+                                 WHERE metric = ? AND status != 'done'
+                                 AND wallet IN (SELECT wallet FROM cohort WHERE saved)""", (now, self.metric))
+            # Done but missing from the output (e.g. the file was deleted): fetch again
+            self.conn.execute("""UPDATE items SET status = 'pending', attempts = 0, updated_at = ?
+                                 WHERE metric = ? AND status = 'done'
+                                 AND wallet IN (SELECT wallet FROM cohort WHERE NOT saved)""", (now, self.metric))
+        return self.remaining()
+
+    def _claimable_args(self):
+        return MAX_ATTEMPTS, self.opened_at
+
+    def remaining(self):
+        """Cohort items a claim could still return."""
+        with self.lock:
+            return self.conn.execute(f"""SELECT COUNT(*) FROM cohort c JOIN items i ON i.metric = ? AND i.wallet = c.wallet
+                                         WHERE {CLAIMABLE}""", (self.metric, *self._claimable_args())).fetchone()[0]
+
+    def claim(self, limit):
+        """Lease up to `limit` claimable cohort wallets (in cohort order)."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                wallets = [row[0] for row in self.conn.execute(f"""
+                    SELECT i.wallet FROM cohort c JOIN items i ON i.metric = ? AND i.wallet = c.wallet
+                    WHERE {CLAIMABLE} ORDER BY c.seq LIMIT ?""",
+                    (self.metric, *self._claimable_args(), limit))]
+                self.conn.executemany("""UPDATE items SET status = 'leased', attempts = attempts + 1,
+                                         updated_at = ? WHERE metric = ? AND wallet = ?""",
+                                      ((now, self.metric, w) for w in wallets))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return wallets
+
+    def complete(self, wallets):
+        """Mark wallets done. Call right after their rows are flushed to the output."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("""UPDATE items SET status = 'done', last_error = NULL,
+                                     updated_at = ? WHERE metric = ? AND wallet = ?""",
+                                  ((now, self.metric, w) for w in wallets))
+
+    def fail(self, wallets, error):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("""UPDATE items SET status = 'failed', last_error = ?,
+                                     updated_at = ? WHERE metric = ? AND wallet = ? AND status = 'leased'""",
+                                  ((str(error)[:500], now, self.metric, w) for w in wallets))
+
+    def counts(self):
+        """{status: n} over this run's cohort."""
+        with self.lock:
+            rows = self.conn.execute("""SELECT i.status, COUNT(*) FROM cohort c
+                                        JOIN items i ON i.metric = ? AND i.wallet = c.wallet
+                                        GROUP BY i.status""", (self.metric,)).fetchall()
+        return dict(rows)
+
+    def print_summary(self):
+        counts = self.counts()
+        print(f"📋 {self.metric}: " + ", ".join(f"{counts[s]} {s}" for s in ("done", "failed", "leased", "pending") if counts.get(s)))
+        with self.lock:
+            errors = self.conn.execute("""SELECT i.last_error, COUNT(*) FROM cohort c
+                                          JOIN items i ON i.metric = ? AND i.wallet = c.wallet
+                                          WHERE i.status = 'failed' GROUP BY i.last_error
+                                          ORDER BY COUNT(*) DESC LIMIT 3""", (self.metric,)).fetchall()
+        for error, n in errors:
+            print(f"   ⚠️ {n} failed: {error}")
+
+    def finish(self):
+        """
+        Print the summary, then raise if any cohort wallet is not done but could
+        still be retried (the run must not count as complete). Wallets out of
+        attempts are only reported: a rerun would not fetch them anyway.
+        """
+        self.print_summary()
+        counts = self.counts()
+        left = {status: n for status, n in counts.items() if status != "done"}
+        if not left:
+            return
+        with self.lock:
+            exhausted = self.conn.execute("""SELECT COUNT(*) FROM cohort c JOIN items i ON i.metric = ? AND i.wallet = c.wallet
+                                             WHERE i.status = 'failed' AND i.attempts >= ?""", (self.metric, MAX_ATTEMPTS)).fetchone()[0]
+        if exhausted:
+            print(f"⚠️ {self.metric}: {exhausted} wallets used all {MAX_ATTEMPTS} attempts and are left out of the output "
+                  f"(reset their attempts in {self.path} to retry them)")
+        if sum(left.values()) > exhausted:
+            raise RuntimeError(f"{self.metric}: {sum(left.values()) - exhausted} wallets not done {left}; rerun to retry them")
+
+    def process(self, fn, workers, batch_size=1):
+        """
+        Run `fn` over claimed wallets on `workers` threads, yielding each call's
+        result as it completes. `fn` takes one wallet (batch_size=1) or a list
+        of them, and returns a row dict, a list of rows, or None. Wallets
+        without a returned row (or whose call raised) are marked failed; a
+        call that raised yields [] (or None). The caller marks the others
+        done when it flushes them.
+        """
+        tasks = deque()
+        running = {}
+
+        def refill():
+            while len(running) < workers * 2:
+                if not tasks:
+                    claimed = self.claim(max(CLAIM_SIZE, batch_size))
+                    if not claimed:
+                        return
+                    tasks.extend(claimed[i:i + batch_size] for i in range(0, len(claimed), batch_size))
+                task = tasks.popleft()
+                running[pool.submit(fn, task if batch_size > 1 else task[0])] = task
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            refill()
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    try:
+                        result, error = future.result(), "no result returned"
+                    except Exception as e:
+                        result, error = [] if batch_size > 1 else None, f"{type(e).__name__}: {e}"
+                    rows = result if isinstance(result, list) else [result] if result else []
+                    returned = {row["wallet"] for row in rows}
+                    failed = [w for w in task if w not in returned]
+                    if failed:
+                        self.fail(failed, error)
+                    yield result
+                refill()
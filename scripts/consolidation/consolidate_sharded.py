@@ -0,0 +1,146 @@
+"""
+Bounded-memory consolidation for very large cohorts.
+
+Splits the cohort into shards by address prefix (see common/sharding.py) and
+consolidates each shard on its own, optionally across a process pool. Every
+shard streams the id-sorted intermediates through the same merge join as
+create_consolidated_table.py, keeping only its own wallets, and writes its
+own segment file:
+
+    data/output/final_wallet_data.shard-003-of-016.csv
+
+Join chunks are sized from --memory-mb, split across the workers. Segments
+are written under a temporary name and renamed when the shard finishes.
+
+    python3 scripts/consolidation/consolidate_sharded.py [--delta] [--shards 16] [--workers 4] [--memory-mb 4096]
+    python3 scripts/upload/upload_delta.py --shards   # streams the delta segments to Dune
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import column_names, iter_sorted, iter_table, sort_all
+from final_table import DTYPES, FINAL_COLUMNS, VOLUME_COLUMNS, finalize
+from merge_join import cohort_chunks, merge_join
+from sharding import AddressTable, segment_path
+from wallet_ids import attach_ids
+
+# CONFIG
+SHARDS = 16
+WORKERS = 4
+MEMORY_CAP_MB = 4096 # Working memory shared by all workers (the parent's wallet dictionary comes on top)
+ROW_BYTES = 2000 # Rough peak cost of one in-flight joined row: source batches, merge copies, strings
+MIN_CHUNK_ROWS = 1000
+
+MODES = {
+    "full": {
+        "cohort": "data/input/final_active_wallets.csv",
+        "output": "data/output/final_wallet_data.csv",
+        "sources": [
+            ("data/intermediate/wallet_ages.csv", ['wallet_age_days', 'first_tx_timestamp']),
+            ("data/intermediate/wallet_volumes.csv", VOLUME_COLUMNS),
+            ("data/intermediate/wallet_gas_fees.csv", ['gas_fees_usd']),
+            ("data/intermediate/wallet_portfolio_ath_backup.csv", ['present_value_usd', 'ath_value_usd', 'top_tokens']),
+            ("data/intermediate/alchemy_eth_balances.csv", ['alchemy_eth_balance']),
+        ],
+    },
+    "delta": {
+        "cohort": "data/input/delta_wallets.csv",
+        "output": "data/output/final_wallet_data_delta.csv",
+        "sources": [
+            ("data/intermediate/wallet_ages_delta.csv", ['wallet_age_days', 'first_tx_timestamp']),
+            ("data/intermediate/wallet_volumes_delta.csv", VOLUME_COLUMNS),
+            ("data/intermediate/wallet_gas_fees_delta.csv", ['gas_fees_usd']),
+            ("data/intermediate/wallet_portfolio_ath_delta.csv", ['present_value_usd', 'ath_value_usd', 'top_tokens']),
+            ("data/intermediate/alchemy_eth_balances_delta.csv", ['alchemy_eth_balance']),
+        ],
+    },
+}
+
+def load_cohort(path, batch_rows):
+    """Cohort as a wallet_id-sorted frame of ids + tx_count, read and interned in batches."""
+    columns = [c for c in ['wallet', 'tx_count'] if c in column_names(path)]
+    parts = []
+    for batch in iter_table(path, columns=columns, dtypes=DTYPES, batch_rows=batch_rows):
+        parts.append(attach_ids(batch).reindex(columns=['wallet_id', 'tx_count']))
+    cohort = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['wallet_id', 'tx_count'])
+    return cohort.drop_duplicates(subset=['wallet_id']).sort_values('wallet_id', kind='stable', ignore_index=True)
+
+def consolidate_shard(shard, num_shards, cohort, sources, chunk_rows, output_file):
+    """Join one shard's cohort against every source and write its segment. Returns (shard, rows)."""
+    table = AddressTable()
+
+    def in_shard(batch):
+        ids = batch['wallet_id'].to_numpy()
+        known = batch[ids < len(table)] # ids interned after the table was opened can't be in this cohort
+        return known[table.prefix_shards(known['wallet_id'], num_shards) == shard]
+
+    streams = [
+        ((in_shard(b) for b in iter_sorted(path, columns, chunk_rows, DTYPES)), columns)
+        for path, columns in sources
+    ]
+
+    segment = segment_path(output_file, shard, num_shards)
+    tmp = segment + ".tmp"
+    pd.DataFrame(columns=FINAL_COLUMNS).to_csv(tmp, index=False) # header, even for an empty shard
+    rows = 0
+    for merged in merge_join(cohort_chunks(cohort, chunk_rows), streams):
+        final_chunk = finalize(merged, table.to_addresses)
+        final_chunk.to_csv(tmp, mode='a', header=False, index=False)
+        rows += len(final_chunk)
+    os.replace(tmp, segment)
+    return shard, rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Consolidate the final wallet table shard by shard")
+    parser.add_argument("--delta", action="store_true", help="Consolidate the delta cohort instead of the full one")
+    parser.add_argument("--shards", type=int, default=SHARDS, help="Number of address-prefix shards")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes (1 = run in this process)")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_CAP_MB, help="Working memory cap across all workers")
+    args = parser.parse_args()
+
+    mode = MODES["delta" if args.delta else "full"]
+    workers = max(1, min(args.workers, args.shards))
+    chunk_rows = max(MIN_CHUNK_ROWS, args.memory_mb * 1024 * 1024 // workers // ROW_BYTES)
+    print(f"🧩 Consolidating {mode['cohort']} in {args.shards} shards, {workers} workers, {chunk_rows} rows per chunk")
+
+    # Everything that writes shared state happens here, before any worker
+    # starts: interning the cohort and sorting the intermediates
+    start = time.time()
+    cohort = load_cohort(mode['cohort'], chunk_rows)
+    print(f"   - Base Wallets: {len(cohort)}")
+    sort_all([path for path, _ in mode['sources']])
+
+    base, ext = os.path.splitext(mode['output'])
+    for stale in glob.glob(f"{base}.shard-*{ext}"):
+        os.remove(stale) # segments from an earlier run, possibly with another shard count
+
+    shard_of = AddressTable().prefix_shards(cohort['wallet_id'], args.shards)
+    jobs = [
+        (shard, args.shards, cohort[shard_of == shard], mode['sources'], chunk_rows, mode['output'])
+        for shard in range(args.shards)
+    ]
+    del cohort
+
+    total_rows = 0
+    if workers == 1:
+        results = (consolidate_shard(*job) for job in jobs)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = (f.result() for f in as_completed([pool.submit(consolidate_shard, *job) for job in jobs]))
+    for done, (shard, rows) in enumerate(results, 1):
+        total_rows += rows
+        print(f"   ✅ Shard {shard}: {rows} rows ({done}/{args.shards})")
+    if workers > 1:
+        pool.shutdown()
+
+    print(f"✅ Saved {total_rows} rows in {args.shards} segments of {mode['output']} ({time.time() - start:.0f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,13 @@ import pandas as pd
 import requests
 import time
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import column_names, open_sorted, read_table
+from final_table import DTYPES, VOLUME_COLUMNS, finalize
+from merge_join import cohort_chunks, merge_join
+from wallet_ids import attach_ids, get_dictionary
 
 # Try to load env vars
 try:
@@ -23,133 +30,49 @@ if not DUNE_API_KEY:
 DUNE_NAMESPACE = "orbt_official"
 DUNE_TABLE_NAME = "orbt_wallet_final_v2" # Shortened name for better visibility
 UPLOAD_BATCH_SIZE = 5000
+CHUNK_ROWS = 50000 # Cohort wallets joined and written per step; bounds peak memory
 
 # 1. LOAD DATA
+# Only the base cohort is held in memory, as sorted integer wallet ids. Each
+# intermediate streams in wallet_id order (columnar.open_sorted: sorted and
+# decoded in parallel, one thread per source), so the merge below is a k-way
+# merge join over bounded chunks.
 print("📖 Loading datasets...")
 
 # Base List (Active Wallets)
-df_base = pd.read_csv("data/input/delta_wallets.csv")
-df_base['wallet'] = df_base['wallet'].astype(str).str.lower().str.strip()
+base_file = "data/input/delta_wallets.csv"
+df_base = read_table(base_file, columns=[c for c in ['wallet', 'tx_count'] if c in column_names(base_file)], dtypes=DTYPES)
+df_base = attach_ids(df_base) # validates + normalises once, assigns wallet_id
+df_base = df_base.drop_duplicates(subset=['wallet_id']).sort_values('wallet_id').reindex(columns=['wallet_id', 'tx_count'])
 print(f"   - Base Wallets: {len(df_base)}")
 
-# Wallet Age
-df_age = pd.read_csv("data/intermediate/wallet_ages_delta.csv")
-df_age['wallet'] = df_age['wallet'].astype(str).str.lower().str.strip()
-print(f"   - Age Data: {len(df_age)}")
-
-# Wallet Volumes
-df_vols = pd.read_csv("data/intermediate/wallet_volumes_delta.csv")
-df_vols['wallet'] = df_vols['wallet'].astype(str).str.lower().str.strip()
-print(f"   - Volume Data: {len(df_vols)}")
-
-# Gas Fees
-df_gas = pd.read_csv("data/intermediate/wallet_gas_fees_delta.csv")
-df_gas['wallet'] = df_gas['wallet'].astype(str).str.lower().str.strip()
-print(f"   - Gas Data: {len(df_gas)}")
+# Each source yields one row per wallet (the first one written), ascending by id
+sources = open_sorted([
+    # Wallet Age
+    ("data/intermediate/wallet_ages_delta.csv", ['wallet_age_days', 'first_tx_timestamp']),
+    # Wallet Volumes
+    ("data/intermediate/wallet_volumes_delta.csv", VOLUME_COLUMNS),
+    # Gas Fees
+    ("data/intermediate/wallet_gas_fees_delta.csv", ['gas_fees_usd']),
+    # Portfolio (SIM & Dune)
+    ("data/intermediate/wallet_portfolio_ath_delta.csv", ['present_value_usd', 'ath_value_usd', 'top_tokens']),
+    # Alchemy Balances
+    ("data/intermediate/alchemy_eth_balances_delta.csv", ['alchemy_eth_balance']),
+], dtypes=DTYPES)
 
-# Portfolio (SIM & Dune)
-df_sim = pd.read_csv("data/intermediate/wallet_portfolio_ath_delta.csv")
-df_sim['wallet'] = df_sim['wallet'].astype(str).str.lower().str.strip()
-# Deduplicate SIM data (keep last updated or just first)
-df_sim = df_sim.drop_duplicates(subset=['wallet'])
-print(f"   - Portfolio Data: {len(df_sim)}")
 
-# Alchemy Balances
-df_alc = pd.read_csv("data/intermediate/alchemy_eth_balances_delta.csv")
-df_alc['wallet'] = df_alc['wallet'].astype(str).str.lower().str.strip()
-df_alc = df_alc.drop_duplicates(subset=['wallet'])
-print(f"   - Alchemy Data: {len(df_alc)}")
+# 2. CLEAN & CALCULATE happens per joined chunk (final_table.finalize)
 
-
-# 2. MERGE DATA
+# 3. MERGE & SAVE (streaming, CHUNK_ROWS wallets at a time)
 print("🔄 Merging all datasets...")
-
-# Start with Base
-merged = df_base.copy()
-
-# Merge Age
-merged = pd.merge(merged, df_age[['wallet', 'wallet_age_days', 'first_tx_timestamp']], on='wallet', how='left')
-merged.rename(columns={'first_tx_timestamp': 'first_seen_date'}, inplace=True)
-
-# Merge Volumes
-vol_cols = ['wallet', 'total_dex_volume_usd', 'total_cex_volume_usd', 'total_lending_volume_usd', 'total_volume_usd_cis']
-merged = pd.merge(merged, df_vols[vol_cols], on='wallet', how='left')
-# Rename for final upload to match user request "Total Volume"
-merged.rename(columns={'total_volume_usd_cis': 'total_volume_usd'}, inplace=True)
-
-# Merge Gas
-merged = pd.merge(merged, df_gas[['wallet', 'gas_fees_usd']], on='wallet', how='left')
-
-# Merge Portfolio
-sim_cols = ['wallet', 'present_value_usd', 'ath_value_usd', 'top_tokens']
-merged = pd.merge(merged, df_sim[sim_cols], on='wallet', how='left')
-
-# Merge Alchemy
-merged = pd.merge(merged, df_alc[['wallet', 'alchemy_eth_balance']], on='wallet', how='left')
-
-
-# 3. CLEAN & CALCULATE
-print("🧹 Cleaning data...")
-
-# Fill NaNs for numeric columns with 0
-numeric_cols = [
-    'wallet_age_days', 
-    'total_dex_volume_usd', 'total_cex_volume_usd', 'total_lending_volume_usd',
-    'gas_fees_usd', 'present_value_usd', 'ath_value_usd', 'alchemy_eth_balance',
-    'total_volume_usd'
-]
-merged[numeric_cols] = merged[numeric_cols].fillna(0)
-
-# Cast to int
-merged['wallet_age_days'] = merged['wallet_age_days'].astype(int)
-merged['tx_count'] = merged['tx_count'].fillna(0).astype(int)
-
-# Calculate Alchemy USD Value
-ETH_PRICE = 3300 # Approx
-merged['alchemy_current_wallet_value'] = merged['alchemy_eth_balance'] * ETH_PRICE
-
-# Rename columns for final output
-final_df = merged[[
-    'wallet',
-    'tx_count',
-    'wallet_age_days',
-    'first_seen_date',
-    'gas_fees_usd',
-    'total_dex_volume_usd',
-    'total_cex_volume_usd',
-    'total_lending_volume_usd',
-    'alchemy_current_wallet_value',
-    'present_value_usd',
-    'ath_value_usd',
-    'top_tokens'
-]]
-
-final_df.columns = [
-    'wallet_address',
-    'tx_count',
-    'wallet_age_days',
-    'first_seen_date',
-    'gas_fees_usd',
-    'total_dex_volume_usd',
-    'total_cex_volume_usd',
-    'total_lending_volume_usd',
-    'alchemy_current_wallet_value',
-    'sim_current_wallet_value',
-    'sim_ath_wallet_value',
-    'top_tokens_held'
-]
-
-# Round decimals
-round_cols = [
-    'gas_fees_usd', 'total_dex_volume_usd', 'total_cex_volume_usd', 
-    'total_lending_volume_usd', 'alchemy_current_wallet_value',
-    'sim_current_wallet_value', 'sim_ath_wallet_value'
-]
-final_df[round_cols] = final_df[round_cols].round(2)
-
-# Save local CSV
-final_df.to_csv("data/output/final_wallet_data_delta.csv", index=False)
-print(f"✅ Saved final dataset: {len(final_df)} rows to final_wallet_data_delta.csv")
+wallets = get_dictionary()
+total_rows = 0
+for i, merged in enumerate(merge_join(cohort_chunks(df_base, CHUNK_ROWS), sources)):
+    final_chunk = finalize(merged, wallets.to_addresses)
+    # Save local CSV
+    final_chunk.to_csv("data/output/final_wallet_data_delta.csv", mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+    total_rows += len(final_chunk)
+print(f"✅ Saved final dataset: {total_rows} rows to data/output/final_wallet_data_delta.csv")
 
 
 
@@ -0,0 +1,107 @@
+"""
+Fold a delta consolidation into the master dataset.
+
+Upserts data/output/final_wallet_data_delta.csv into the wallet_id-partitioned
+master (see common/master_dataset.py): wallets already in the master get their
+row replaced, new wallets are appended, and only the partitions they fall in
+are rewritten. The first run seeds the master from data/output/final_wallet_data.csv,
+into a staging directory that is renamed into place only after the last chunk, so
+a seed that dies partway never looks like a master. --export re-writes that CSV
+from the master afterwards.
+
+The master remembers which version of final_wallet_data.csv it matches (seeded
+from or exported to). If the CSV has been rewritten since, e.g. by a full
+consolidation, the master is re-seeded from it before the upsert, so a stale
+master never overwrites newer full output on --export.
+
+    python3 scripts/consolidation/upsert_delta.py [--export]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from master_dataset import MasterDataset
+
+MASTER_FILE = "data/output/final_wallet_data.csv"
+DELTA_FILE = "data/output/final_wallet_data_delta.csv"
+SEED_CHUNK_ROWS = 200000 # Rows per upsert while seeding; bounds memory on the first run
+SOURCE_MARKER = "source.json" # In the master directory: stat of MASTER_FILE as of the last seed/export
+
+def _master_file_stat():
+    st = os.stat(MASTER_FILE)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+def record_source(master):
+    """Note that the master now matches MASTER_FILE as it is on disk."""
+    with open(os.path.join(master.directory, SOURCE_MARKER), "w") as f:
+        json.dump(_master_file_stat(), f)
+
+def is_stale(master):
+    """True when MASTER_FILE was rewritten after the master last matched it."""
+    if master.is_empty() or not os.path.exists(MASTER_FILE):
+        return False
+    marker = os.path.join(master.directory, SOURCE_MARKER)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            return json.load(f) != _master_file_stat()
+    # Master from before the marker existed: stale if the CSV is newer than every partition
+    return os.path.getmtime(MASTER_FILE) > master.last_modified()
+
+def seed(master):
+    if not os.path.exists(MASTER_FILE):
+        print(f"⚠️ {MASTER_FILE} not found; starting the master from the delta alone.")
+        return
+    print(f"🌱 Seeding master dataset from {MASTER_FILE}...")
+    # Seed into a staging directory; leftovers from a seed that crashed are discarded
+    staging = MasterDataset(directory=master.directory + ".seeding", partition_ids=master.partition_ids)
+    shutil.rmtree(staging.directory, ignore_errors=True)
+    total = 0
+    for chunk in pd.read_csv(MASTER_FILE, chunksize=SEED_CHUNK_ROWS):
+        staging.upsert(chunk)
+        total += len(chunk)
+    if total:
+        # Swap the old master aside before deleting it; a crash in between leaves no
+        # master, and the next run seeds again from the same CSV
+        old = master.directory + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.isdir(master.directory):
+            os.replace(master.directory, old)
+        os.replace(staging.directory, master.directory)
+        shutil.rmtree(old, ignore_errors=True)
+        record_source(master)
+    print(f"   Seeded {total} rows into {len(master.partitions())} partitions.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upsert the delta consolidation into the master dataset")
+    parser.add_argument("--export", action="store_true", help=f"Rewrite {MASTER_FILE} from the master afterwards")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(DELTA_FILE):
+        print(f"❌ {DELTA_FILE} not found. Run create_consolidated_table_delta.py first.")
+        sys.exit(1)
+
+    master = MasterDataset()
+    if master.is_empty():
+        seed(master)
+    elif is_stale(master):
+        print(f"⚠️ {MASTER_FILE} changed since the master last matched it (full consolidation?); re-seeding.")
+        seed(master)
+
+    delta = pd.read_csv(DELTA_FILE)
+    print(f"🔄 Upserting {len(delta)} delta rows...")
+    replaced, added, touched = master.upsert(delta)
+    print(f"✅ {replaced} rows replaced, {added} added; rewrote {len(touched)} of {len(master.partitions())} partitions.")
+
+    if args.export:
+        total = master.export_csv(MASTER_FILE)
+        if total:
+            record_source(master)
+        print(f"💾 Exported {total} rows to {MASTER_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
-import requests
 import pandas as pd
 import time
-import concurrent.futures
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from snapshot import block_tag, get_snapshot_cache
+from processed_index import ProcessedIndex
+from work_queue import WorkQueue
+from sharding import parse_shard_args, segment_path, select_shard
+from columnar import append_rows, compact, read_table
+from http_client import get_session
 
 # Try to load env vars
 try:
@@ -29,35 +36,61 @@ ALCHEMY_RPC_URL = f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
 INPUT_FILE = "data/input/delta_wallets.csv"
 OUTPUT_FILE = "data/intermediate/alchemy_eth_balances_delta.csv"
 MAX_WORKERS = 5
+http = get_session() # pooled connections, shared across stages in --in-process pipeline runs
 BATCH_SIZE = 50  # Alchemy supports batch requests
 
+# Block-pinned snapshot (None when reading at "latest"); set by main()
+snapshot_cache = None
+
+# Compact resume index (OUTPUT_FILE.idx), appended on every flush
+processed_index = ProcessedIndex(OUTPUT_FILE)
+
+# Per-wallet status / attempts / last error (see work_queue); a run fetches only pending or failed wallets
+work_queue = WorkQueue(OUTPUT_FILE)
+output_file = OUTPUT_FILE # this run's segment of OUTPUT_FILE; main() re-points it and the two above
+
+def save_results(rows):
+    # Appends a row group to the intermediate (see columnar)
+    df = pd.DataFrame(rows)
+    append_rows(output_file, df)
+    processed_index.add_many(df['wallet'])
+    work_queue.complete(df['wallet'])
+
 def get_eth_balances_batch(wallets):
+    # Serve what we can from the snapshot cache (raw wei as int)
+    cached = snapshot_cache.get_many("eth_getBalance", wallets) if snapshot_cache else {}
+    missing = [w for w in wallets if w not in cached]
+    # If the RPC fails, cached wallets are still returned; only the misses are marked failed
+    hits = [{"wallet": w, "alchemy_eth_balance": cached[w] / 1e18} for w in wallets if w in cached]
+    if not missing:
+        return hits
+
     payload = []
-    for i, wallet in enumerate(wallets):
+    for i, wallet in enumerate(missing):
         payload.append({
             "jsonrpc": "2.0",
             "id": i,
             "method": "eth_getBalance",
-            "params": [wallet, "latest"]
+            "params": [wallet, block_tag()]
         })
     
     # Retry logic
     for attempt in range(3):
         try:
-            response = requests.post(ALCHEMY_RPC_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
+            response = http.post(ALCHEMY_RPC_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
             if response.status_code == 200:
                 break
             elif response.status_code == 429:
                 time.sleep(2 * (attempt + 1))
             else:
                 print(f"❌ Error: {response.status_code} - {response.text}")
-                return []
+                return hits
         except Exception as e:
             print(f"❌ Exception: {e}")
             time.sleep(1)
     else:
         print("❌ Max retries exceeded for batch")
-        return []
+        return hits
 
     try:
         results = response.json()
@@ -66,104 +99,109 @@ def get_eth_balances_batch(wallets):
         # Map id to wallet
         results_map = {r['id']: r for r in results if 'result' in r}
         
-        for i, wallet in enumerate(wallets):
+        fetched = {}
+        for i, wallet in enumerate(missing):
             res = results_map.get(i)
             if res:
-                # Convert hex to ETH
-                val_wei = int(res['result'], 16)
-                val_eth = val_wei / 1e18
-                parsed.append({"wallet": wallet, "alchemy_eth_balance": val_eth})
-            else:
-                parsed.append({"wallet": wallet, "alchemy_eth_balance": 0.0})
+                fetched[wallet] = int(res['result'], 16)
+
+        if snapshot_cache:
+            snapshot_cache.put_many("eth_getBalance", fetched)
+
+        for wallet in wallets:
+            val_wei = cached.get(wallet, fetched.get(wallet))
+            if val_wei is not None:
+                # Convert wei to ETH
+                parsed.append({"wallet": wallet, "alchemy_eth_balance": val_wei / 1e18})
+            # No result: left out (not written as 0) so the work queue retries it
         return parsed
     except Exception as e:
         print(f"❌ Exception: {e}")
-        return []
-
-def main():
+        return hits
+
+def main(wallets=None, shard=0, num_shards=1, session=None, snapshot=None):
+    # wallets: an already-normalised cohort (in-process pipeline runs); None reads INPUT_FILE
+    # shard / num_shards: fetch only that hash shard, into its own segment file (pipeline/merge_shards.py combines them)
+    # session / snapshot: the pipeline's shared HTTP session and snapshot cache; None uses this process's own
+    global output_file, processed_index, work_queue, http, snapshot_cache
+    http, snapshot_cache = session or get_session(), snapshot if snapshot is not None else get_snapshot_cache()
+    output_file = segment_path(OUTPUT_FILE, shard, num_shards)
+    processed_index, work_queue = ProcessedIndex(output_file), WorkQueue(output_file)
     if "REPLACE" in ALCHEMY_API_KEY:
         print("⚠️  PLEASE UPDATE THE 'ALCHEMY_API_KEY' IN THE SCRIPT FIRST!")
         return
 
-    print(f"📖 Reading {INPUT_FILE}...")
-    try:
-        # Read all wallets from CSV
-        # We need to handle potential header 'wallet'
-        df = pd.read_csv(INPUT_FILE)
-        
-        # Check if we have 'wallet' column
-        if 'wallet' in df.columns:
-             wallets = [str(x).strip() for x in df['wallet'].tolist()]
-        else:
-             # Fallback to first column
-             wallets = [str(x).strip() for x in df.iloc[:, 0].tolist()]
-             
-    except Exception as e:
-        print(f"❌ Error reading input file: {e}")
-        return
+    print(f"📌 Reading balances at block: {block_tag()}")
+    if wallets is None:
+        print(f"📖 Reading {INPUT_FILE}...")
+        try:
+            # Read all wallets from CSV
+            # We need to handle potential header 'wallet'
+            df = read_table(INPUT_FILE)
+            
+            # Check if we have 'wallet' column
+            if 'wallet' in df.columns:
+                 wallets = [str(x).strip() for x in df['wallet'].tolist()]
+            else:
+                 # Fallback to first column
+                 wallets = [str(x).strip() for x in df.iloc[:, 0].tolist()]
+                 
+        except Exception as e:
+            print(f"❌ Error reading input file: {e}")
+            return
 
-    # Normalize wallets
-    wallets = [str(w).strip().lower() for w in wallets]
+        # Normalize wallets
+        wallets = [str(w).strip().lower() for w in wallets]
 
     # Filter (Removed per user request)
     # if 'tx_count' in df.columns:
     #     df = df[(df['tx_count'] > 0) & (df['tx_count'] <= 20000)]
 
     # Load existing results to skip
-    if os.path.exists(OUTPUT_FILE):
-        try:
-            df_existing = pd.read_csv(OUTPUT_FILE)
-            # FORCE string type for all existing wallets
-            existing_wallets = set(df_existing['wallet'].astype(str).str.lower().str.strip())
-            
-            # FORCE string type for input wallets
-            wallets_set = set([str(w).lower().strip() for w in wallets])
-            
-            print(f"⏩ Found {len(existing_wallets)} already processed. Skipping...")
-            
-            # DEBUG: Print sample wallets from each to check formatting
-            print(f"Sample Input: {list(wallets_set)[:3]}")
-            print(f"Sample Existing: {list(existing_wallets)[:3]}")
- 
-            remaining_set = wallets_set - existing_wallets
-            wallets = list(remaining_set)
-            
-            # Sanity Check
-            print(f"DEBUG: Total unique input wallets: {len(wallets_set)}")
-            print(f"DEBUG: Existing unique processed: {len(existing_wallets)}")
-            print(f"DEBUG: Remaining to process: {len(wallets)}")
-            
-        except Exception as e:
-            print(f"⚠️ Error reading existing output: {e}")
-
-    if not wallets:
+    processed_index.load()
+    # Keep this worker's hash shard (every wallet when unsharded)
+    wallets = select_shard(wallets, shard, num_shards)
+    if num_shards > 1:
+        print(f"🧩 Shard {shard}/{num_shards}: {len(wallets)} wallets -> {output_file}")
+
+    total_unique = len(set(wallets))
+    remaining = work_queue.sync(wallets, processed_index)
+    if len(processed_index):
+        print(f"⏩ Found {len(processed_index)} already processed. Skipping...")
+        print(f"DEBUG: Total unique input wallets: {total_unique}")
+        print(f"DEBUG: Remaining to process: {remaining}")
+
+    if not remaining:
+        work_queue.finish() # reports wallets that are out of attempts
         print("✅ All wallets processed!")
         return
 
-    print(f"🚀 Processing {len(wallets)} wallets in batches of {BATCH_SIZE}...")
+    print(f"🚀 Processing {remaining} wallets in batches of {BATCH_SIZE}...")
     
-    all_results = []
-
-    # Process in chunks of BATCH_SIZE
-    chunks = [wallets[i:i + BATCH_SIZE] for i in range(0, len(wallets), BATCH_SIZE)]
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(get_eth_balances_batch, chunk): chunk for chunk in chunks}
-        
-        processed = 0
-        for future in concurrent.futures.as_completed(futures):
-            res = future.result()
-            all_results.extend(res)
-            processed += len(res)
-            if processed % 1000 == 0:
-                print(f"⏳ Processed {processed}/{len(wallets)}...")
-
-    print(f"💾 Saving results to {OUTPUT_FILE}...")
-    # Append if file exists, else write new
-    mode = 'a' if os.path.exists(OUTPUT_FILE) else 'w'
-    header = not os.path.exists(OUTPUT_FILE)
-    pd.DataFrame(all_results).to_csv(OUTPUT_FILE, mode=mode, header=header, index=False)
-    print(f"✅ Done! Added {len(all_results)} new records.")
+    pending = []
+    saved = 0
+
+    # Workers lease batches of BATCH_SIZE from the queue as they go
+    processed = 0
+    for res in work_queue.process(get_eth_balances_batch, MAX_WORKERS, BATCH_SIZE):
+        pending.extend(res)
+        processed += len(res)
+        if processed % 1000 == 0:
+            print(f"⏳ Processed {processed}/{remaining}...")
+
+        # Save incrementally so an interrupted run resumes where it stopped
+        if len(pending) >= 5000:
+            save_results(pending)
+            saved += len(pending)
+            pending = []
+
+    print(f"💾 Saving results to {output_file}...")
+    if pending:
+        save_results(pending)
+        saved += len(pending)
+    compact(output_file)
+    work_queue.finish() # raises if any wallet is left undone
+    print(f"✅ Done! Added {saved} new records.")
 
 if __name__ == "__main__":
-    main()
+    main(None, *parse_shard_args("Fetch ETH balances via Alchemy"))
@@ -1,10 +1,16 @@
-import requests
 import pandas as pd
 import time
-import concurrent.futures
 import os
+import sys
 from threading import Lock
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import append_rows, compact, exists, read_table
+from http_client import get_session
+from processed_index import ProcessedIndex
+from work_queue import WorkQueue
+from sharding import parse_shard_args, segment_path, select_shard
+
 # Try to load env vars
 try:
     from dotenv import load_dotenv
@@ -26,10 +32,18 @@ ALCHEMY_URL = f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
 INPUT_FILE = "data/input/delta_wallets.csv"
 OUTPUT_FILE = "data/intermediate/wallet_gas_fees_delta.csv"
 MAX_WORKERS = 5 # Lower workers to avoid rate limits with heavy batching
+http = get_session() # pooled connections, shared across stages in --in-process pipeline runs
 
-results = []
+results = [] # Rows not yet flushed to OUTPUT_FILE
 results_lock = Lock()
 
+# Compact resume index (OUTPUT_FILE.idx), appended on every flush
+processed_index = ProcessedIndex(OUTPUT_FILE)
+
+# Per-wallet status / attempts / last error (see work_queue); a run fetches only pending or failed wallets
+work_queue = WorkQueue(OUTPUT_FILE)
+output_file = OUTPUT_FILE # this run's segment of OUTPUT_FILE; main() re-points it and the two above
+
 # Cache for ETH Price (simple static for now, or fetch once)
 ETH_PRICE = 3300.0 
 
@@ -51,14 +65,24 @@ def get_recent_txs(wallet):
         ]
     }
     
-    try:
-        response = requests.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("result", {}).get("transfers", [])
-    except:
-        pass
-    return []
+    error = None
+    for attempt in range(3):
+        try:
+            response = http.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
+            if response.status_code == 200:
+                data = response.json()
+                return data.get("result", {}).get("transfers", [])
+            elif response.status_code == 429:
+                error = "HTTP 429"
+                time.sleep(2 * (attempt + 1))
+            else:
+                error = f"HTTP {response.status_code}"
+                break
+        except Exception as e:
+            error = e
+            time.sleep(1)
+    # Raise rather than return "no transfers", so the work queue records the failure and retries
+    raise RuntimeError(f"alchemy_getAssetTransfers failed: {error}")
 
 def get_gas_fees_batch(tx_hashes):
     if not tx_hashes:
@@ -75,25 +99,24 @@ def get_gas_fees_batch(tx_hashes):
         
     total_gas_eth = 0.0
     
-    # Send batch
-    try:
-        response = requests.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=30)
-        if response.status_code == 200:
-            results_batch = response.json()
-            if not isinstance(results_batch, list):
-                results_batch = [results_batch]
-                
-            for res in results_batch:
-                if 'result' in res and res['result']:
-                    receipt = res['result']
-                    gas_used = int(receipt.get('gasUsed', '0x0'), 16)
-                    effective_gas_price = int(receipt.get('effectiveGasPrice', '0x0'), 16)
-                    
-                    fee_wei = gas_used * effective_gas_price
-                    fee_eth = fee_wei / 1e18
-                    total_gas_eth += fee_eth
-    except Exception as e:
-        print(f"Batch Error: {e}")
+    # Send batch. Errors raise (a partial sum would be saved as the wallet's fee total)
+    response = http.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=30)
+    if response.status_code != 200:
+        raise RuntimeError(f"eth_getTransactionReceipt batch failed: HTTP {response.status_code}")
+    results_batch = response.json()
+    if not isinstance(results_batch, list):
+        results_batch = [results_batch]
+
+    receipts = [res['result'] for res in results_batch if res.get('result')]
+    if len(receipts) < len(tx_hashes):
+        raise RuntimeError(f"Missing {len(tx_hashes) - len(receipts)} of {len(tx_hashes)} receipts")
+    for receipt in receipts:
+        gas_used = int(receipt.get('gasUsed', '0x0'), 16)
+        effective_gas_price = int(receipt.get('effectiveGasPrice', '0x0'), 16)
+        
+        fee_wei = gas_used * effective_gas_price
+        fee_eth = fee_wei / 1e18
+        total_gas_eth += fee_eth
         
     return total_gas_eth
 
@@ -101,7 +124,8 @@ def process_wallet(wallet):
     # 1. Get recent txs
     transfers = get_recent_txs(wallet)
     if not transfers:
-        return None
+        # No outgoing transfers: a real zero, saved rather than retried
+        return {"wallet": wallet, "gas_fees_usd": 0.0, "total_transactions_analyzed": 0}
         
     # 2. Extract hashes
     hashes = [t['hash'] for t in transfers if 'hash' in t]
@@ -117,60 +141,75 @@ def process_wallet(wallet):
         # Note: 'total_transactions_3y' is just tx_count from our other file
     }
 
-def main():
+def save_results():
+    # Append unsaved rows as one row group (see columnar) and mark them processed
+    if not results:
+        return 0
+    df = pd.DataFrame(results)
+    append_rows(output_file, df)
+    processed_index.add_many(df['wallet'])
+    work_queue.complete(df['wallet'])
+    results.clear()
+    return len(df)
+
+def main(wallets=None, shard=0, num_shards=1, session=None, snapshot=None):
+    # wallets: an already-normalised cohort (in-process pipeline runs); None reads INPUT_FILE
+    # shard / num_shards: fetch only that hash shard, into its own segment file (pipeline/merge_shards.py combines them)
+    # session / snapshot: the pipeline's shared HTTP session and snapshot cache; None uses this process's own
+    global output_file, processed_index, work_queue, http
+    # snapshot is unused: these metrics are read from transfer history, not block-pinned state
+    http = session or get_session()
+    results.clear() # nothing carries over from an earlier in-process call
+    output_file = segment_path(OUTPUT_FILE, shard, num_shards)
+    processed_index, work_queue = ProcessedIndex(output_file), WorkQueue(output_file)
     print("🚀 Starting Gas Fee Calculator (Last 100 Txs)...")
     
-    # 0. Load Existing Results (Resume capability)
-    processed_wallets = set()
-    if os.path.exists(OUTPUT_FILE):
-        try:
-            df_existing = pd.read_csv(OUTPUT_FILE)
-            if 'wallet' in df_existing.columns:
-                processed_wallets = set(df_existing['wallet'].astype(str).str.lower().str.strip())
-                results.extend(df_existing.to_dict('records'))
-                print(f"🔄 Resuming: Found {len(processed_wallets)} existing records in {OUTPUT_FILE}")
-        except Exception as e:
-            print(f"⚠️ Error reading existing output: {e}")
+    # 0. Resume from the index of wallets already saved
+    processed_index.load()
+    if len(processed_index):
+        print(f"🔄 Resuming: Found {len(processed_index)} existing records in {output_file}")
 
-    if not os.path.exists(INPUT_FILE):
-        print(f"❌ Input file {INPUT_FILE} not found.")
-        return
+    if wallets is None:
+        if not exists(INPUT_FILE):
+            print(f"❌ Input file {INPUT_FILE} not found.")
+            return
+            
+        df = read_table(INPUT_FILE)
+        df['wallet'] = df['wallet'].astype(str).str.lower().str.strip()
         
-    df = pd.read_csv(INPUT_FILE)
-    df['wallet'] = df['wallet'].astype(str).str.lower().str.strip()
-    
-    # Filter (Removed per user request)
-    # if 'tx_count' in df.columns:
-    #     df = df[(df['tx_count'] > 0) & (df['tx_count'] <= 20000)]
+        # Filter (Removed per user request)
+        # if 'tx_count' in df.columns:
+        #     df = df[(df['tx_count'] > 0) & (df['tx_count'] <= 20000)]
+        wallets = df['wallet'].tolist()
     
+    # Keep this worker's hash shard (every wallet when unsharded)
+    wallets = select_shard(wallets, shard, num_shards)
+    if num_shards > 1:
+        print(f"🧩 Shard {shard}/{num_shards}: {len(wallets)} wallets -> {output_file}")
+
     # Exclude already processed
-    df = df[~df['wallet'].isin(processed_wallets)]
-    print(f"✅ Active Retail Wallets remaining: {len(df)}")
-    
-    wallets = df['wallet'].tolist()
+    total = work_queue.sync(wallets, processed_index)
+    print(f"✅ Active Retail Wallets remaining: {total}")
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_wallet, w): w for w in wallets}
-        
-        total = len(wallets)
-        completed = 0
+    # Workers lease wallets from the queue as they go
+    completed = 0
+    for res in work_queue.process(process_wallet, MAX_WORKERS):
+        if res:
+            results.append(res)
         
-        for future in concurrent.futures.as_completed(futures):
-            res = future.result()
-            if res:
-                results.append(res)
+        completed += 1
+        if completed % 50 == 0: # Slower progress updates
+            print(f"Progress: {completed}/{total} ({completed/total:.1%})")
             
-            completed += 1
-            if completed % 50 == 0: # Slower progress updates
-                print(f"Progress: {completed}/{total} ({completed/total:.1%})")
-                
-            if completed % 200 == 0:
-                pd.DataFrame(results).to_csv(OUTPUT_FILE, index=False)
-                print(f"💾 Saved {len(results)} rows")
+        if completed % 200 == 0:
+            saved = save_results()
+            print(f"💾 Saved {saved} rows")
 
     # Final Save
-    pd.DataFrame(results).to_csv(OUTPUT_FILE, index=False)
-    print(f"🎉 Done! Saved to {OUTPUT_FILE}")
+    save_results()
+    compact(output_file)
+    work_queue.finish() # raises if any wallet is left undone
+    print(f"🎉 Done! Saved to {output_file}")
 
 if __name__ == "__main__":
-    main()
+    main(None, *parse_shard_args("Fetch gas fees over recent transactions"))
@@ -0,0 +1,332 @@
+import pandas as pd
+import time
+import os
+import sys
+from functools import partial
+from threading import Lock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from snapshot import get_snapshot_block, get_snapshot_cache
+from processed_index import ProcessedIndex
+from work_queue import WorkQueue
+from sharding import parse_shard_args, segment_path, select_shard
+from columnar import append_rows, compact, exists, read_table
+from http_client import get_session
+
+# Try to load env vars
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    if os.path.exists(".env"):
+        with open(".env") as f:
+            for line in f:
+                if line.strip() and not line.startswith("#"):
+                    key, value = line.strip().split("=", 1)
+                    os.environ[key] = value
+
+# ---------------------------------------------------------
+# 🔑 CONFIGURATION
+# ---------------------------------------------------------
+ALCHEMY_API_KEY = os.getenv("ALCHEMY_API_KEY")
+if not ALCHEMY_API_KEY:
+    raise ValueError("Please set ALCHEMY_API_KEY in .env file")
+
+ALCHEMY_RPC_URL = f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
+
+INPUT_FILE = "data/input/final_active_wallets.csv"
+OUTPUT_FILE = "data/intermediate/multicall_token_balances.csv"
+MAX_WORKERS = 5
+http = get_session() # pooled connections, shared across stages in --in-process pipeline runs
+CALLS_PER_MULTICALL = 2000  # (wallet, token) pairs packed into one eth_call
+
+# Multicall3 is deployed at the same address on every EVM chain
+MULTICALL3_ADDRESS = "0xca11bde05977b3631167028862be2a173976ca11"
+AGGREGATE3_SELECTOR = "82ad56cb"   # aggregate3((address,bool,bytes)[])
+BALANCE_OF_SELECTOR = "70a08231"   # balanceOf(address)
+GET_ETH_BALANCE_SELECTOR = "4d2301cc"  # Multicall3.getEthBalance(address)
+
+# Pricing Constants (Approximation) - same snapshot as TOKEN_PRICES in fetch_volumes.py
+ETH_PRICE = 3300.0
+
+# Curated liquid tokens: symbol -> (mainnet contract, decimals, price_usd)
+# "native" is read through Multicall3.getEthBalance so ETH lands in the same call.
+CURATED_TOKENS = {
+    "ETH": ("native", 18, ETH_PRICE),
+    "WETH": ("0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2", 18, ETH_PRICE),
+    "USDC": ("0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48", 6, 1.0),
+    "USDT": ("0xdac17f958d2ee523a2206206994597c13d831ec7", 6, 1.0),
+    "DAI": ("0x6b175474e89094c44da98b954eedeac495271d0f", 18, 1.0),
+    "USDE": ("0x4c9edd5852cd905f086c759e8383e09bff1e68b3", 18, 1.0),
+    "PYUSD": ("0x6c3ea9036406852006290770bedfcaba0e23a0e8", 6, 1.0),
+    "GUSD": ("0x056fd409e1d7a124bd7017459dfea2f387b6d5cd", 2, 1.0),
+}
+
+results = []
+results_lock = Lock()
+processed_count = 0
+count_lock = Lock()
+
+# Block-pinned snapshot (None when no pipeline snapshot is set); set by main()
+snapshot_cache = None
+
+# Compact resume index (OUTPUT_FILE.idx), appended on every flush
+processed_index = ProcessedIndex(OUTPUT_FILE)
+
+# Per-wallet status / attempts / last error (see work_queue); a run fetches only pending or failed wallets
+work_queue = WorkQueue(OUTPUT_FILE)
+output_file = OUTPUT_FILE # this run's segment of OUTPUT_FILE; main() re-points it and the two above
+
+def get_latest_block():
+    payload = {"jsonrpc": "2.0", "id": 1, "method": "eth_blockNumber", "params": []}
+    for attempt in range(3):
+        try:
+            response = http.post(ALCHEMY_RPC_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
+            if response.status_code == 200:
+                return int(response.json()["result"], 16)
+            elif response.status_code == 429:
+                time.sleep(2 * (attempt + 1))
+        except Exception as e:
+            print(f"❌ Exception: {e}")
+            time.sleep(1)
+    return None
+
+def _word(value):
+    """Encode an int as one 32-byte ABI word (hex, no 0x)."""
+    return format(value, "064x")
+
+def _address_word(address):
+    return address.lower().replace("0x", "").rjust(64, "0")
+
+def encode_aggregate3(calls):
+    """
+    ABI-encode aggregate3 calldata for a list of (target, calldata_hex) pairs.
+    Every call is sent with allowFailure=True so one bad token never reverts the batch.
+    """
+    encoded_calls = []
+    for target, call_data in calls:
+        data_len = len(call_data) // 2
+        padded = call_data.ljust(((data_len + 31) // 32) * 64, "0")
+        # tuple(address target, bool allowFailure, bytes callData): bytes lives after the 3 head words
+        encoded_calls.append(_address_word(target) + _word(1) + _word(0x60) + _word(data_len) + padded)
+
+    # Array head: length, then one offset per element (relative to the first offset word)
+    offsets = []
+    position = 32 * len(encoded_calls)
+    for enc in encoded_calls:
+        offsets.append(_word(position))
+        position += len(enc) // 2
+
+    return "0x" + AGGREGATE3_SELECTOR + _word(0x20) + _word(len(encoded_calls)) + "".join(offsets) + "".join(encoded_calls)
+
+def decode_aggregate3(result_hex):
+    """Decode aggregate3's (bool success, bytes returnData)[] into a list of ints (None on failure)."""
+    raw = bytes.fromhex(result_hex[2:] if result_hex.startswith("0x") else result_hex)
+
+    def read_word(pos):
+        return int.from_bytes(raw[pos:pos + 32], "big")
+
+    array_start = read_word(0)
+    count = read_word(array_start)
+    heads = array_start + 32
+
+    values = []
+    for i in range(count):
+        tuple_start = heads + read_word(heads + 32 * i)
+        success = read_word(tuple_start) == 1
+        data_start = tuple_start + read_word(tuple_start + 32)
+        data_len = read_word(data_start)
+        if success and data_len >= 32:
+            values.append(read_word(data_start + 32))
+        else:
+            values.append(None)
+    return values
+
+def build_calls(wallets):
+    calls = []
+    for wallet in wallets:
+        for symbol, (token, _decimals, _price) in CURATED_TOKENS.items():
+            if token == "native":
+                calls.append((MULTICALL3_ADDRESS, GET_ETH_BALANCE_SELECTOR + _address_word(wallet)))
+            else:
+                calls.append((token, BALANCE_OF_SELECTOR + _address_word(wallet)))
+    return calls
+
+def fetch_raw_balances(wallets, block_number):
+    """Return {wallet: [raw balance per CURATED_TOKENS entry]} for one multicall, or None on failure."""
+    payload = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "eth_call",
+        "params": [{"to": MULTICALL3_ADDRESS, "data": encode_aggregate3(build_calls(wallets))}, hex(block_number)]
+    }
+
+    # Retry logic
+    for attempt in range(3):
+        try:
+            response = http.post(ALCHEMY_RPC_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=30)
+            if response.status_code == 200:
+                break
+            elif response.status_code == 429:
+                time.sleep(2 * (attempt + 1))
+            else:
+                print(f"❌ Error: {response.status_code} - {response.text}")
+                return None
+        except Exception as e:
+            print(f"❌ Exception: {e}")
+            time.sleep(1)
+    else:
+        print("❌ Max retries exceeded for batch")
+        return None
+
+    try:
+        data_json = response.json()
+        if "result" not in data_json:
+            print(f"❌ RPC Error: {data_json.get('error')}")
+            return None
+        values = decode_aggregate3(data_json["result"])
+    except Exception as e:
+        print(f"❌ Parse Exception: {e}")
+        return None
+
+    n = len(CURATED_TOKENS)
+    return {wallet: values[w_idx * n:(w_idx + 1) * n] for w_idx, wallet in enumerate(wallets)}
+
+def get_balances_batch(wallets, block_number):
+    symbols = list(CURATED_TOKENS.keys())
+    raw_by_wallet = {}
+
+    # Serve fully cached wallets from the snapshot
+    if snapshot_cache:
+        per_token = {s: snapshot_cache.get_many(f"balanceOf:{CURATED_TOKENS[s][0]}", wallets) for s in symbols}
+        for wallet in wallets:
+            if all(wallet in per_token[s] for s in symbols):
+                raw_by_wallet[wallet] = [per_token[s][wallet] for s in symbols]
+
+    missing = [w for w in wallets if w not in raw_by_wallet]
+    fetched = fetch_raw_balances(missing, block_number) if missing else {}
+    if fetched is not None:
+        raw_by_wallet.update(fetched)
+        if snapshot_cache:
+            for t_idx, symbol in enumerate(symbols):
+                snapshot_cache.put_many(
+                    f"balanceOf:{CURATED_TOKENS[symbol][0]}",
+                    {w: fetched[w][t_idx] for w in missing if fetched[w][t_idx] is not None},
+                )
+
+    parsed = []
+    for wallet in wallets:
+        raw_balances = raw_by_wallet.get(wallet)
+        # A failed multicall or sub-call (success=false) is not a 0 balance: leave the wallet
+        # out so the work queue retries it
+        if raw_balances is None or any(raw is None for raw in raw_balances):
+            continue
+        row = {"wallet": wallet, "block_number": block_number}
+        total_usd = 0.0
+        token_count = 0
+        for t_idx, symbol in enumerate(symbols):
+            _token, decimals, price = CURATED_TOKENS[symbol]
+            amount = raw_balances[t_idx] / (10 ** decimals)
+            row[f"{symbol.lower()}_balance"] = amount
+            if amount > 0:
+                token_count += 1
+                total_usd += amount * price
+        row["curated_value_usd"] = round(total_usd, 2)
+        row["curated_token_count"] = token_count
+        parsed.append(row)
+    return parsed
+
+def save_results(rows):
+    # Appends a row group to the intermediate (see columnar)
+    df = pd.DataFrame(rows)
+    append_rows(output_file, df)
+    processed_index.add_many(df['wallet'])
+    work_queue.complete(df['wallet'])
+
+def process_batch(data):
+    # Buffer one fetched batch's rows
+    global processed_count
+
+    with results_lock:
+        results.extend(data)
+
+        # Save incrementally
+        if len(results) >= 5000:
+            save_results(results)
+            results.clear()
+
+    with count_lock:
+        processed_count += len(data)
+        if processed_count % 1000 < len(data):
+            print(f"⏳ Processed {processed_count} wallets...")
+
+def main(wallets=None, shard=0, num_shards=1, session=None, snapshot=None):
+    # wallets: an already-normalised cohort (in-process pipeline runs); None reads INPUT_FILE
+    # shard / num_shards: fetch only that hash shard, into its own segment file (pipeline/merge_shards.py combines them)
+    # session / snapshot: the pipeline's shared HTTP session and snapshot cache; None uses this process's own
+    global output_file, processed_index, work_queue, http, snapshot_cache, processed_count
+    output_file = segment_path(OUTPUT_FILE, shard, num_shards)
+    processed_index, work_queue = ProcessedIndex(output_file), WorkQueue(output_file)
+    # Nothing carries over from an earlier in-process call
+    http, snapshot_cache = session or get_session(), snapshot if snapshot is not None else get_snapshot_cache()
+    results.clear()
+    processed_count = 0
+    print("🚀 Starting Multicall Curated Balance Fetcher...")
+
+    if wallets is None:
+        if not exists(INPUT_FILE):
+            print(f"❌ Input file {INPUT_FILE} not found")
+            return
+
+        df = read_table(INPUT_FILE)
+        if 'wallet' in df.columns:
+            wallets = df['wallet'].astype(str).tolist()
+        else:
+            wallets = df.iloc[:, 0].astype(str).tolist()
+        wallets = [w.strip().lower() for w in wallets]
+
+    # Filter processed
+    processed_index.load()
+    if len(processed_index):
+        print(f"⏩ Found {len(processed_index)} already processed. Skipping...")
+
+    # Keep this worker's hash shard (every wallet when unsharded)
+    wallets = select_shard(wallets, shard, num_shards)
+    if num_shards > 1:
+        print(f"🧩 Shard {shard}/{num_shards}: {len(wallets)} wallets -> {output_file}")
+
+    remaining = work_queue.sync(wallets, processed_index)
+    print(f"📊 Total to process: {remaining}")
+
+    if not remaining:
+        work_queue.finish() # reports wallets that are out of attempts
+        print("✅ All done!")
+        return
+
+    # Pin every read to one block so the whole run is a consistent snapshot
+    block_number = get_snapshot_block() or get_latest_block()
+    if block_number is None:
+        print("❌ Failed to get block number")
+        return
+    print(f"📌 Reading balances at block {block_number}")
+
+    # Pack as many wallets as fit into CALLS_PER_MULTICALL (wallet, token) pairs;
+    # workers lease one multicall's worth of wallets from the queue at a time
+    wallets_per_call = max(1, CALLS_PER_MULTICALL // len(CURATED_TOKENS))
+    print(f"🚀 Multicalls of up to {wallets_per_call} wallets x {len(CURATED_TOKENS)} tokens")
+
+    for data in work_queue.process(partial(get_balances_batch, block_number=block_number), MAX_WORKERS, wallets_per_call):
+        process_batch(data)
+
+    # Flush final
+    with results_lock:
+        if results:
+            save_results(results)
+            results.clear()
+    compact(output_file)
+    work_queue.finish() # raises if any wallet is left undone
+
+    print("🎉 Done fetching curated token balances!")
+
+if __name__ == "__main__":
+    main(None, *parse_shard_args("Fetch curated token balances via Multicall3"))
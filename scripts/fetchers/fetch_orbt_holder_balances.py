@@ -0,0 +1,99 @@
+"""
+Index current ORBT holder balances on Base from Transfer logs.
+
+Replays every ORBT Transfer since deployment into data/state/orbt_balances.sqlite
+and resumes from its checkpoint on later runs, so holder lists never need a
+per-wallet balanceOf call.
+
+    python3 scripts/fetchers/fetch_orbt_holder_balances.py --above 100 --output orbt_holders.csv
+"""
+import argparse
+import os
+import sys
+from decimal import Decimal
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from deployment import find_deployment_block, rpc_call
+from holder_index import HolderIndex
+from log_scanner import LogScanner
+
+# Public Base RPC
+BASE_RPC_URL = "https://mainnet.base.org"
+ORBT_CONTRACT = "0x48190e377ba663476c1ccd7100c0b49229319199"
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+INDEX_FILE = "data/state/orbt_balances.sqlite"
+CHUNK_BLOCKS = 500000 # Blocks per committed batch; bounds memory and work lost on interrupt
+MAX_WORKERS = 8
+REORG_SAFETY_BLOCKS = 64
+
+def rpc(method, params):
+    # Raises once retries are exhausted instead of failing on a missing 'result'
+    return rpc_call(BASE_RPC_URL, method, params, timeout=10)
+
+def get_decimals():
+    # decimals()
+    return int(rpc("eth_call", [{"to": ORBT_CONTRACT, "data": "0x313ce567"}, "latest"]), 16)
+
+def sync(index):
+    latest = int(rpc("eth_blockNumber", []), 16)
+    to_block = latest - REORG_SAFETY_BLOCKS
+    start = index.last_block + 1 if index.last_block is not None else find_deployment_block(BASE_RPC_URL, ORBT_CONTRACT, latest)
+    if start > to_block:
+        print(f"✅ Index already synced through block {index.last_block}.")
+        return
+
+    print(f"🚀 Replaying ORBT transfers, blocks {start}-{to_block}...")
+    scanner = LogScanner(BASE_RPC_URL, ORBT_CONTRACT, [TRANSFER_TOPIC], workers=MAX_WORKERS)
+
+    while start <= to_block:
+        end = min(to_block, start + CHUNK_BLOCKS - 1)
+        logs, failed = scanner.scan(start, end)
+        if failed:
+            # Apply what's contiguous and stop; the next run resumes at the gap
+            end = failed[0][0] - 1
+            logs = [l for l in logs if int(l['blockNumber'], 16) <= end]
+        if end >= start:
+            touched = index.apply_logs(logs, end)
+            print(f"   Blocks {start}-{end}: {len(logs)} transfers, {touched} balances updated. Holders: {index.holder_count()}")
+        if failed:
+            print(f"⚠️ Could not scan {len(failed)} ranges starting at block {failed[0][0]}; re-run to resume.")
+            return
+        start = end + 1
+
+    print(f"✅ Index synced through block {to_block}.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Index ORBT holder balances from Transfer logs")
+    parser.add_argument("--above", type=Decimal, default=Decimal(0), help="Only list holders with more than this many ORBT")
+    parser.add_argument("--output", help="Write matching holders to this CSV")
+    parser.add_argument("--no-sync", action="store_true", help="Query the existing index without fetching new logs")
+    args = parser.parse_args()
+
+    index = HolderIndex(INDEX_FILE)
+    try:
+        if not args.no_sync:
+            sync(index)
+
+        decimals = index.get_meta("decimals")
+        if decimals is None:
+            decimals = get_decimals()
+            index.set_meta("decimals", decimals)
+        scale = 10 ** int(decimals)
+
+        holders = index.holders_above(int(args.above * scale))
+        print(f"📊 {len(holders)} holders with more than {args.above} ORBT (of {index.holder_count()} total)")
+
+        if args.output:
+            df = pd.DataFrame(holders, columns=["wallet", "raw_balance"])
+            df["raw_balance"] = df["raw_balance"].astype(str)
+            df["balance"] = [b / scale for _, b in holders]
+            df.to_csv(args.output, index=False)
+            print(f"💾 Saved to {args.output}")
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
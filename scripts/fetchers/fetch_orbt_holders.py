@@ -1,9 +1,15 @@
+import argparse
 import requests
-import pandas as pd
 import time
 import os
+import sys
 from concurrent.futures import ThreadPoolExecutor
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from deployment import find_deployment_block
+from minter_sync import append_new_minters, emit_new_minters, load_checkpoint, save_checkpoint, unseen_minters
+from rate_control import backoff_delay
+
 # Try to load env vars
 try:
     from dotenv import load_dotenv
@@ -26,13 +32,29 @@ ALCHEMY_BASE_URL = f"https://base-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
 ORBT_CONTRACT = "0x48190e377ba663476c1ccd7100c0b49229319199"
 ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 
-OUTPUT_FILE = "orbt_base_minters.csv"
+OUTPUT_FILE = "orbt_base_minters.csv" # Append-only; see minter_sync
+REORG_SAFETY_BLOCKS = 64 # Stay this far behind head so the checkpoint never covers a reorged block
+PARTITIONS = 8 # Block ranges paginated concurrently, each with its own pageKey chain
+MAX_RETRIES = 6 # Per page, on 429 / network errors
+RETRY_BASE_DELAY = 2.0
 
-def fetch_orbt_minters():
-    print("🚀 Fetching ORBT Minters from Base (Alchemy API)...")
-    
+def get_latest_block():
+    try:
+        resp = requests.post(ALCHEMY_BASE_URL, json={"jsonrpc":"2.0","method":"eth_blockNumber","params":[],"id":1}, timeout=10)
+        return int(resp.json()['result'], 16)
+    except:
+        return 0
+
+def partition_blocks(from_block, to_block, parts):
+    """Split [from_block, to_block] into up to `parts` contiguous, ordered ranges."""
+    size = max(1, -(-(to_block - from_block + 1) // parts))
+    return [(start, min(to_block, start + size - 1)) for start in range(from_block, to_block + 1, size)]
+
+def fetch_partition(from_block, to_block):
+    """Follow one pageKey chain over [from_block, to_block]. Returns (minters, complete)."""
     minters = set()
     page_key = None
+    attempt = 0
     
     while True:
         payload = {
@@ -41,8 +63,8 @@ def fetch_orbt_minters():
             "method": "alchemy_getAssetTransfers",
             "params": [
                 {
-                    "fromBlock": "0x0",
-                    "toBlock": "latest",
+                    "fromBlock": hex(from_block),
+                    "toBlock": hex(to_block),
                     "fromAddress": ZERO_ADDRESS,
                     "contractAddresses": [ORBT_CONTRACT],
                     "category": ["erc20"],
@@ -68,31 +90,85 @@ def fetch_orbt_minters():
                         minters.add(to_addr.lower().strip())
                 
                 page_key = result.get("pageKey")
-                print(f"   Fetched {len(transfers)} transfers. Total Unique Minters: {len(minters)}")
-                
+                attempt = 0
                 if not page_key:
-                    break
+                    return minters, True
+                continue
             elif response.status_code == 429:
-                print("   ⚠️ 429 Rate Limit. Sleeping 2s...")
-                time.sleep(2)
+                reason = "429 Rate Limit"
             else:
-                print(f"   ❌ Error: {response.status_code} - {response.text}")
-                break
+                print(f"   ❌ Blocks {from_block}-{to_block}: {response.status_code} - {response.text}")
+                return minters, False
         except Exception as e:
-            print(f"   ❌ Exception: {e}")
-            time.sleep(2)
-            
-    return list(minters)
+            reason = f"Exception: {e}"
+
+        if attempt >= MAX_RETRIES:
+            print(f"   ❌ Blocks {from_block}-{to_block}: giving up after {attempt} retries ({reason})")
+            return minters, False
+        delay = backoff_delay(attempt, base=RETRY_BASE_DELAY)
+        print(f"   ⚠️ Blocks {from_block}-{to_block}: {reason}. Retrying in {delay:.1f}s...")
+        time.sleep(delay)
+        attempt += 1
+
+def fetch_orbt_minters(from_block, to_block, partitions=PARTITIONS):
+    """
+    Minters in [from_block, to_block], paginating each block partition concurrently.
+    Returns (minters, covered_to): the last block of the contiguous run of
+    completed partitions from from_block (from_block - 1 if the first failed).
+    """
+    ranges = partition_blocks(from_block, to_block, partitions)
+    print(f"🚀 Fetching ORBT Minters from Base (Alchemy API), blocks {from_block}-{to_block} in {len(ranges)} partitions...")
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        results = list(executor.map(lambda r: fetch_partition(*r), ranges))
+
+    minters = set()
+    covered_to = from_block - 1
+    contiguous = True
+    for (start, end), (found, complete) in zip(ranges, results):
+        minters |= found
+        contiguous = contiguous and complete
+        if contiguous:
+            covered_to = end
+    print(f"   Total Unique Minters: {len(minters)}")
+    return list(minters), covered_to
 
 def main():
-    # 1. Fetch Minters
-    minters = fetch_orbt_minters()
-    print(f"✅ Found {len(minters)} unique ORBT minters on Base.")
-    
-    # Save to file
-    df = pd.DataFrame(minters, columns=["wallet"])
-    df.to_csv(OUTPUT_FILE, index=False)
-    print(f"💾 Saved to {OUTPUT_FILE}")
+    parser = argparse.ArgumentParser(description="Incrementally sync ORBT minters on Base")
+    parser.add_argument("--to-delta", action="store_true", help="Write new minters to data/input/delta_wallets.csv")
+    args = parser.parse_args()
+
+    latest = get_latest_block()
+    if latest == 0:
+        print("❌ Failed to get block number")
+        return
+
+    checkpoint = load_checkpoint()
+    if checkpoint is None:
+        # First sync: start exactly at the contract's deployment block
+        from_block = find_deployment_block(ALCHEMY_BASE_URL, ORBT_CONTRACT, latest)
+    else:
+        from_block = checkpoint + 1
+    to_block = latest - REORG_SAFETY_BLOCKS
+    if from_block > to_block:
+        print(f"✅ Already synced through block {checkpoint}.")
+        return
+
+    # 1. Fetch Minters since the last checkpoint
+    minters, covered_to = fetch_orbt_minters(from_block, to_block)
+    # Hand new minters on before recording them, so a crash can't lose them
+    new_minters = unseen_minters(minters, OUTPUT_FILE)
+    if new_minters:
+        path = emit_new_minters(new_minters, to_delta=args.to_delta)
+        print(f"💾 Saved {len(new_minters)} new minters to {path}")
+    append_new_minters(new_minters, OUTPUT_FILE)
+    print(f"✅ Found {len(minters)} ORBT minters in range, {len(new_minters)} new. Appended to {OUTPUT_FILE}")
+
+    # A pageKey is only valid for its own request, so advance only over fully paginated partitions
+    if covered_to >= from_block:
+        save_checkpoint(covered_to)
+    if covered_to < to_block:
+        print(f"⚠️ Fetch incomplete after block {covered_to}; re-run to resume.")
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,17 @@
-import requests
 import pandas as pd
 import time
-import concurrent.futures
 import os
+import sys
 from threading import Lock
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from snapshot import block_tag, get_snapshot_cache
+from processed_index import ProcessedIndex
+from work_queue import WorkQueue
+from sharding import parse_shard_args, segment_path, select_shard
+from columnar import append_rows, compact, exists, read_table
+from http_client import get_session
+
 # Try to load env vars
 try:
     from dotenv import load_dotenv
@@ -29,6 +36,7 @@ ALCHEMY_RPC_URL = f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
 INPUT_FILE = "data/intermediate/wallet_portfolio_ath_backup.csv" # Using the clean list of 268k wallets
 OUTPUT_FILE = "data/intermediate/wallet_tx_counts.csv"
 MAX_WORKERS = 10
+http = get_session() # pooled connections, shared across stages in --in-process pipeline runs
 BATCH_SIZE = 50
 
 results = []
@@ -36,33 +44,51 @@ results_lock = Lock()
 processed_count = 0
 count_lock = Lock()
 
+# Block-pinned snapshot (None when reading at "latest"); set by main()
+snapshot_cache = None
+
+# Compact resume index (OUTPUT_FILE.idx), appended on every flush
+processed_index = ProcessedIndex(OUTPUT_FILE)
+
+# Per-wallet status / attempts / last error (see work_queue); a run fetches only pending or failed wallets
+work_queue = WorkQueue(OUTPUT_FILE)
+output_file = OUTPUT_FILE # this run's segment of OUTPUT_FILE; main() re-points it and the two above
+
 def get_tx_counts_batch(wallets):
+    # Serve what we can from the snapshot cache
+    cached = snapshot_cache.get_many("eth_getTransactionCount", wallets) if snapshot_cache else {}
+    missing = [w for w in wallets if w not in cached]
+    # If the RPC fails, cached wallets are still returned; only the misses are marked failed
+    hits = [{"wallet": w, "tx_count": cached[w]} for w in wallets if w in cached]
+    if not missing:
+        return hits
+
     payload = []
-    for i, wallet in enumerate(wallets):
+    for i, wallet in enumerate(missing):
         payload.append({
             "jsonrpc": "2.0",
             "id": i,
             "method": "eth_getTransactionCount",
-            "params": [wallet, "latest"]
+            "params": [wallet, block_tag()]
         })
     
     # Retry logic
     for attempt in range(3):
         try:
-            response = requests.post(ALCHEMY_RPC_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
+            response = http.post(ALCHEMY_RPC_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
             if response.status_code == 200:
                 break
             elif response.status_code == 429:
                 time.sleep(2 * (attempt + 1))
             else:
                 print(f"❌ Error: {response.status_code} - {response.text}")
-                return []
+                return hits
         except Exception as e:
             print(f"❌ Exception: {e}")
             time.sleep(1)
     else:
         print("❌ Max retries exceeded for batch")
-        return []
+        return hits
 
     try:
         data_json = response.json()
@@ -72,95 +98,115 @@ def get_tx_counts_batch(wallets):
             data_json = [data_json]
             
         parsed = []
+        fetched = {}
         results_map = {r['id']: r for r in data_json if 'result' in r and 'id' in r}
         
-        for i, wallet in enumerate(wallets):
+        for i, wallet in enumerate(missing):
             res = results_map.get(i)
             if res:
-                val = int(res['result'], 16)
-                parsed.append({"wallet": wallet, "tx_count": val})
-            else:
-                # If error in individual result, assume 0 or handle
-                # print(f"⚠️ No result for {wallet}")
-                parsed.append({"wallet": wallet, "tx_count": 0})
+                fetched[wallet] = int(res['result'], 16)
+
+        if snapshot_cache:
+            snapshot_cache.put_many("eth_getTransactionCount", fetched)
+
+        for wallet in wallets:
+            if wallet in cached:
+                parsed.append({"wallet": wallet, "tx_count": cached[wallet]})
+            elif wallet in fetched:
+                parsed.append({"wallet": wallet, "tx_count": fetched[wallet]})
+            # No result: left out (not written as 0) so the work queue retries it
         return parsed
     except Exception as e:
         print(f"❌ Parse Exception: {e}")
-        return []
+        return hits
 
-def process_batch(batch_wallets):
+def process_batch(data):
+    # Buffer one fetched batch's rows
     global processed_count
     
-    data = get_tx_counts_batch(batch_wallets)
-    
     with results_lock:
         results.extend(data)
         
         # Save incrementally
         if len(results) >= 5000:
             df = pd.DataFrame(results)
-            header = not os.path.exists(OUTPUT_FILE)
-            df.to_csv(OUTPUT_FILE, mode='a', header=header, index=False)
+            append_rows(output_file, df)
+            processed_index.add_many(df['wallet'])
+            work_queue.complete(df['wallet'])
             results.clear()
             
     with count_lock:
-        processed_count += len(batch_wallets)
+        processed_count += len(data)
         if processed_count % 1000 == 0:
             print(f"⏳ Processed {processed_count} wallets...")
 
-def main():
+def main(wallets=None, shard=0, num_shards=1, session=None, snapshot=None):
+    # wallets: an already-normalised cohort (in-process pipeline runs); None reads INPUT_FILE
+    # shard / num_shards: fetch only that hash shard, into its own segment file (pipeline/merge_shards.py combines them)
+    # session / snapshot: the pipeline's shared HTTP session and snapshot cache; None uses this process's own
+    global output_file, processed_index, work_queue, http, snapshot_cache, processed_count
+    # Nothing carries over from an earlier in-process call
+    http, snapshot_cache = session or get_session(), snapshot if snapshot is not None else get_snapshot_cache()
+    results.clear()
+    processed_count = 0
+    output_file = segment_path(OUTPUT_FILE, shard, num_shards)
+    processed_index, work_queue = ProcessedIndex(output_file), WorkQueue(output_file)
     print("🚀 Starting Transaction Count Fetcher...")
+    print(f"📌 Reading nonces at block: {block_tag()}")
     
-    if not os.path.exists(INPUT_FILE):
-        print(f"❌ Input file {INPUT_FILE} not found")
-        return
+    if wallets is None:
+        if not exists(INPUT_FILE):
+            print(f"❌ Input file {INPUT_FILE} not found")
+            return
 
-    # Load wallets
-    df = pd.read_csv(INPUT_FILE)
-    # Ensure we have the wallet column
-    if 'wallet' not in df.columns:
-        # Fallback for old CSVs
-        if 'wallet_address' in df.columns:
-            wallets = df['wallet_address'].astype(str).tolist()
+        # Load wallets
+        df = read_table(INPUT_FILE)
+        # Ensure we have the wallet column
+        if 'wallet' not in df.columns:
+            # Fallback for old CSVs
+            if 'wallet_address' in df.columns:
+                wallets = df['wallet_address'].astype(str).tolist()
+            else:
+                wallets = df.iloc[:, 0].astype(str).tolist()
         else:
-            wallets = df.iloc[:, 0].astype(str).tolist()
-    else:
-        wallets = df['wallet'].astype(str).tolist()
+            wallets = df['wallet'].astype(str).tolist()
 
-    wallets = [w.strip().lower() for w in wallets]
+        wallets = [w.strip().lower() for w in wallets]
     
     # Filter processed
-    processed_wallets = set()
-    if os.path.exists(OUTPUT_FILE):
-        try:
-            df_done = pd.read_csv(OUTPUT_FILE)
-            processed_wallets = set(df_done['wallet'].astype(str).str.lower().str.strip())
-            print(f"⏩ Found {len(processed_wallets)} already processed. Skipping...")
-        except:
-            pass
+    processed_index.load()
+    if len(processed_index):
+        print(f"⏩ Found {len(processed_index)} already processed. Skipping...")
             
-    remaining = [w for w in wallets if w not in processed_wallets]
-    print(f"📊 Total to process: {len(remaining)}")
+    # Keep this worker's hash shard (every wallet when unsharded)
+    wallets = select_shard(wallets, shard, num_shards)
+    if num_shards > 1:
+        print(f"🧩 Shard {shard}/{num_shards}: {len(wallets)} wallets -> {output_file}")
+
+    remaining = work_queue.sync(wallets, processed_index)
+    print(f"📊 Total to process: {remaining}")
     
     if not remaining:
+        work_queue.finish() # reports wallets that are out of attempts
         print("✅ All done!")
         return
 
-    # Create batches
-    batches = [remaining[i:i + BATCH_SIZE] for i in range(0, len(remaining), BATCH_SIZE)]
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        executor.map(process_batch, batches)
+    # Workers lease batches of BATCH_SIZE from the queue as they go
+    for data in work_queue.process(get_tx_counts_batch, MAX_WORKERS, BATCH_SIZE):
+        process_batch(data)
 
     # Flush final
     with results_lock:
         if results:
             df = pd.DataFrame(results)
-            header = not os.path.exists(OUTPUT_FILE)
-            df.to_csv(OUTPUT_FILE, mode='a', header=header, index=False)
+            append_rows(output_file, df)
+            processed_index.add_many(df['wallet'])
+            work_queue.complete(df['wallet'])
             results.clear()
+    compact(output_file)
+    work_queue.finish() # raises if any wallet is left undone
 
     print("🎉 Done fetching transaction counts!")
 
 if __name__ == "__main__":
-    main()
+    main(None, *parse_shard_args("Fetch transaction counts (nonces)"))
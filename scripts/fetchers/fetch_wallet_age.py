@@ -1,11 +1,17 @@
-import requests
 import pandas as pd
 import time
-import concurrent.futures
 import os
+import sys
 from datetime import datetime, timezone
 from threading import Lock
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import append_rows, compact, exists, read_table
+from http_client import get_session
+from processed_index import ProcessedIndex
+from work_queue import WorkQueue
+from sharding import parse_shard_args, segment_path, select_shard
+
 # Try to load env vars
 try:
     from dotenv import load_dotenv
@@ -27,9 +33,17 @@ ALCHEMY_URL = f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
 INPUT_FILE = "data/input/final_active_wallets.csv"
 OUTPUT_FILE = "data/intermediate/wallet_ages.csv"
 MAX_WORKERS = 10
+http = get_session() # pooled connections, shared across stages in --in-process pipeline runs
 
-results = []
+results = [] # Rows not yet flushed to OUTPUT_FILE
 results_lock = Lock()
+
+# Compact resume index (OUTPUT_FILE.idx), appended on every flush
+processed_index = ProcessedIndex(OUTPUT_FILE)
+
+# Per-wallet status / attempts / last error (see work_queue); a run fetches only pending or failed wallets
+work_queue = WorkQueue(OUTPUT_FILE)
+output_file = OUTPUT_FILE # this run's segment of OUTPUT_FILE; main() re-points it and the two above
 processed_count = 0
 
 def get_wallet_age(wallet):
@@ -52,7 +66,7 @@ def get_wallet_age(wallet):
     
     for attempt in range(3):
         try:
-            response = requests.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
+            response = http.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
             if response.status_code == 200:
                 data = response.json()
                 transfers = data.get("result", {}).get("transfers", [])
@@ -101,9 +115,10 @@ def get_wallet_age_with_metadata(wallet):
         ]
     }
     
+    error = None
     for attempt in range(3):
         try:
-            response = requests.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
+            response = http.post(ALCHEMY_URL, json=payload, headers={"Content-Type": "application/json"}, timeout=15)
             if response.status_code == 200:
                 data = response.json()
                 transfers = data.get("result", {}).get("transfers", [])
@@ -114,16 +129,23 @@ def get_wallet_age_with_metadata(wallet):
                     return timestamp_str
                 return "NA" # No transfers
             elif response.status_code == 429:
+                error = "HTTP 429"
                 time.sleep(2 * (attempt + 1))
-        except Exception:
+            else:
+                error = f"HTTP {response.status_code}"
+                break
+        except Exception as e:
+            error = e
             time.sleep(1)
-    return None
+    # Raise rather than return "no data", so the work queue records the failure and retries
+    raise RuntimeError(f"alchemy_getAssetTransfers failed: {error}")
 
 def process_wallet(wallet):
     ts_str = get_wallet_age_with_metadata(wallet)
     
     if not ts_str or ts_str == "NA":
-        return None
+        # No outgoing transfers: a real answer, saved as an empty age rather than retried
+        return {"wallet": wallet, "first_tx_timestamp": None, "wallet_age_days": 0, "wallet_age_formatted": None}
         
     try:
         # Parse timestamp
@@ -149,64 +171,78 @@ def process_wallet(wallet):
         print(f"Error parsing date {ts_str} for {wallet}: {e}")
         return None
 
-def main():
+def save_results():
+    # Append unsaved rows as one row group (see columnar) and mark them processed
+    if not results:
+        return 0
+    df = pd.DataFrame(results)
+    append_rows(output_file, df)
+    processed_index.add_many(df['wallet'])
+    work_queue.complete(df['wallet'])
+    results.clear()
+    return len(df)
+
+def main(wallets=None, shard=0, num_shards=1, session=None, snapshot=None):
+    # wallets: an already-normalised cohort (in-process pipeline runs); None reads INPUT_FILE
+    # shard / num_shards: fetch only that hash shard, into its own segment file (pipeline/merge_shards.py combines them)
+    # session / snapshot: the pipeline's shared HTTP session and snapshot cache; None uses this process's own
+    global output_file, processed_index, work_queue, http
+    # snapshot is unused: these metrics are read from transfer history, not block-pinned state
+    http = session or get_session()
+    results.clear() # nothing carries over from an earlier in-process call
+    output_file = segment_path(OUTPUT_FILE, shard, num_shards)
+    processed_index, work_queue = ProcessedIndex(output_file), WorkQueue(output_file)
     print("🚀 Starting Wallet Age Fetcher...")
     
-    # 0. Load Existing Results (Resume capability)
-    processed_wallets = set()
-    if os.path.exists(OUTPUT_FILE):
-        try:
-            df_existing = pd.read_csv(OUTPUT_FILE)
-            if 'wallet' in df_existing.columns:
-                processed_wallets = set(df_existing['wallet'].astype(str).str.lower().str.strip())
-                results.extend(df_existing.to_dict('records'))
-                print(f"🔄 Resuming: Found {len(processed_wallets)} existing records in {OUTPUT_FILE}")
-        except Exception as e:
-            print(f"⚠️ Error reading existing output: {e}")
+    # 0. Resume from the index of wallets already saved
+    processed_index.load()
+    if len(processed_index):
+        print(f"🔄 Resuming: Found {len(processed_index)} existing records in {output_file}")
 
     # 1. Load Filtered List
-    if not os.path.exists(INPUT_FILE):
-        print(f"❌ Input file {INPUT_FILE} not found.")
-        return
+    if wallets is None:
+        if not exists(INPUT_FILE):
+            print(f"❌ Input file {INPUT_FILE} not found.")
+            return
         
-    df = pd.read_csv(INPUT_FILE)
-    df['wallet'] = df['wallet'].astype(str).str.lower().str.strip()
+        df = read_table(INPUT_FILE)
+        df['wallet'] = df['wallet'].astype(str).str.lower().str.strip()
     
-    # Filter for active retail (Removed per user request)
-    print(f"Total wallets in file: {len(df)}")
-    # if 'tx_count' in df.columns:
-    #     df = df[(df['tx_count'] > 0) & (df['tx_count'] <= 20000)]
+        # Filter for active retail (Removed per user request)
+        print(f"Total wallets in file: {len(df)}")
+        # if 'tx_count' in df.columns:
+        #     df = df[(df['tx_count'] > 0) & (df['tx_count'] <= 20000)]
+        wallets = df['wallet'].tolist()
     
+    # Keep this worker's hash shard (every wallet when unsharded)
+    wallets = select_shard(wallets, shard, num_shards)
+    if num_shards > 1:
+        print(f"🧩 Shard {shard}/{num_shards}: {len(wallets)} wallets -> {output_file}")
+
     # Exclude already processed
-    df = df[~df['wallet'].isin(processed_wallets)]
-    print(f"✅ Active Retail Wallets to process: {len(df)}")
+    total = work_queue.sync(wallets, processed_index)
+    print(f"✅ Active Retail Wallets to process: {total}")
     
-    wallets = df['wallet'].tolist()
-    
-    # 2. Process
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_wallet, w): w for w in wallets}
-        
-        total = len(wallets)
-        completed = 0
+    # 2. Process (workers lease wallets from the queue as they go)
+    completed = 0
+    for res in work_queue.process(process_wallet, MAX_WORKERS):
+        if res:
+            results.append(res)
         
-        for future in concurrent.futures.as_completed(futures):
-            res = future.result()
-            if res:
-                results.append(res)
+        completed += 1
+        if completed % 100 == 0:
+            print(f"Progress: {completed}/{total} ({completed/total:.1%})")
             
-            completed += 1
-            if completed % 100 == 0:
-                print(f"Progress: {completed}/{total} ({completed/total:.1%})")
-                
-            # Save intermediate
-            if completed % 1000 == 0:
-                pd.DataFrame(results).to_csv(OUTPUT_FILE, index=False)
-                print(f"💾 Saved {len(results)} rows to {OUTPUT_FILE}")
+        # Save intermediate
+        if completed % 1000 == 0:
+            saved = save_results()
+            print(f"💾 Saved {saved} rows to {output_file}")
 
     # Final Save
-    pd.DataFrame(results).to_csv(OUTPUT_FILE, index=False)
-    print(f"🎉 Done! Saved {len(results)} wallet ages to {OUTPUT_FILE}")
+    save_results()
+    compact(output_file)
+    work_queue.finish() # raises if any wallet is left undone
+    print(f"🎉 Done! {len(processed_index)} wallet ages saved to {output_file}")
 
 if __name__ == "__main__":
-    main()
+    main(None, *parse_shard_args("Fetch first-transaction wallet ages"))
@@ -1,10 +1,32 @@
+"""
+SIM portfolio / ATH fetcher.
+
+Importable API:
+    fetch_portfolio(wallet)                       -> one result row (raises if SIM fails)
+    run(wallets, shard=i, num_shards=n, ...)      -> fetch a deterministic hash shard
+
+Each shard writes its own segment file (see sharding.segment_path), so
+several processes or machines can split one cohort:
+    python3 scripts/fetchers/wallet_portfolio_ath_fetcher.py --shard 2/8
+"""
+import argparse
 import requests
+import numpy as np
 import pandas as pd
 import time
-import concurrent.futures
-import random
-from threading import Lock
+import queue
+from threading import Lock, Thread
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import append_rows, compact, read_table
+from http_client import get_session
+from processed_index import ProcessedIndex
+from rate_control import AIMDLimiter, RetryBudget, backoff_delay
+from sharding import parse_shard, segment_path, select_shard
+from wallet_ids import normalize_wallets
+from work_queue import WorkQueue
 
 # Try to load env vars
 try:
@@ -18,12 +40,18 @@ except ImportError:
                     key, value = line.strip().split("=", 1)
                     os.environ[key] = value
 
+# Fast JSON decoding for big balance payloads (falls back to the stdlib)
+try:
+    import orjson
+    parse_json = orjson.loads
+except ImportError:
+    import json
+    parse_json = json.loads
+
 # CONFIG
 SIM_API_KEY = os.getenv("SIM_API_KEY")
 DUNE_API_KEY = os.getenv("DUNE_API_KEY")
 
-if not SIM_API_KEY or not DUNE_API_KEY:
-    raise ValueError("Please set SIM_API_KEY and DUNE_API_KEY in .env file")
 DUNE_NAMESPACE = "orbt_official"
 DUNE_TABLE_NAME = "dataset_wallet_portfolio_ath"
 
@@ -32,98 +60,190 @@ OLD_BACKUP = "wallet_portfolio_backup.csv"
 NEW_BACKUP = "data/intermediate/wallet_portfolio_ath_backup.csv"
 
 SIM_API_URL = "https://api.sim.dune.com/v1/evm/balances"
-CHAIN_IDS = "1"
+# Ethereum + the L2s our users bridge to (ORBT itself lives on Base); one request covers all of them
+CHAIN_IDS = "1,8453,10,42161"
+CHAIN_NAMES = {1: "ethereum", 8453: "base", 10: "optimism", 42161: "arbitrum"}
+
+# Historical price ladder (hours back) requested in the same call: 1d, 1w, 30d, 90d, 180d, 1y.
+# ATH is the best of the present value and the portfolio valued at each of these offsets.
+HISTORICAL_OFFSETS = (24, 168, 720, 2160, 4320, 8760)
+OFFSET_90D = HISTORICAL_OFFSETS.index(2160)
+
+# Columns of the dataset_wallet_portfolio_ath Dune table (per-chain columns stay local)
+DUNE_COLUMNS = ["wallet", "present_value_usd", "ath_value_usd", "token_count", "top_tokens"]
 
-MAX_WORKERS = 20
+# Concurrency is set by the AIMD limiter between MIN and MAX; MAX_WORKERS is the thread ceiling
+MAX_WORKERS = 60
+INITIAL_CONCURRENCY = 20
+MIN_CONCURRENCY = 2
+LATENCY_TARGET = 10.0  # seconds; slower responses count as congestion
+MAX_RETRIES = 5
 UPLOAD_BATCH_SIZE = 25000
+UPLOAD_QUEUE_SIZE = 2  # batches waiting for the uploader before fetch workers are held back
+UPLOAD_RETRIES = 5
 
 headers_sim = {"X-Sim-Api-Key": SIM_API_KEY}
 headers_dune = {"X-Dune-Api-Key": DUNE_API_KEY}
 
-results = []
-results_lock = Lock()
-processed_count = 0
-count_lock = Lock()
 uploaded_count = 0
 
-def get_wallet_portfolio(wallet_address):
-    try:
-        wallet_str = str(wallet_address).strip()
-        if not wallet_str.startswith("0x"):
-            wallet_str = "0x" + wallet_str
-        response = requests.get(
-            f"{SIM_API_URL}/{wallet_str}",
-            headers=headers_sim,
-            params={"chain_ids": CHAIN_IDS, "exclude_spam_tokens": "true", "historical_prices": "2160"},
-            timeout=30
-        )
-        if response.status_code == 429:
-            # print(f"⚠️ 429 Rate Limit for {wallet_address}. Retrying...")
-            time.sleep(random.uniform(2, 5))
-            return get_wallet_portfolio(wallet_address)
-        if response.status_code != 200:
-            return {"wallet": wallet_str, "present_value_usd": 0.0, "ath_value_usd": 0.0, "token_count": 0, "top_tokens": ""}
-        data = response.json()
+limiter = AIMDLimiter(initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_WORKERS, latency_target=LATENCY_TARGET)
+retry_budget = RetryBudget()
+http = get_session() # pooled connections, shared across stages in --in-process pipeline runs
+
+def sim_get(url, params):
+    """GET against SIM under the AIMD limiter. Returns the response, or None once retries run out."""
+    retry_budget.on_request()
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        start = time.monotonic()
+        try:
+            response = http.get(url, headers=headers_sim, params=params, timeout=30)
+        except requests.RequestException:
+            # Timeouts / resets are treated as congestion too
+            limiter.release(throttled=True)
+            response = None
+        else:
+            limiter.release(throttled=response.status_code == 429, latency=time.monotonic() - start)
+
+        if response is not None and response.status_code != 429:
+            return response
+        if attempt == MAX_RETRIES or not retry_budget.try_spend():
+            return None
+        time.sleep(backoff_delay(attempt))
+    return None
+
+def _numeric(df, name, default):
+    """A balance field as float64; missing, null or non-numeric entries become `default`."""
+    if name not in df.columns:
+        return np.full(len(df), default, dtype=np.float64)
+    return pd.to_numeric(df[name], errors="coerce").fillna(default).to_numpy(dtype=np.float64)
+
+def _historical_matrix(df):
+    """
+    tokens x HISTORICAL_OFFSETS price matrix. A missing offset or a null/0 price is NaN,
+    which keeps the current value for that offset instead of a $0 placeholder.
+    """
+    matrix = pd.DataFrame(index=df.index, columns=list(HISTORICAL_OFFSETS), dtype=np.float64)
+    if "historical_prices" not in df.columns:
+        return matrix.to_numpy()
+    entries = df["historical_prices"].explode().dropna()
+    if entries.empty:
+        return matrix.to_numpy()
+    flat = pd.json_normalize(entries.tolist()).reindex(columns=["offset_hours", "price_usd"])
+    flat["token"] = entries.index
+    flat["price_usd"] = pd.to_numeric(flat["price_usd"], errors="coerce").where(lambda p: p > 0)
+    prices = flat.pivot_table(index="token", columns="offset_hours", values="price_usd", aggfunc="last")
+    return prices.reindex(index=df.index, columns=list(HISTORICAL_OFFSETS)).to_numpy(dtype=np.float64)
+
+def balances_to_columns(balances):
+    """A page of SIM balances as column arrays (built column-wise by pandas); all filtering after this is vectorized."""
+    df = pd.DataFrame.from_records(balances)
+    low_liquidity = df["low_liquidity"].fillna(False).astype(bool) if "low_liquidity" in df.columns else False
+    chain_id = _numeric(df, "chain_id", -1)
+    return {
+        "low_liquidity": np.broadcast_to(np.asarray(low_liquidity, dtype=bool), len(df)),
+        "is_native": (df["address"] == "native").to_numpy() if "address" in df.columns else np.zeros(len(df), dtype=bool),
+        "pool_size": _numeric(df, "pool_size", 0),
+        "value_usd": _numeric(df, "value_usd", 0),
+        "price_usd": _numeric(df, "price_usd", 0),
+        "chain_id": np.where(chain_id > 0, chain_id, -1).astype(np.int64),
+        "historical_prices": _historical_matrix(df),
+        "symbol": df["symbol"].fillna("?").to_numpy() if "symbol" in df.columns else np.full(len(df), "?", dtype=object),
+    }
+
+def aggregate_page(cols, present_by_chain, past_by_chain, top_candidates):
+    """Fold one page into the running per-chain totals. Returns the number of held tokens on the page."""
+    val = cols["value_usd"]
+    pool = cols["pool_size"]
+    price = cols["price_usd"]
+    native = cols["is_native"]
+
+    # Strict Filtering Logic
+    # Filter 1: Must be native OR have significant liquidity (> $50k)
+    # Filter 2: Even if liquid, value shouldn't exceed pool size (anti-whale/scam check);
+    #           skipped for native tokens as they don't always have a pool_size field
+    keep = ~cols["low_liquidity"] & (native | (pool > 50000)) & (native | (val <= pool))
+    held = keep & (val > 0)
+    priced = held & (price > 0)
+
+    # Value at every ladder offset via price ratio (tokens x offsets);
+    # a ratio > 100 (99% drop since) is likely a scam wick -> ignore it
+    ratio = cols["historical_prices"] / np.where(price > 0, price, 1.0)[:, None]
+    ratio = np.where(ratio > 100, 1.0, ratio)
+    past = np.where(np.isnan(ratio), val[:, None], val[:, None] * ratio)
+
+    chain = cols["chain_id"]
+    for chain_id in np.unique(chain[keep]):
+        on_chain = chain == chain_id
+        present_by_chain[chain_id] = present_by_chain.get(chain_id, 0.0) + float(val[keep & on_chain].sum())
+        if (priced & on_chain).any():
+            past_by_chain[chain_id] = past_by_chain.get(chain_id, 0.0) + past[priced & on_chain].sum(axis=0)
+
+    # Only this page's top 3 can make the wallet's top 3
+    idx = np.flatnonzero(held)
+    if len(idx) > 3:
+        idx = idx[np.argpartition(-val[idx], 2)[:3]]
+    top_candidates.extend((float(val[i]), cols["symbol"][i]) for i in idx)
+    return int(held.sum())
+
+def fetch_portfolio(wallet_address):
+    # Failures raise instead of returning an all-zero row, so the work queue records and retries them
+    # wallet_address arrives normalised (see run()) and is used as-is, so the row matches the queue and index key
+    params = {
+        "chain_ids": CHAIN_IDS,
+        "exclude_spam_tokens": "true",
+        "historical_prices": ",".join(str(o) for o in HISTORICAL_OFFSETS),
+    }
+
+    present_by_chain = {}
+    past_by_chain = {}
+    token_count = 0
+    top_candidates = []
+
+    # Stream every page into per-chain running totals; pages are not kept
+    while True:
+        response = sim_get(f"{SIM_API_URL}/{wallet_address}", params)
+        if response is None or response.status_code != 200:
+            raise RuntimeError(f"SIM balances failed ({'retries exhausted' if response is None else f'HTTP {response.status_code}'})")
+        data = parse_json(response.content)
         if "balances" not in data:
-            return {"wallet": wallet_str, "present_value_usd": 0.0, "ath_value_usd": 0.0, "token_count": 0, "top_tokens": ""}
-        
-        total_usd = 0.0
-        total_90d = 0.0
-        token_count = 0
-        top_tokens = []
-        
-        for b in data["balances"]:
-            if b.get("low_liquidity", False):
-                continue
-            
-            # Strict Filtering Logic
-            is_native = (b.get("address") == "native")
-            pool_size = b.get("pool_size", 0) or 0
-            val = b.get("value_usd", 0) or 0
-            
-            # Filter 1: Must be native OR have significant liquidity (> $50k)
-            if not (is_native or pool_size > 50000):
-                continue
-                
-            # Filter 2: Even if liquid, value shouldn't exceed pool size (anti-whale/scam check)
-            # We skip this for native tokens as they don't always have a pool_size field or it represents a DEX pair
-            if not is_native and val > pool_size:
-                continue
-
-            current_price = b.get("price_usd", 0) or 0
-            total_usd += val
-            if val > 0:
-                token_count += 1
-                top_tokens.append({"s": b.get("symbol", "?"), "v": val})
-                # Calculate 90d value using ratio
-                if current_price > 0:
-                    best_90d = val # Default to current value
-                    for h in b.get("historical_prices", []):
-                        hp = h.get("price_usd", 0) or 0
-                        if h.get("offset_hours") == 2160:
-                            ratio = hp / current_price
-                            # Sanity check: If ratio > 100 (99% drop), ignore it (likely scam wick)
-                            # Also check if historical price is insanely high
-                            if ratio > 100:
-                                ratio = 1.0
-                            best_90d = val * ratio
-                    total_90d += best_90d
-        
-        top_tokens.sort(key=lambda x: x["v"], reverse=True)
-        top_3 = ", ".join([t["s"] for t in top_tokens[:3]])
-        ath = max(total_usd, total_90d)
-        
-        return {"wallet": wallet_str, "present_value_usd": round(total_usd, 2), "ath_value_usd": round(ath, 2), "token_count": token_count, "top_tokens": top_3}
-    except:
-        return {"wallet": str(wallet_address), "present_value_usd": 0.0, "ath_value_usd": 0.0, "token_count": 0, "top_tokens": ""}
+            raise RuntimeError("SIM response has no balances")
+
+        if data["balances"]:
+            cols = balances_to_columns(data["balances"])
+            token_count += aggregate_page(cols, present_by_chain, past_by_chain, top_candidates)
+
+        next_offset = data.get("next_offset")
+        if not next_offset:
+            break
+        params["offset"] = next_offset
+
+    total_usd = sum(present_by_chain.values())
+    # Portfolio value at each ladder offset; ATH is the best of those and today
+    totals_by_offset = sum(past_by_chain.values(), np.zeros(len(HISTORICAL_OFFSETS)))
+    best = int(np.argmax(totals_by_offset))
+    if totals_by_offset[best] > total_usd:
+        ath, ath_offset = float(totals_by_offset[best]), HISTORICAL_OFFSETS[best]
+    else:
+        ath, ath_offset = total_usd, 0
+
+    top_candidates.sort(key=lambda x: x[0], reverse=True)
+    top_3 = ", ".join([sym for _, sym in top_candidates[:3]])
+
+    row = {"wallet": wallet_address, "present_value_usd": round(total_usd, 2), "ath_value_usd": round(ath, 2), "token_count": token_count, "top_tokens": top_3, "ath_offset_hours": ath_offset}
+    for chain_id, name in CHAIN_NAMES.items():
+        row[f"{name}_value_usd"] = round(present_by_chain.get(chain_id, 0.0), 2)
+        row[f"{name}_value_90d_usd"] = round(float(past_by_chain.get(chain_id, np.zeros(len(HISTORICAL_OFFSETS)))[OFFSET_90D]), 2)
+    return row
 
 def upload_to_dune(data):
     global uploaded_count
     try:
         df = pd.DataFrame(data)
-        csv_data = df.to_csv(index=False)
+        csv_data = df[[c for c in DUNE_COLUMNS if c in df.columns]].to_csv(index=False)
         url = f"https://api.dune.com/api/v1/table/{DUNE_NAMESPACE}/{DUNE_TABLE_NAME}/insert"
-        response = requests.post(url, headers={**headers_dune, "Content-Type": "text/csv"}, data=csv_data)
+        response = http.post(url, headers={**headers_dune, "Content-Type": "text/csv"}, data=csv_data, timeout=120)
         if response.status_code == 200:
             uploaded_count += len(data)
             print(f"✅ Uploaded {len(data)} to Dune (Total: {uploaded_count})")
@@ -135,98 +255,211 @@ def upload_to_dune(data):
         print(f"❌ Error: {e}")
         return False
 
-def process_wallet(wallet):
-    global processed_count, results
-    result = get_wallet_portfolio(wallet)
-    with results_lock:
-        results.append(result)
-        batch_ready = len(results) >= UPLOAD_BATCH_SIZE
+def append_csv(path, rows):
+    """
+    Append rows to a plain CSV, keeping its column layout (used for the pending-upload spool).
+    Rows with columns the header lacks widen the file: it is rewritten with the new columns
+    (NaN for the old rows) instead of silently dropping them.
+    """
+    df = pd.DataFrame(rows)
+    if os.path.exists(path):
+        columns = list(pd.read_csv(path, nrows=0).columns)
+        added = [c for c in df.columns if c not in columns]
+        if added:
+            tmp = path + ".tmp"
+            pd.concat([pd.read_csv(path), df], ignore_index=True).reindex(columns=columns + added).to_csv(tmp, index=False)
+            os.replace(tmp, path)
+            return
+        df.reindex(columns=columns).to_csv(path, mode='a', header=False, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+class BatchUploader:
+    """
+    Dedicated thread that persists finished batches and pushes them to Dune.
+
+    Fetch workers hand batches over through a bounded queue, so they only wait
+    when the uploader is UPLOAD_QUEUE_SIZE batches behind (backpressure), never
+    for the upload itself. Each batch is appended to the segment file before
+    uploading (as a row group, see columnar); batches Dune still rejects after UPLOAD_RETRIES go to
+    <output>.pending_upload.csv and are retried on the next run. If a batch cannot be
+    persisted, its wallets stay unfinished in the work queue and close() raises the error.
+    """
+
+    def __init__(self, output_file, index, work_queue, upload=True):
+        self.output_file = output_file
+        self.index = index
+        self.work_queue = work_queue
+        self.upload = upload
+        self.pending_file = output_file + ".pending_upload.csv"
+        self.error = None
+        self.queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        self.thread = Thread(target=self._worker, name="dune-uploader", daemon=True)
+        self.thread.start()
+
+    def submit(self, batch):
+        self.queue.put(batch)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _upload_with_retries(self, batch):
+        for attempt in range(UPLOAD_RETRIES):
+            if upload_to_dune(batch):
+                return True
+            time.sleep(backoff_delay(attempt, base=2.0, cap=60.0))
+        return False
+
+    def _retry_pending(self):
+        if not os.path.exists(self.pending_file):
+            return
+        pending = pd.read_csv(self.pending_file).to_dict('records')
+        print(f"🔁 Retrying {len(pending)} rows left from failed uploads...")
+        if self._upload_with_retries(pending):
+            os.remove(self.pending_file)
+
+    def _worker(self):
+        if self.upload:
+            self._retry_pending()
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            try:
+                # Persist locally first so a failed upload never loses the rows
+                append_rows(self.output_file, batch)
+                self.index.add_many(r["wallet"] for r in batch)
+                self.work_queue.complete(r["wallet"] for r in batch)
+                if self.upload and not self._upload_with_retries(batch):
+                    print(f"⚠️ Keeping {len(batch)} rows in {self.pending_file} for the next run")
+                    append_csv(self.pending_file, batch)
+            except Exception as e:
+                # Keep draining so fetch workers never block on a full queue; the
+                # batch's wallets are not marked done, and close() re-raises.
+                print(f"❌ Uploader error, {len(batch)} rows not saved: {e}")
+                self.error = self.error or e
+
+class PortfolioWriter:
+    """Collects results and hands every UPLOAD_BATCH_SIZE rows to the background uploader."""
+
+    def __init__(self, output_file, index, work_queue, upload=True):
+        self.uploader = BatchUploader(output_file, index, work_queue, upload=upload)
+        self.results = []
+        self.results_lock = Lock()
+        self.processed_count = 0
+        self.count_lock = Lock()
+
+    def process_wallet(self, wallet):
+        result = fetch_portfolio(wallet)
+        with self.results_lock:
+            self.results.append(result)
+            batch_ready = len(self.results) >= UPLOAD_BATCH_SIZE
+            if batch_ready:
+                batch = self.results.copy()
+                self.results.clear()
+        with self.count_lock:
+            self.processed_count += 1
+            if self.processed_count % 100 == 0:
+                print(f"⏳ Processed {self.processed_count}... (concurrency {limiter.current_limit}, 429s {limiter.throttled_count})")
         if batch_ready:
-            batch = results.copy()
-            results.clear()
-    with count_lock:
-        processed_count += 1
-        if processed_count % 100 == 0:
-            print(f"⏳ Processed {processed_count}...")
-    if batch_ready:
-        upload_to_dune(batch)
-        pd.DataFrame(batch).to_csv(NEW_BACKUP, mode='a', header=not os.path.exists(NEW_BACKUP), index=False)
-    time.sleep(0.02)
-    return result
-
-print("🚀 Starting ATH Portfolio Fetcher...")
-
-df_all = pd.read_csv(INPUT_FILE)
-# Ensure we get the 'wallet' column if it exists, otherwise assume first column if no header
-if 'wallet' in df_all.columns:
-    all_wallets = [str(w).strip().lower() for w in df_all['wallet'].tolist()]
-else:
-    all_wallets = [str(w).strip().lower() for w in df_all.iloc[:, 0].tolist()]
-
-# Filter out header 'wallet' if present in data (just in case)
-all_wallets = [w for w in all_wallets if w != 'wallet']
-print(f"📊 Total unique input wallets: {len(set(all_wallets))}")
-
-# Filter (Removed per user request)
-# if 'tx_count' in df.columns:
-#     df = df[(df['tx_count'] > 0) & (df['tx_count'] <= 20000)]
-
-# Load already processed wallets from current run/backup
-processed_wallets = set()
-if os.path.exists(NEW_BACKUP):
-    try:
-        df_new = pd.read_csv(NEW_BACKUP)
-        processed_wallets = set(str(w).strip().lower() for w in df_new['wallet'].tolist())
-        print(f"⏩ Found {len(processed_wallets)} already processed in {NEW_BACKUP}. Skipping them.")
-    except Exception as e:
-        print(f"⚠️ Could not read existing backup: {e}")
+            self.uploader.submit(batch)
+        return result
 
-original_old_wallets = set()
+    def flush(self):
+        with self.results_lock:
+            batch = self.results.copy()
+            self.results.clear()
+        if batch:
+            self.uploader.submit(batch)
 
-if os.path.exists(OLD_BACKUP):
-    try:
-        df_old = pd.read_csv(OLD_BACKUP)
-        original_old_wallets = set(str(w).strip().lower() for w in df_old['wallet'].tolist())
-        
-        old_wallets = [w for w in original_old_wallets if w not in processed_wallets]
-        
-        print(f"📁 Found {len(old_wallets)} wallets in old backup (after skipping processed)")
-        
-        if old_wallets:
-            print(f"\n🔄 Phase 1: Re-fetching {len(old_wallets)} wallets with ATH...")
-            # Process old wallets
-            with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-                list(ex.map(process_wallet, old_wallets))
-                
-            # Flush remaining results from Phase 1
-            with results_lock:
-                if results:
-                    upload_to_dune(results)
-                    pd.DataFrame(results).to_csv(NEW_BACKUP, mode='a', header=not os.path.exists(NEW_BACKUP), index=False)
-                    results.clear()
-            print(f"✅ Phase 1 complete!")
-        else:
-            print("✅ Phase 1 already complete (all wallets processed).")
-            
-    except Exception as e:
-        print(f"⚠️ Error reading/processing old backup: {e}")
-else:
-    print("📁 No old backup found. Starting fresh...")
+    def close(self):
+        """Flush what's left and wait for the uploader to drain."""
+        self.flush()
+        self.uploader.close()
+
+def load_wallets(input_file=INPUT_FILE):
+    df_all = read_table(input_file)
+    # Ensure we get the 'wallet' column if it exists, otherwise assume first column if no header
+    if 'wallet' in df_all.columns:
+        all_wallets = [str(w).strip().lower() for w in df_all['wallet'].tolist()]
+    else:
+        all_wallets = [str(w).strip().lower() for w in df_all.iloc[:, 0].tolist()]
+
+    # Filter out header 'wallet' if present in data (just in case)
+    return [w for w in all_wallets if w != 'wallet']
+
+def run(wallets, shard=0, num_shards=1, output_file=NEW_BACKUP, old_backup=OLD_BACKUP, upload=True, session=None):
+    """
+    Fetch portfolios for this process's shard of `wallets` and append them to its segment file.
+    `session` is the pipeline's shared HTTP session (None uses this process's own).
+    Returns the segment path.
+    """
+    global http, limiter, retry_budget, uploaded_count
+    if not SIM_API_KEY or (upload and not DUNE_API_KEY):
+        raise ValueError("Please set SIM_API_KEY and DUNE_API_KEY in .env file")
+
+    # Fresh rate control and counters, so an earlier in-process call's state doesn't carry over
+    http = session or get_session()
+    limiter = AIMDLimiter(initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_WORKERS, latency_target=LATENCY_TARGET)
+    retry_budget = RetryBudget()
+    uploaded_count = 0
+
+    print(f"🚀 Starting ATH Portfolio Fetcher (shard {shard}/{num_shards})...")
+
+    # Normalise once: the queue key, the fetched row and the resume index all use this string
+    all_wallets = select_shard(normalize_wallets(wallets).dropna().tolist(), shard, num_shards)
+    output_file = segment_path(output_file, shard, num_shards)
+    print(f"📊 Total unique input wallets: {len(set(all_wallets))} -> {output_file}")
+
+    # Filter (Removed per user request)
+    # if 'tx_count' in df.columns:
+    #     df = df[(df['tx_count'] > 0) & (df['tx_count'] <= 20000)]
+
+    # Load already processed wallets from current run/backup
+    processed_wallets = ProcessedIndex(output_file).load()
+    if len(processed_wallets):
+        print(f"⏩ Found {len(processed_wallets)} already processed in {output_file}. Skipping them.")
+
+    # Per-wallet status / attempts / last error for this segment (see work_queue)
+    work_queue = WorkQueue(output_file)
+    writer = PortfolioWriter(output_file, processed_wallets, work_queue, upload=upload)
+    old_wallets = []
+
+    if old_backup and os.path.exists(old_backup):
+        try:
+            df_old = pd.read_csv(old_backup)
+            old_wallets = select_shard(normalize_wallets(df_old['wallet']).dropna().tolist(), shard, num_shards)
+            print(f"📁 Found {len(old_wallets)} wallets in old backup; re-fetching them first with ATH")
+        except Exception as e:
+            print(f"⚠️ Error reading old backup: {e}")
+    else:
+        print("📁 No old backup found. Starting fresh...")
+
+    # Old-backup wallets first, then the rest of the input; the queue claims them in this order
+    remaining = work_queue.sync(list(dict.fromkeys([*old_wallets, *all_wallets])), processed_wallets)
+    print(f"\n🚀 Processing {remaining} remaining wallets...")
+
+    for _ in work_queue.process(writer.process_wallet, MAX_WORKERS):
+        pass
 
-# Phase 2: Remaining
-# Identify remaining wallets from ALL inputs that are not processed and not in old backup (already handled)
-remaining = [w for w in all_wallets if w not in processed_wallets and w not in original_old_wallets]
+    # Flush final results and wait for the uploader
+    writer.close()
+    compact(output_file)
+    work_queue.finish() # raises if any wallet is left undone
 
-print(f"\n🚀 Phase 2: Processing {len(remaining)} remaining wallets...")
+    print(f"\n✅ DONE! Total uploaded: {uploaded_count}")
+    return output_file
 
-processed_count = 0
-with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-    list(ex.map(process_wallet, remaining))
+def main():
+    parser = argparse.ArgumentParser(description="Fetch SIM portfolio / ATH values")
+    parser.add_argument("--shard", default="0/1", help="Process shard i of N, e.g. 2/8")
+    args = parser.parse_args()
 
-# Flush final results
-with results_lock:
-    if results:
-        upload_to_dune(results)
-        pd.DataFrame(results).to_csv(NEW_BACKUP, mode='a', header=not os.path.exists(NEW_BACKUP), index=False)
+    shard, num_shards = parse_shard(args.shard)
+    run(load_wallets(INPUT_FILE), shard=shard, num_shards=num_shards)
 
-print(f"\n✅ DONE! Total uploaded: {uploaded_count}")
+if __name__ == "__main__":
+    main()
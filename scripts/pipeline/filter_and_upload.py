@@ -1,7 +1,13 @@
+import numpy as np
 import pandas as pd
 import requests
 import time
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import read_keyed
+from wallet_ids import get_dictionary
 
 # Try to load env vars
 try:
@@ -29,7 +35,7 @@ TX_FILE = "data/intermediate/wallet_tx_counts.csv"
 ALCHEMY_FILE = "data/intermediate/alchemy_eth_balances.csv"
 SIM_FILE = "data/intermediate/wallet_portfolio_ath_backup.csv"
 
-def upload_table(df, table_name, schema):
+def upload_table(df, table_name, schema, wallets=None):
     print(f"\n🚀 Processing {table_name} ({len(df)} rows)...")
     
     # 1. Delete Old
@@ -60,6 +66,9 @@ def upload_table(df, table_name, schema):
     url = f"https://api.dune.com/api/v1/table/{DUNE_NAMESPACE}/{table_name}/insert"
     
     for i, chunk in enumerate(chunks):
+        if 'wallet_id' in chunk.columns:
+            # Addresses are built one upload chunk at a time, never for the whole table
+            chunk = chunk.assign(wallet_address=wallets.to_addresses(chunk['wallet_id']))[[c["name"] for c in schema]]
         csv_data = chunk.to_csv(index=False)
         for attempt in range(3):
             try:
@@ -82,55 +91,49 @@ def main():
     
     # 1. Load Filter Data (Transaction Counts)
     print("📖 Loading transaction counts...")
-    df_tx = pd.read_csv(TX_FILE)
-    df_tx['wallet'] = df_tx['wallet'].astype(str).str.lower().str.strip()
+    df_tx = read_keyed(TX_FILE, ['tx_count'])
+    wallets = get_dictionary()
     
-    # Define Valid Wallets (0 < tx <= 20000)
-    valid_wallets = set(df_tx[
+    # Define Valid Wallets (0 < tx <= 20000), as integer wallet ids
+    valid_ids = np.unique(df_tx.loc[
         (df_tx['tx_count'] > 0) & 
-        (df_tx['tx_count'] <= 20000)
-    ]['wallet'])
+        (df_tx['tx_count'] <= 20000),
+        'wallet_id'
+    ].to_numpy())
     
     print(f"📊 Filtering Criteria:")
     print(f"   - Original Count: {len(df_tx)}")
-    print(f"   - Valid Retail Count: {len(valid_wallets)}")
-    print(f"   - Removed: {len(df_tx) - len(valid_wallets)} (Inactive or Bots)")
+    print(f"   - Valid Retail Count: {len(valid_ids)}")
+    print(f"   - Removed: {len(df_tx) - len(valid_ids)} (Inactive or Bots)")
 
     # ---------------------------------------------------------
     # 2. Prepare & Upload: Alchemy Balances
     # ---------------------------------------------------------
     print("\n🔹 Preparing Alchemy Data...")
-    df_alchemy = pd.read_csv(ALCHEMY_FILE)
-    df_alchemy['wallet'] = df_alchemy['wallet'].astype(str).str.lower().str.strip()
+    df_alchemy = read_keyed(ALCHEMY_FILE, ['alchemy_eth_balance'])
     
     # Filter
-    df_alchemy_clean = df_alchemy[df_alchemy['wallet'].isin(valid_wallets)].copy()
-    df_alchemy_clean.columns = ['wallet_address', 'alchemy_eth_balance'] # Rename for Dune
+    df_alchemy_clean = df_alchemy[np.isin(df_alchemy['wallet_id'], valid_ids)]
     
     upload_table(
         df_alchemy_clean, 
         "dataset_alchemy_balances",
-        [{"name": "wallet_address", "type": "varchar"}, {"name": "alchemy_eth_balance", "type": "double"}]
+        [{"name": "wallet_address", "type": "varchar"}, {"name": "alchemy_eth_balance", "type": "double"}],
+        wallets
     )
 
     # ---------------------------------------------------------
     # 3. Prepare & Upload: SIM Portfolio
     # ---------------------------------------------------------
     print("\n🔹 Preparing SIM Portfolio Data...")
-    df_sim = pd.read_csv(SIM_FILE)
-    df_sim['wallet'] = df_sim['wallet'].astype(str).str.lower().str.strip()
+    df_sim = read_keyed(SIM_FILE, ['present_value_usd', 'ath_value_usd', 'token_count', 'top_tokens'])
     
     # Filter
-    df_sim_clean = df_sim[df_sim['wallet'].isin(valid_wallets)].copy()
+    df_sim_clean = df_sim[np.isin(df_sim['wallet_id'], valid_ids)]
     
-    # Rename cols for Dune
-    df_sim_clean_upload = df_sim_clean.rename(columns={
-        'wallet': 'wallet_address',
-        'present_value_usd': 'present_value_usd',
-        'ath_value_usd': 'ath_value_usd',
-        'token_count': 'token_count',
-        'top_tokens': 'top_tokens'
-    })
+    # Per-chain breakdown columns stay local; only the table schema columns go up
+    # (wallet_address is filled in per upload chunk from wallet_id)
+    df_sim_clean_upload = df_sim_clean[['wallet_id', 'present_value_usd', 'ath_value_usd', 'token_count', 'top_tokens']]
     
     upload_table(
         df_sim_clean_upload, 
@@ -141,7 +144,8 @@ def main():
             {"name": "ath_value_usd", "type": "double"},
             {"name": "token_count", "type": "integer"},
             {"name": "top_tokens", "type": "varchar"}
-        ]
+        ],
+        wallets
     )
 
     # ---------------------------------------------------------
@@ -151,10 +155,10 @@ def main():
     
     # Merge Clean Datasets
     # Note: df_sim_clean and df_alchemy_clean are already filtered to the same set of valid wallets
-    # But let's merge on 'wallet' (using the pre-renamed dataframes for convenience)
+    # But let's merge on 'wallet_id' (using the pre-renamed dataframes for convenience)
     
     # Use original column names for merge
-    merged = pd.merge(df_sim_clean, df_alchemy, on="wallet", how="left")
+    merged = pd.merge(df_sim_clean, df_alchemy, on="wallet_id", how="left")
     merged['alchemy_eth_balance'] = merged['alchemy_eth_balance'].fillna(0.0)
     
     # Calc Values
@@ -164,7 +168,7 @@ def main():
     
     # Select Final Cols
     final_df = merged[[
-        'wallet',
+        'wallet_id',
         'alchemy_present_value_usd',
         'alchemy_ath_value_usd',
         'present_value_usd',
@@ -173,7 +177,7 @@ def main():
     ]]
     
     final_df.columns = [
-        'wallet_address',
+        'wallet_id',
         'alchemy_current_wallet_value',
         'alchemy_ath_wallet_value',
         'sim_current_wallet_value',
@@ -195,7 +199,8 @@ def main():
             {"name": "sim_current_wallet_value", "type": "double"},
             {"name": "sim_ath_wallet_value", "type": "double"},
             {"name": "top_tokens_held", "type": "varchar"}
-        ]
+        ],
+        wallets
     )
 
     # ---------------------------------------------------------
@@ -203,12 +208,13 @@ def main():
     # ---------------------------------------------------------
     print("\n🔹 Preparing User List...")
     # Just the wallet addresses
-    users_df = pd.DataFrame(list(valid_wallets), columns=['wallet_address'])
+    users_df = pd.DataFrame({'wallet_id': valid_ids})
     
     upload_table(
         users_df,
         "dataset_orbt_users",
-        [{"name": "wallet_address", "type": "varchar"}]
+        [{"name": "wallet_address", "type": "varchar"}],
+        wallets
     )
 
     print("\n🎉 ALL TASKS COMPLETE! All Dune tables are now optimized and clean.")
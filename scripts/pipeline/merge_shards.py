@@ -0,0 +1,102 @@
+"""
+Combine per-shard fetcher segments into the intermediates consolidation reads.
+
+Each worker of a multi-node fetch (`--shard i/N` on the fetchers or on
+run_full_delta_pipeline.py) writes segment files such as
+
+    data/intermediate/wallet_ages_delta.shard-002-of-008.csv
+
+Copy every worker's segments into data/intermediate/, then run this on one
+machine. It checks that all N segments exist, and that each segment holds only
+wallets that hash to its shard. It then appends the rows to the main
+intermediate. Wallets already in the intermediate keep their row, so rerunning
+the merge is safe. wallet_id values are local to the machine that wrote them,
+so they are dropped and reassigned from this machine's wallet dictionary.
+
+    python3 scripts/pipeline/merge_shards.py --shards 8 [--delta]
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import append_rows, compact, exists, read_table
+from processed_index import ProcessedIndex
+from sharding import segment_path, shard_of
+
+MODES = {
+    "full": {
+        "cohort": "data/input/final_active_wallets.csv",
+        "outputs": [
+            "data/intermediate/wallet_tx_counts.csv",
+            "data/intermediate/wallet_ages.csv",
+            "data/intermediate/alchemy_eth_balances.csv",
+            "data/intermediate/wallet_volumes.csv",
+            "data/intermediate/wallet_gas_fees.csv",
+            "data/intermediate/wallet_portfolio_ath_backup.csv",
+        ],
+    },
+    "delta": {
+        "cohort": "data/input/delta_wallets.csv",
+        "outputs": [
+            "data/intermediate/wallet_tx_counts_delta.csv",
+            "data/intermediate/wallet_ages_delta.csv",
+            "data/intermediate/alchemy_eth_balances_delta.csv",
+            "data/intermediate/wallet_volumes_delta.csv",
+            "data/intermediate/wallet_gas_fees_delta.csv",
+            "data/intermediate/wallet_portfolio_ath_delta.csv",
+        ],
+    },
+}
+
+def segments(output_file, num_shards):
+    return [segment_path(output_file, shard, num_shards) for shard in range(num_shards)]
+
+def merge_segments(output_file, num_shards):
+    """Append every shard's new rows to output_file. Returns the number of rows added."""
+    paths = segments(output_file, num_shards)
+    missing = [p for p in paths if not exists(p)]
+    if missing:
+        raise FileNotFoundError(f"{len(missing)} of {num_shards} segments missing for {output_file}: {missing}")
+
+    index = ProcessedIndex(output_file).load()
+    added = 0
+    for shard, path in enumerate(paths):
+        df = read_table(path).drop(columns=['wallet_id'], errors='ignore')
+        misplaced = sum(shard_of(w, num_shards) != shard for w in df['wallet'])
+        if misplaced:
+            raise ValueError(f"{path} holds {misplaced} wallets of other shards (written with a different shard count?)")
+        df = df.drop_duplicates(subset=['wallet'], keep='last')
+        df = df[[w not in index for w in df['wallet']]]
+        if df.empty:
+            continue
+        append_rows(output_file, df)
+        index.add_many(df['wallet'])
+        added += len(df)
+    compact(output_file)
+    return added
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge per-shard fetcher segments")
+    parser.add_argument("--shards", type=int, required=True, help="Shard count N the workers ran with")
+    parser.add_argument("--delta", action="store_true", help="Merge the delta intermediates")
+    args = parser.parse_args(argv)
+    mode = MODES["delta" if args.delta else "full"]
+
+    cohort = None
+    if exists(mode["cohort"]):
+        cohort = read_table(mode["cohort"], columns=['wallet'])['wallet'].astype(str).str.strip().str.lower().unique()
+
+    for output_file in mode["outputs"]:
+        print(f"🧩 Merging {args.shards} segments into {output_file}...")
+        added = merge_segments(output_file, args.shards)
+        print(f"   Added {added} rows.")
+        if cohort is not None:
+            index = ProcessedIndex(output_file).load()
+            uncovered = sum(w not in index for w in cohort)
+            if uncovered:
+                print(f"   ⚠️ {uncovered} of {len(cohort)} cohort wallets have no row (failed on their shard; rerun that worker)")
+    print("✅ Shards merged.")
+
+if __name__ == "__main__":
+    main()
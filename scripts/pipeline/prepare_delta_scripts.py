@@ -6,12 +6,8 @@ scripts = {
         "data/input/final_active_wallets.csv": "data/input/delta_wallets.csv",
         "data/intermediate/wallet_ages.csv": "data/intermediate/wallet_ages_delta.csv"
     }),
-    "wallet_portfolio_ath_fetcher.py": ("wallet_portfolio_ath_fetcher_delta.py", {
-        "data/input/final_active_wallets.csv": "data/input/delta_wallets.csv",
-        "data/intermediate/wallet_portfolio_ath_backup.csv": "data/intermediate/wallet_portfolio_ath_delta.csv",
-        "wallet_portfolio_backup.csv": "wallet_portfolio_backup_delta.csv",
-        "upload_to_dune": "# upload_to_dune" # Disable intermediate uploads
-    }),
+    # wallet_portfolio_ath_fetcher_delta.py is a thin wrapper around
+    # wallet_portfolio_ath_fetcher.run() and is no longer generated here.
     "fetch_volumes.py": ("fetch_volumes_delta.py", {
         "data/input/final_active_wallets.csv": "data/input/delta_wallets.csv",
         "data/intermediate/wallet_volumes.csv": "data/intermediate/wallet_volumes_delta.csv"
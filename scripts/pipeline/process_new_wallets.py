@@ -3,8 +3,14 @@ import pandas as pd
 import time
 import concurrent.futures
 import os
+import sys
 from threading import Lock
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import append_rows, exists, read_table
+from processed_index import ProcessedIndex
+from snapshot import block_tag
+
 # Try to load env vars
 try:
     from dotenv import load_dotenv
@@ -42,7 +48,7 @@ def get_tx_counts_batch(wallets):
             "jsonrpc": "2.0",
             "id": i,
             "method": "eth_getTransactionCount",
-            "params": [wallet, "latest"]
+            "params": [wallet, block_tag()]
         })
     
     for attempt in range(3):
@@ -102,8 +108,8 @@ def main():
     
     # 2. Load Existing TX Counts
     existing_wallets = set()
-    if os.path.exists(TX_FILE):
-        df_tx = pd.read_csv(TX_FILE)
+    if exists(TX_FILE):
+        df_tx = read_table(TX_FILE, columns=['wallet'])
         existing_wallets = set(df_tx['wallet'].astype(str).str.lower().str.strip())
         print(f"✅ Loaded {len(existing_wallets)} existing wallets with tx counts.")
     
@@ -122,13 +128,14 @@ def main():
         # Append to TX File
         if results:
             df_new = pd.DataFrame(results)
-            header = not os.path.exists(TX_FILE)
-            df_new.to_csv(TX_FILE, mode='a', header=header, index=False)
+            append_rows(TX_FILE, df_new)
+            # Keep fetch_tx_counts' resume index in step with the rows added here
+            ProcessedIndex(TX_FILE).load().add_many(df_new['wallet'])
             print(f"💾 Added {len(df_new)} new wallets to {TX_FILE}")
             
     # 5. Create Final Active List
     print("🧹 Creating Final Active List...")
-    df_final = pd.read_csv(TX_FILE)
+    df_final = read_table(TX_FILE)
     df_final['wallet'] = df_final['wallet'].astype(str).str.lower().str.strip()
     
     # Filter: Keep ALL wallets (removed all filters per user request)
@@ -1,26 +1,108 @@
+import argparse
+import importlib
+import runpy
 import subprocess
 import pandas as pd
 import sys
 import os
+import time
+from functools import partial
 
-def run_script(script_name):
-    print(f"\n🚀 Running {script_name}...")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import exists, read_table
+from dag import Stage, run_dag
+from http_client import get_session, print_request_stats
+from manifest import ManifestStore
+from sharding import parse_shard, segment_path
+from snapshot import SNAPSHOT_ENV, get_snapshot_cache, resolve_snapshot
+from wallet_ids import normalize_wallets
+
+# Try to load env vars
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+ALCHEMY_RPC_URL = f"https://eth-mainnet.g.alchemy.com/v2/{os.getenv('ALCHEMY_API_KEY')}"
+
+# Concurrent requests allowed per API across all stages running at once.
+# A stage's cost is its fetcher's MAX_WORKERS.
+API_BUDGETS = {"alchemy": 20, "sim": 1, "dune": 1}
+
+COHORT_FILE = "data/input/delta_wallets.csv"
+TX_COUNTS_FILE = "data/intermediate/wallet_tx_counts_delta.csv"
+METRIC_FILES = {
+    "wallet_age": "data/intermediate/wallet_ages_delta.csv",
+    "alchemy_balances": "data/intermediate/alchemy_eth_balances_delta.csv",
+    "volumes": "data/intermediate/wallet_volumes_delta.csv",
+    "gas_fees": "data/intermediate/wallet_gas_fees_delta.csv",
+    "portfolio": "data/intermediate/wallet_portfolio_ath_delta.csv",
+}
+DELTA_OUTPUT_FILE = "data/output/final_wallet_data_delta.csv"
+# Shared modules every fetcher runs on; part of each fetch stage's code fingerprint
+FETCHER_LIBS = [f"scripts/common/{name}.py" for name in
+                ("columnar", "wallet_ids", "http_client", "processed_index", "work_queue", "sharding", "snapshot")]
+MERGE_SHARDS_SCRIPT = "scripts/pipeline/merge_shards.py"
+
+def run_script(script_name, *args):
+    # Raises CalledProcessError on failure; the scheduler reports it and skips dependents
+    subprocess.run(["python3", script_name, *args], check=True)
+
+# In-process mode: stages share this interpreter, so pandas is imported once
+# and the cohort is parsed once. The HTTP session (http_client) and snapshot
+# cache are created here and passed to every fetcher explicitly; each fetcher
+# resets its own per-run state (buffers, counters, rate limiters) on entry.
+
+def load_cohort(path=COHORT_FILE):
+    """The delta cohort, read and normalised once for every in-process stage."""
+    wallets = normalize_wallets(read_table(path, columns=['wallet'])['wallet']).dropna()
+    return list(dict.fromkeys(wallets))
+
+def _exit_to_error(script_name, e):
+    if e.code not in (None, 0):
+        raise RuntimeError(f"{script_name} exited with status {e.code}") from e
+
+def call_entry(script_name, entry, *args):
+    """Import a pipeline script (once per process) and call one of its functions."""
+    directory, module_name = os.path.split(os.path.splitext(script_name)[0])
+    if directory not in sys.path:
+        sys.path.append(directory)
     try:
-        subprocess.run(["python3", script_name], check=True)
-        print(f"✅ {script_name} completed.")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {script_name} failed with error {e}")
-        sys.exit(1)
+        getattr(importlib.import_module(module_name), entry)(*args)
+    except SystemExit as e:
+        _exit_to_error(script_name, e)
+
+def run_path(script_name):
+    """Execute a top-level script (no entry point) in this process."""
+    try:
+        runpy.run_path(script_name)
+    except SystemExit as e:
+        _exit_to_error(script_name, e)
+
+def stage_runner(in_process):
+    """
+    step(script, entry, *args, cli=[...]) -> callable for a Stage: a subprocess
+    given `cli` as its arguments, or the entry point called in-process with `args`.
+    """
+    def step(script_name, entry=None, *args, cli=()):
+        if not in_process:
+            return partial(run_script, script_name, *cli)
+        if entry is None:
+            return partial(run_path, script_name)
+        return partial(call_entry, script_name, entry, *args)
+    return step
 
 def merge_tx_counts():
     print("\n🔄 Merging tx counts into delta_wallets.csv...")
     try:
-        if not os.path.exists("data/intermediate/wallet_tx_counts_delta.csv"):
+        if not exists("data/intermediate/wallet_tx_counts_delta.csv"):
             print("⚠️ wallet_tx_counts_delta.csv not found, skipping merge.")
             return
 
         df_wallets = pd.read_csv("data/input/delta_wallets.csv")
-        df_tx = pd.read_csv("data/intermediate/wallet_tx_counts_delta.csv")
+        df_wallets = df_wallets.drop(columns=['tx_count'], errors='ignore') # re-merging replaces earlier counts
+        df_tx = read_table("data/intermediate/wallet_tx_counts_delta.csv")
         
         # Clean columns
         df_wallets['wallet'] = df_wallets['wallet'].astype(str).str.lower().str.strip()
@@ -45,23 +127,103 @@ def merge_tx_counts():
         print(f"⚠️ Failed to merge tx counts: {e}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the full delta pipeline")
+    parser.add_argument("--in-process", action="store_true", help="Run every stage in this process instead of one python3 per stage")
+    parser.add_argument("--force", action="store_true", help="Rerun every stage even if its inputs and code are unchanged")
+    parser.add_argument("--shard", default="0/1", help="Worker i of N: run only the fetchers, on hash shard i, into segment files")
+    parser.add_argument("--merge-shards", type=int, metavar="N", help="Merge N workers' segments instead of fetching, then consolidate and upload")
+    args = parser.parse_args()
+    shard, num_shards = parse_shard(args.shard)
+    if num_shards > 1 and args.merge_shards:
+        parser.error("--shard and --merge-shards are separate runs (workers, then the coordinator)")
+
     print("🌟 STARTING FULL DELTA PIPELINE 🌟")
+
+    # 0. Pin one block for every state read (inherited by all child scripts).
+    # Set ORBT_SNAPSHOT_BLOCK yourself to replay an earlier snapshot from cache.
+    if num_shards > 1 and not os.getenv(SNAPSHOT_ENV):
+        print(f"⚠️ {SNAPSHOT_ENV} is not set; give every worker the same block so the shards read one consistent state.")
+    snapshot_block = resolve_snapshot(ALCHEMY_RPC_URL)
+    print(f"📌 Snapshot block: {snapshot_block}")
     
-    # 1. Fetch TX Counts first (needed for base file)
-    run_script("scripts/fetchers/fetch_tx_counts_delta.py")
-    merge_tx_counts()
-    
-    # 2. Fetch other metrics
-    run_script("scripts/fetchers/fetch_wallet_age_delta.py")
-    run_script("scripts/fetchers/fetch_alchemy_balances_delta.py")
-    run_script("scripts/fetchers/fetch_volumes_delta.py")
-    run_script("scripts/fetchers/fetch_gas_fees_delta.py")
-    run_script("scripts/fetchers/wallet_portfolio_ath_fetcher_delta.py")
-    
-    # 3. Consolidate
-    run_script("scripts/consolidation/create_consolidated_table_delta.py")
-    
-    # 4. Upload
-    run_script("scripts/upload/upload_delta.py")
+    step = stage_runner(args.in_process)
+    cohort = session = snapshot = None
+    if args.in_process:
+        cohort = load_cohort()
+        session, snapshot = get_session(), get_snapshot_cache()
+        print(f"👥 Cohort: {len(cohort)} wallets, shared by every stage")
+
+    # Stages run as soon as their dependencies finish, within API_BUDGETS.
+    # Only tx counts must come first: the other fetchers read the cohort file it updates.
+    # A stage is skipped when its inputs, code and outputs match its last successful run
+    # (data/state/manifests/); fetchers are keyed on the cohort, snapshot block and
+    # shard, so iterating on consolidation or upload never triggers fetch work.
+    #
+    # Multi-node: each worker runs `--shard i/N`, which fetches its hash shard into
+    # segment files and stops there (no cohort update, no consolidation). Once the
+    # segments are copied to one machine, `--merge-shards N` merges them and carries on.
+    shard_cli = ["--shard", args.shard] if num_shards > 1 else []
+    fetch_deps = [] if num_shards > 1 else ["merge_tx_counts"]
+    fetch_params = {"snapshot_block": snapshot_block, "shard": [shard, num_shards]}
+
+    def fetcher(name, script, entry="main", code=(), **kwargs):
+        return Stage(name, step(script, entry, cohort, shard, num_shards, session, snapshot, cli=shard_cli), deps=fetch_deps,
+                     inputs=[COHORT_FILE], outputs=[segment_path(METRIC_FILES[name], shard, num_shards)],
+                     code=[script, *code, *FETCHER_LIBS], params=fetch_params, **kwargs)
+
+    fetch_stages = [
+        # 1. Fetch TX Counts first (needed for base file)
+        Stage("tx_counts", step("scripts/fetchers/fetch_tx_counts_delta.py", "main", cohort, shard, num_shards, session, snapshot, cli=shard_cli),
+              api="alchemy", cost=10, inputs=[COHORT_FILE], outputs=[segment_path(TX_COUNTS_FILE, shard, num_shards)],
+              code=["scripts/fetchers/fetch_tx_counts_delta.py", *FETCHER_LIBS], params=fetch_params),
+
+        # 2. Fetch other metrics (concurrently)
+        fetcher("wallet_age", "scripts/fetchers/fetch_wallet_age_delta.py", api="alchemy", cost=10),
+        fetcher("alchemy_balances", "scripts/fetchers/fetch_alchemy_balances_delta.py", api="alchemy", cost=5),
+        fetcher("volumes", "scripts/fetchers/fetch_volumes_delta.py", api="alchemy", cost=5),
+        fetcher("gas_fees", "scripts/fetchers/fetch_gas_fees_delta.py", api="alchemy", cost=5),
+        fetcher("portfolio", "scripts/fetchers/wallet_portfolio_ath_fetcher_delta.py", "run_delta",
+                code=["scripts/fetchers/wallet_portfolio_ath_fetcher.py", "scripts/common/rate_control.py"], api="sim"),
+    ]
+
+    if args.merge_shards:
+        merge_argv = ["--delta", "--shards", str(args.merge_shards)]
+        intermediates = [TX_COUNTS_FILE, *METRIC_FILES.values()]
+        stages = [Stage("merge_shards", step(MERGE_SHARDS_SCRIPT, "main", merge_argv, cli=merge_argv),
+                        inputs=[segment_path(path, k, args.merge_shards) for path in intermediates for k in range(args.merge_shards)],
+                        outputs=intermediates, code=[MERGE_SHARDS_SCRIPT])]
+        tx_deps = metric_deps = ["merge_shards"]
+    else:
+        stages = fetch_stages
+        tx_deps, metric_deps = ["tx_counts"], list(METRIC_FILES)
+
+    if num_shards == 1:
+        stages += [
+            Stage("merge_tx_counts", merge_tx_counts, deps=tx_deps,
+                  inputs=[COHORT_FILE, TX_COUNTS_FILE], outputs=[COHORT_FILE], code=["scripts/pipeline/run_full_delta_pipeline.py"]),
+
+            # 3. Consolidate
+            Stage("consolidate", step("scripts/consolidation/create_consolidated_table_delta.py"), deps=[*metric_deps, "merge_tx_counts"],
+                  inputs=[COHORT_FILE, *METRIC_FILES.values()], outputs=[DELTA_OUTPUT_FILE],
+                  code=["scripts/consolidation/create_consolidated_table_delta.py", "scripts/common/final_table.py", "scripts/common/merge_join.py",
+                        "scripts/common/columnar.py", "scripts/common/wallet_ids.py"]),
+            # Fold into the master, touching only affected partitions
+            Stage("upsert_master", step("scripts/consolidation/upsert_delta.py", "main", []), deps=["consolidate"],
+                  inputs=[DELTA_OUTPUT_FILE], outputs=["data/output/master"],
+                  code=["scripts/consolidation/upsert_delta.py", "scripts/common/master_dataset.py"]),
+
+            # 4. Upload (alongside the upsert; both only read the consolidated delta).
+            # Memoized too, so an unchanged delta is never inserted into Dune twice.
+            Stage("upload", step("scripts/upload/upload_delta.py", "upload_to_dune", DELTA_OUTPUT_FILE), deps=["consolidate"], api="dune",
+                  inputs=[DELTA_OUTPUT_FILE], code=["scripts/upload/upload_delta.py", "scripts/common/http_client.py", "scripts/common/rate_control.py"]),
+        ]
+
+    start = time.time()
+    failed = run_dag(stages, API_BUDGETS, manifests=ManifestStore(), force=args.force)
+    if args.in_process:
+        print_request_stats()
+    if failed:
+        print(f"\n❌ Pipeline finished with failures after {time.time() - start:.0f}s: {', '.join(failed)}")
+        sys.exit(1)
     
-    print("\n🎉 PIPELINE COMPLETE! 🎉")
+    print(f"\n🎉 PIPELINE COMPLETE! 🎉 ({time.time() - start:.0f}s)")
@@ -1,9 +1,18 @@
+import argparse
+import glob
+import hashlib
+import json
 import pandas as pd
 import requests
 import os
+import sys
 import time
 import io
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from http_client import get_session
+from rate_control import backoff_delay
+
 # Try to load env vars
 try:
     from dotenv import load_dotenv
@@ -19,31 +28,34 @@ if not DUNE_API_KEY:
 DUNE_NAMESPACE = "orbt_official"
 DUNE_TABLE_NAME = "orbt_wallet_final_v2"
 INPUT_FILE = "data/output/final_wallet_data_delta.csv" # Consolidated delta file
+BATCH_SIZE = 20000 # Dune supports larger CSV batches than JSON
+MAX_RETRIES = 5 # Per batch, for 429 / 5xx / connection errors
+PROGRESS_DIR = "data/state/upload_progress" # Batches already inserted, per input, for resuming a failed upload
+
+# Define the exact schema columns required by the Dune table
+REQUIRED_COLUMNS = [
+    'wallet_address',
+    'tx_count',
+    'wallet_age_days',
+    'first_seen_date',
+    'gas_fees_usd',
+    'total_dex_volume_usd',
+    'total_cex_volume_usd',
+    'total_lending_volume_usd',
+    'alchemy_current_wallet_value',
+    'sim_current_wallet_value',
+    'sim_ath_wallet_value',
+    'top_tokens_held'
+]
 
-def upload_to_dune(csv_path):
-    print(f"Reading {csv_path}...")
-    try:
-        df_input = pd.read_csv(csv_path)
-    except FileNotFoundError:
-        print(f"Error: {csv_path} not found. Did you run create_consolidated_table_delta.py?")
-        return
-
-    # Define the exact schema columns required by the Dune table
-    required_columns = [
-        'wallet_address',
-        'tx_count',
-        'wallet_age_days',
-        'first_seen_date',
-        'gas_fees_usd',
-        'total_dex_volume_usd',
-        'total_cex_volume_usd',
-        'total_lending_volume_usd',
-        'alchemy_current_wallet_value',
-        'sim_current_wallet_value',
-        'sim_ath_wallet_value',
-        'top_tokens_held'
-    ]
+def input_files(csv_path, shards=False):
+    """The consolidated file, or its shard segments (written by consolidate_sharded.py)."""
+    if not shards:
+        return [csv_path]
+    base, ext = os.path.splitext(csv_path)
+    return sorted(glob.glob(f"{base}.shard-*{ext}"))
 
+def prepare(df_input):
     # Prepare the DataFrame
     df_upload = df_input.copy()
     
@@ -52,7 +64,7 @@ def upload_to_dune(csv_path):
         df_upload['wallet_address'] = df_upload['wallet']
     
     # Fill missing columns with defaults (if any)
-    for col in required_columns:
+    for col in REQUIRED_COLUMNS:
         if col not in df_upload.columns:
             if 'volume' in col or 'value' in col or 'fees' in col:
                 df_upload[col] = 0.0
@@ -62,10 +74,80 @@ def upload_to_dune(csv_path):
                 df_upload[col] = ""
 
     # Reorder to match schema exactly
-    df_upload = df_upload[required_columns]
+    return df_upload[REQUIRED_COLUMNS]
+
+def post_batch(url, headers, csv_data):
+    """POST one CSV batch, retrying throttling / server errors with backoff. Raises unless Dune returns 200."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = get_session().post(url, headers=headers, data=csv_data, timeout=120)
+        except requests.RequestException as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if response.status_code == 200:
+                return
+            error = f"HTTP {response.status_code}: {response.text[:500]}"
+            if response.status_code != 429 and response.status_code < 500:
+                break  # rejected as sent; retrying won't help
+        if attempt < MAX_RETRIES:
+            print(f"  -> {error}; retrying...")
+            time.sleep(backoff_delay(attempt, base=2.0, cap=60.0))
+    raise RuntimeError(f"Dune insert failed: {error}")
+
+def _input_digest(files):
+    """SHA-256 over the upload's input files and batch size; progress is only reused for identical input."""
+    digest = hashlib.sha256(str(BATCH_SIZE).encode())
+    for path in files:
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+class UploadProgress:
+    """
+    Which batches of an input are already in Dune, saved after every accepted
+    batch, so a rerun after a failure resumes instead of inserting them twice.
+    Tied to the input's content: a different file starts from scratch.
+    """
+
+    def __init__(self, csv_path, files):
+        self.path = os.path.join(PROGRESS_DIR, os.path.basename(csv_path) + ".json")
+        self.digest = _input_digest(files)
+        self.done = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            if saved.get("digest") == self.digest:
+                self.done = saved.get("batches", {})
+
+    def batches_done(self, path):
+        return self.done.get(os.path.basename(path), 0)
+
+    def mark(self, path, batches):
+        self.done[os.path.basename(path)] = batches
+        os.makedirs(PROGRESS_DIR, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"digest": self.digest, "batches": self.done}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def upload_to_dune(csv_path, shards=False):
+    """
+    Insert the consolidated delta into Dune. Exits with status 1 if the input is
+    missing and raises if a batch is not accepted, so the pipeline only records
+    the upload stage as done after every batch got a 200. Accepted batches are
+    recorded (UploadProgress), so a rerun on the same input skips them.
+    """
+    files = input_files(csv_path, shards)
+    if not files or not all(os.path.exists(f) for f in files):
+        print(f"Error: {csv_path} not found. Did you run create_consolidated_table_delta.py (or consolidate_sharded.py --delta)?")
+        sys.exit(1)
 
-    print(f"Prepared {len(df_upload)} records for upload.")
-    
     # API Endpoint
     url = f"https://api.dune.com/api/v1/table/{DUNE_NAMESPACE}/{DUNE_TABLE_NAME}/insert"
     headers = {
@@ -73,26 +155,44 @@ def upload_to_dune(csv_path):
         "Content-Type": "text/csv" # CRITICAL: Use CSV content type
     }
     
-    # Batch upload
-    BATCH_SIZE = 20000 # Dune supports larger CSV batches than JSON
-    
-    for i in range(0, len(df_upload), BATCH_SIZE):
-        batch_df = df_upload.iloc[i:i+BATCH_SIZE]
-        print(f"Uploading batch {i} to {i+len(batch_df)}...")
-        
-        # Convert batch to CSV string
-        csv_buffer = io.StringIO()
-        batch_df.to_csv(csv_buffer, index=False)
-        csv_data = csv_buffer.getvalue()
-        
-        response = requests.post(url, headers=headers, data=csv_data)
-        
-        if response.status_code == 200:
+    progress = UploadProgress(csv_path, files)
+
+    # Batch upload, streamed: only one batch is in memory at a time
+    uploaded = 0
+    for path in files:
+        print(f"Reading {path}...")
+        skip = progress.batches_done(path)
+        if skip:
+            print(f"  -> Resuming after {skip} batches already inserted by an earlier run")
+        for batch_no, batch_df in enumerate(pd.read_csv(path, chunksize=BATCH_SIZE)):
+            if batch_no < skip:
+                continue
+            batch_df = prepare(batch_df)
+            print(f"Uploading batch {uploaded} to {uploaded+len(batch_df)}...")
+            
+            # Convert batch to CSV string
+            csv_buffer = io.StringIO()
+            batch_df.to_csv(csv_buffer, index=False)
+            csv_data = csv_buffer.getvalue()
+            
+            try:
+                post_batch(url, headers, csv_data)
+            except RuntimeError:
+                if uploaded:
+                    print(f"  -> Stopped after {uploaded} records; earlier batches are already in Dune and a rerun resumes after them")
+                raise
             print("  -> Success")
-        else:
-            print(f"  -> Error {response.status_code}: {response.text}")
-        
-        time.sleep(1) # Rate limit safety
+            progress.mark(path, batch_no + 1)
+            uploaded += len(batch_df)
+            
+            time.sleep(1) # Rate limit safety
+
+    progress.clear() # complete; the pipeline's manifest now guards against re-uploading
+    print(f"Uploaded {uploaded} records.")
 
 if __name__ == "__main__":
-    upload_to_dune(INPUT_FILE)
+    parser = argparse.ArgumentParser(description="Upload the consolidated delta to Dune")
+    parser.add_argument("--input", default=INPUT_FILE, help="Consolidated CSV")
+    parser.add_argument("--shards", action="store_true", help="Upload the input's shard segments instead of the single file")
+    args = parser.parse_args()
+    upload_to_dune(args.input, args.shards)
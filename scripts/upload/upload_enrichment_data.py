@@ -2,6 +2,10 @@ import pandas as pd
 import requests
 import time
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import exists, read_table
 
 # Try to load env vars
 try:
@@ -83,8 +87,8 @@ def main():
     print("🧹 Starting Enrichment Upload Process...")
     
     # 1. Wallet Ages
-    if os.path.exists("data/intermediate/wallet_ages.csv"):
-        df_ages = pd.read_csv("data/intermediate/wallet_ages.csv")
+    if exists("data/intermediate/wallet_ages.csv"):
+        df_ages = read_table("data/intermediate/wallet_ages.csv", columns=['wallet', 'first_tx_timestamp', 'wallet_age_formatted', 'wallet_age_days'])
         schema_ages = [
             {"name": "wallet", "type": "varchar"},
             {"name": "first_tx_timestamp", "type": "varchar"}, # Keep as string for safety or timestamp
@@ -98,8 +102,8 @@ def main():
         print("⚠️  wallet_ages.csv not found.")
 
     # 2. Volumes (DEX, CEX, Lending)
-    if os.path.exists("data/intermediate/wallet_volumes.csv"):
-        df_vol = pd.read_csv("data/intermediate/wallet_volumes.csv")
+    if exists("data/intermediate/wallet_volumes.csv"):
+        df_vol = read_table("data/intermediate/wallet_volumes.csv")
         df_vol['wallet'] = df_vol['wallet'].astype(str).str.lower().str.strip()
         
         # DEX Table
@@ -135,8 +139,8 @@ def main():
         print("⚠️  wallet_volumes.csv not found.")
 
     # 3. Gas Fees
-    if os.path.exists("data/intermediate/wallet_gas_fees.csv"):
-        df_gas = pd.read_csv("data/intermediate/wallet_gas_fees.csv")
+    if exists("data/intermediate/wallet_gas_fees.csv"):
+        df_gas = read_table("data/intermediate/wallet_gas_fees.csv", columns=['wallet', 'gas_fees_usd', 'total_transactions_analyzed'])
         schema_gas = [
             {"name": "wallet", "type": "varchar"},
             {"name": "gas_fees_usd", "type": "double"},
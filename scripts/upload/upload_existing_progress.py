@@ -2,8 +2,12 @@ import pandas as pd
 import requests
 import time
 import os
+import sys
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import exists, read_table
+
 # Load env vars
 load_dotenv()
 DUNE_API_KEY = os.getenv("DUNE_API_KEY")
@@ -73,12 +77,13 @@ def upload_chunk(df_chunk, chunk_index, total_chunks):
     return False
 
 def main():
-    if not os.path.exists(INPUT_FILE):
+    if not exists(INPUT_FILE):
         print(f"❌ {INPUT_FILE} not found.")
         return
 
     print(f"📖 Reading {INPUT_FILE}...")
-    df = pd.read_csv(INPUT_FILE)
+    # Only the table schema columns (the fetcher also keeps per-chain breakdowns locally)
+    df = read_table(INPUT_FILE, columns=['wallet', 'present_value_usd', 'ath_value_usd', 'token_count', 'top_tokens'])
     print(f"📊 Total records to upload: {len(df)}")
     
     if clear_and_create_table():
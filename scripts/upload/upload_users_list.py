@@ -2,6 +2,10 @@ import pandas as pd
 import requests
 import time
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import exists, read_table
 
 # Try to load env vars
 try:
@@ -72,12 +76,12 @@ def upload_chunk(df_chunk, chunk_index, total_chunks):
 
 def main():
     print("📖 Loading processed wallet list...")
-    if not os.path.exists(INPUT_FILE):
+    if not exists(INPUT_FILE):
         print(f"❌ File {INPUT_FILE} not found.")
         return
 
     # Load verified clean list
-    df = pd.read_csv(INPUT_FILE)
+    df = read_table(INPUT_FILE, columns=['wallet'])
     
     # We only need the wallet column
     df = df[['wallet']].copy()
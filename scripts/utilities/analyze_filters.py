@@ -1,10 +1,15 @@
 import pandas as pd
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import read_table
 
 TX_FILE = "data/intermediate/wallet_tx_counts.csv"
 
 def main():
     print("📊 Analyzing Wallet Transaction Counts...")
-    df = pd.read_csv(TX_FILE)
+    df = read_table(TX_FILE, columns=['wallet', 'tx_count'])
     
     total = len(df)
     
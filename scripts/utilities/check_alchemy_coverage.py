@@ -1,5 +1,9 @@
 import pandas as pd
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import exists, read_table
 
 ALL_WALLETS_FILE = 'data/input/all_wallets.csv'
 ALCHEMY_OUTPUT_FILE = 'data/intermediate/alchemy_eth_balances.csv'
@@ -25,9 +29,9 @@ def main():
 
     # 2. Load Alchemy Processed Wallets
     processed_wallets = set()
-    if os.path.exists(ALCHEMY_OUTPUT_FILE):
+    if exists(ALCHEMY_OUTPUT_FILE):
         try:
-            df_alc = pd.read_csv(ALCHEMY_OUTPUT_FILE)
+            df_alc = read_table(ALCHEMY_OUTPUT_FILE, columns=['wallet'])
             processed_wallets = set(df_alc['wallet'].astype(str).str.strip().str.lower())
             print(f"✅ Total Unique Processed (Alchemy): {len(processed_wallets)}")
             
@@ -1,5 +1,9 @@
 import pandas as pd
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from columnar import exists, read_table, write_table
 
 ALL_WALLETS_FILE = 'data/input/all_wallets.csv'
 SIM_OUTPUT_FILE = 'data/intermediate/wallet_portfolio_ath_backup.csv'
@@ -25,34 +29,24 @@ def main():
 
     # 2. Load SIM Processed Wallets
     processed_wallets = set()
-    if os.path.exists(SIM_OUTPUT_FILE):
+    if exists(SIM_OUTPUT_FILE):
         try:
-            df_sim = pd.read_csv(SIM_OUTPUT_FILE, header=None)
-            # Assuming format: wallet, ... (wallet is 1st column)
+            df_sim = read_table(SIM_OUTPUT_FILE)
             processed_wallets = normalize_wallets(df_sim)
             print(f"✅ Total Unique Processed (SIM): {len(processed_wallets)}")
             
             # Deduplicate the SIM file while we are at it
-            if len(df_sim) > len(processed_wallets) + 1: # +1 for potential header
+            if len(df_sim) > len(processed_wallets):
                  print("🧹 Deduplicating SIM output file...")
                  # We need to keep the data associated with the wallet.
-                 # We'll drop duplicates based on the first column (normalized)
-                 
-                 # Create a temp column for normalized wallet
-                 df_sim['norm_wallet'] = df_sim.iloc[:, 0].astype(str).str.strip().str.lower()
+                 # We'll drop duplicates based on the normalized wallet
+                 norm_wallet = df_sim['wallet'].astype(str).str.strip().str.lower()
                  
                  # Drop duplicates keeping first
-                 df_sim_clean = df_sim.drop_duplicates(subset=['norm_wallet'])
-                 
-                 # Remove the 'wallet' row if it exists in data
-                 df_sim_clean = df_sim_clean[df_sim_clean['norm_wallet'] != 'wallet']
-                 
-                 # Remove temp col
-                 df_sim_clean = df_sim_clean.drop(columns=['norm_wallet'])
+                 df_sim_clean = df_sim[~norm_wallet.duplicated()]
                  
                  # Save back
-                 # Note: The original file had no header (header=None), so we save without header
-                 df_sim_clean.to_csv(SIM_OUTPUT_FILE, index=False, header=False)
+                 write_table(SIM_OUTPUT_FILE, df_sim_clean)
                  print(f"💾 Cleaned SIM file saved. Rows: {len(df_sim_clean)}")
                  
         except Exception as e: